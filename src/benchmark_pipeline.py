@@ -0,0 +1,150 @@
+"""
+Stage-by-stage benchmark of the pipeline on synthetic IDSC data.
+
+For every cohort size a synthetic dataset is generated with synthetic_idsc_data, then every stage
+(feature extraction of lab_data, medications and vasopressors, long covid and severe covid patient
+selection, time series matrix building, dataset composition by day range) runs in its own Python
+process pointed at the dataset through the data_paths environment variables. A stage reports its
+wall time and the peak resident memory of its process, so the stages do not share a memory high-water
+mark. The results are written to '<work_dir>/benchmark_results.csv'.
+
+    python benchmark_pipeline.py --work-dir /tmp/idsc_benchmark --patients 1000 10000 100000
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+import time
+import pandas as pd
+
+from synthetic_idsc_data import generate_idsc_dataset
+
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+## Stage name -> code run in the stage process, from the src directory
+STAGES = {
+    'extract_lab_data': "from template_2_extract_clinical_data import launcher_pipeline; launcher_pipeline('lab_data')",
+    'extract_medications': "from template_2_extract_clinical_data import launcher_pipeline; launcher_pipeline('medications')",
+    'extract_vasopressors': "from template_2_extract_clinical_data import launcher_pipeline; launcher_pipeline('vasopressors')",
+    'long_covid_selection': "import runpy; runpy.run_path('long_covid_patient_selection.py')",
+    'severe_covid_selection': "import runpy; runpy.run_path('severe_covid_patients_selection.py')",
+    'time_series_matrix': "from time_series_clinical_matrix import main; main()",
+    'dataset_composer': "import runpy; runpy.run_path('ts_dataset_composer_by_range.py')",
+}
+
+## Wraps the stage code with the measurements, reported on the last line of the output
+STAGE_WRAPPER = """
+import json, resource, sys, time
+start_time = time.perf_counter()
+{code}
+seconds = time.perf_counter() - start_time
+## ru_maxrss is in kilobytes on Linux and in bytes on macOS
+peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+print('BENCHMARK ' + json.dumps({{'seconds': seconds, 'peak_rss_mb': peak_rss_mb}}))
+"""
+
+
+def dataset_environment(dataset_dir):
+    """
+    Returns the environment pointing the data_paths roots at a synthetic dataset.
+
+    Args:
+        dataset_dir (str): Directory of the dataset, with the idsc/, patientomics/ and long_covid/ roots.
+
+    Returns:
+        dict: The environment of the stage processes.
+    """
+    env = dict(os.environ)
+    env['IDSC_DATA_DIR'] = os.path.join(dataset_dir, 'idsc')
+    env['PATIENTOMICS_DATA_DIR'] = os.path.join(dataset_dir, 'patientomics')
+    env['LONG_COVID_STUDY_DIR'] = os.path.join(dataset_dir, 'long_covid')
+    env['MPLBACKEND'] = 'Agg'
+    return env
+
+
+def run_stage(stage, dataset_dir, log_file, timeout=None):
+    """
+    Runs one stage in its own process.
+
+    Args:
+        stage (str): Name of the stage in STAGES.
+        dataset_dir (str): Directory of the dataset.
+        log_file (str): File receiving the output of the stage.
+        timeout (float): Seconds after which the stage is stopped.
+
+    Returns:
+        dict: The stage, its status ('ok', 'failed' or 'timeout'), wall time and peak RSS in MB.
+    """
+    result = {'stage': stage, 'status': 'ok', 'seconds': None, 'peak_rss_mb': None}
+    start_time = time.perf_counter()
+    with open(log_file, 'w') as log:
+        try:
+            process = subprocess.run([sys.executable, '-c', STAGE_WRAPPER.format(code=STAGES[stage])], cwd=SRC_DIR,
+                                     env=dataset_environment(dataset_dir), stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired as error:
+            log.write(error.output.decode() if isinstance(error.output, bytes) else (error.output or ''))
+            result.update(status='timeout', seconds=time.perf_counter() - start_time)
+            return result
+        log.write(process.stdout)
+
+    measurements = [line for line in process.stdout.splitlines() if line.startswith('BENCHMARK ')]
+    if process.returncode != 0 or not measurements:
+        result.update(status='failed', seconds=time.perf_counter() - start_time)
+    else:
+        result.update(json.loads(measurements[-1][len('BENCHMARK '):]))
+    return result
+
+
+def run_benchmark(work_dir, patient_counts=(1000, 10000, 100000), stages=tuple(STAGES), timeout=None,
+                  events_per_patient=50, seed=0):
+    """
+    Generates a dataset per cohort size and runs the stages on it, in order.
+
+    Args:
+        work_dir (str): Directory of the datasets, the stage logs and the results.
+        patient_counts (tuple): Cohort sizes.
+        stages (tuple): Names of the stages to run, in order.
+        timeout (float): Seconds after which a stage is stopped.
+        events_per_patient (float): Mean number of lab events per patient.
+        seed (int): Seed of the data generator.
+
+    Returns:
+        pd.DataFrame: One row per (cohort size, stage) with the status, wall time and peak RSS.
+    """
+    results = []
+    for n_patients in patient_counts:
+        dataset_dir = os.path.join(work_dir, f'{n_patients}_patients')
+        start_time = time.perf_counter()
+        n_rows = generate_idsc_dataset(os.path.join(dataset_dir, 'idsc'), os.path.join(dataset_dir, 'patientomics'),
+                                       os.path.join(dataset_dir, 'long_covid'), n_patients=n_patients,
+                                       events_per_patient=events_per_patient, seed=seed)
+        print(f"Dataset of {n_patients} patients ({n_rows['lab_data']} lab rows) generated in "
+              f"{time.perf_counter() - start_time:.1f}s")
+
+        for stage in stages:
+            result = run_stage(stage, dataset_dir, os.path.join(dataset_dir, f'{stage}.log'), timeout)
+            result.update(patients=n_patients, lab_rows=n_rows['lab_data'])
+            results.append(result)
+            print(f"  {stage}: {result['status']}, {result['seconds']:.1f}s, peak RSS {result['peak_rss_mb'] or float('nan'):.0f} MB")
+
+    results_df = pd.DataFrame(results, columns=['patients', 'lab_rows', 'stage', 'status', 'seconds', 'peak_rss_mb'])
+    results_df.to_csv(os.path.join(work_dir, 'benchmark_results.csv'), index=False)
+    return results_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic IDSC data.")
+    parser.add_argument('--work-dir', required=True, help="Directory of the datasets, logs and results")
+    parser.add_argument('--patients', type=int, nargs='+', default=[1000, 10000, 100000], help="Cohort sizes")
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES), help="Stages to run")
+    parser.add_argument('--timeout', type=float, default=None, help="Seconds after which a stage is stopped")
+    parser.add_argument('--events-per-patient', type=float, default=50, help="Mean number of lab events per patient")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the data generator")
+    args = parser.parse_args()
+
+    results_df = run_benchmark(args.work_dir, args.patients, args.stages, args.timeout, args.events_per_patient, args.seed)
+    print(results_df.to_string(index=False))
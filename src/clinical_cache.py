@@ -0,0 +1,156 @@
+"""
+Columnar cache for the raw IDSC extracts.
+
+The first read of a source CSV parses it (including its date columns) and stores the typed result
+as a compressed Parquet file next to a small JSON sidecar with the source fingerprint. Later reads
+with an unchanged source and the same read options are served directly from the Parquet file, so
+reruns of the pipeline skip the CSV and datetime parsing.
+"""
+
+import os
+import json
+import hashlib
+import pandas as pd
+
+from source_schemas import read_source
+from date_normalization import normalize_dates
+
+
+CACHE_VERSION = 5
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def source_fingerprint(file_path, full_hash=False):
+    """
+    Computes the fingerprint used to decide if a cached copy of a source file is still valid.
+
+    Args:
+        file_path (str): Path to the source file.
+        full_hash (bool): Hash the whole file instead of its first and last blocks.
+
+    Returns:
+        dict: Size, modification time and content hash of the file.
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.blake2b(digest_size=16)
+
+    with open(file_path, 'rb') as file:
+        if full_hash:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+                digest.update(block)
+        else:
+            ## Hash the head and the tail of the file, enough to catch a re-exported drop
+            digest.update(file.read(HASH_BLOCK_SIZE))
+            if stat.st_size > HASH_BLOCK_SIZE:
+                file.seek(max(stat.st_size - HASH_BLOCK_SIZE, HASH_BLOCK_SIZE))
+                digest.update(file.read(HASH_BLOCK_SIZE))
+
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'hash': digest.hexdigest(),
+        'full_hash': full_hash,
+    }
+
+
+def cache_paths(csv_file_path, cache_dir=None):
+    """
+    Returns the Parquet and sidecar paths used to cache a source file.
+
+    Args:
+        csv_file_path (str): Path to the source CSV file.
+        cache_dir (str): Directory of the cache. Defaults to '.cache' next to the source file.
+
+    Returns:
+        tuple: (parquet_path, sidecar_path)
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(csv_file_path)), '.cache')
+
+    base_name = os.path.splitext(os.path.basename(csv_file_path))[0]
+    parquet_path = os.path.join(cache_dir, base_name + '.parquet')
+    return parquet_path, parquet_path + '.json'
+
+
+def read_through_cache(csv_file_path, read_options, load_source, cache_dir=None, full_hash=False):
+    """
+    Serves a source file from the cache, loading and caching it on a miss.
+
+    Args:
+        csv_file_path (str): Path to the source CSV file.
+        read_options (dict): JSON-serializable options that change the loaded DataFrame.
+        load_source (callable): Loads the source file into a typed DataFrame on a cache miss.
+        cache_dir (str): Directory of the cache. Defaults to '.cache' next to the source file.
+        full_hash (bool): Hash the whole source file to validate the cache.
+
+    Returns:
+        pd.DataFrame: The typed DataFrame.
+    """
+    parquet_path, sidecar_path = cache_paths(csv_file_path, cache_dir)
+    cache_key = {
+        'version': CACHE_VERSION,
+        'source': source_fingerprint(csv_file_path, full_hash=full_hash),
+        'options': read_options,
+    }
+
+    ## Serve the cached copy when the source and the read options did not change
+    if os.path.exists(parquet_path) and os.path.exists(sidecar_path):
+        with open(sidecar_path, 'r') as file:
+            if json.load(file) == cache_key:
+                print(f"Reading cached source from {parquet_path}")
+                return pd.read_parquet(parquet_path)
+
+    df = load_source(csv_file_path)
+
+    ## Write to a temporary file first so an interrupted run never leaves a partial cache behind
+    os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+    tmp_path = parquet_path + '.tmp'
+    df.to_parquet(tmp_path, index=False, compression='zstd')
+    os.replace(tmp_path, parquet_path)
+    with open(sidecar_path, 'w') as file:
+        json.dump(cache_key, file)
+    print(f"Source cached to {parquet_path}")
+
+    return df
+
+
+def read_csv_cached(csv_file_path, sep=',', date_columns=(), cache_dir=None, full_hash=False):
+    """
+    Reads a CSV file through the columnar cache.
+
+    Args:
+        csv_file_path (str): Path to the source CSV file.
+        sep (str): Separator of the CSV file.
+        date_columns (list): Columns converted to datetime before caching.
+        cache_dir (str): Directory of the cache. Defaults to '.cache' next to the source file.
+        full_hash (bool): Hash the whole source file to validate the cache.
+
+    Returns:
+        pd.DataFrame: The DataFrame with the date columns already parsed.
+    """
+    def load_source(file_path):
+        df = pd.read_csv(file_path, sep=sep)
+        for column in date_columns:
+            df[column], _ = normalize_dates(df[column])
+        return df
+
+    read_options = {'sep': sep, 'date_columns': list(date_columns)}
+    return read_through_cache(csv_file_path, read_options, load_source, cache_dir, full_hash)
+
+
+def read_source_cached(csv_file_path, schema, cache_dir=None, full_hash=False):
+    """
+    Reads a registered source through the columnar cache, typed by its schema.
+
+    Args:
+        csv_file_path (str): Path to the source CSV file.
+        schema (dict): The schema of the source (see source_schemas.SOURCE_SCHEMAS).
+        cache_dir (str): Directory of the cache. Defaults to '.cache' next to the source file.
+        full_hash (bool): Hash the whole source file to validate the cache.
+
+    Returns:
+        pd.DataFrame: The typed DataFrame with the date column already parsed.
+    """
+    ## A change of the schema changes the cached dtypes, so it is part of the cache key
+    return read_through_cache(csv_file_path, {'schema': schema}, lambda file_path: read_source(file_path, schema),
+                              cache_dir, full_hash)
@@ -0,0 +1,96 @@
+"""
+Out-of-core ingestion of the large IDSC extracts (lab_data, medications, ...).
+
+The source CSV is streamed in fixed-size chunks and every chunk is hash-partitioned by patient into
+spill files on disk. All rows of a patient land in the same partition, so the per-patient feature
+extraction can run one partition at a time with a memory footprint bounded by the partition size
+instead of the size of the whole extract.
+"""
+
+import os
+import glob
+import shutil
+import pandas as pd
+
+from source_schemas import read_source
+
+
+def patient_partition(patient_ids, n_partitions):
+    """
+    Assigns every patient id to a partition number.
+
+    Args:
+        patient_ids (pd.Series): The patient ids of the rows.
+        n_partitions (int): Number of partitions.
+
+    Returns:
+        pd.Series: The partition number of every row.
+    """
+    hashed = pd.util.hash_pandas_object(patient_ids, index=False)
+    return (hashed % n_partitions).astype('int64')
+
+
+def partition_source(csv_file_path, partition_dir, schema, n_partitions=64, chunksize=1_000_000):
+    """
+    Streams a source CSV file in chunks and spills the rows into patient partitions.
+
+    Args:
+        csv_file_path (str): Path to the source CSV file.
+        partition_dir (str): Directory for the spill files. It is emptied before writing.
+        schema (dict): The schema of the source (see source_schemas.SOURCE_SCHEMAS).
+        n_partitions (int): Number of partitions.
+        chunksize (int): Number of rows read per chunk.
+
+    Returns:
+        list: Paths of the partition directories that received rows.
+    """
+    if os.path.exists(partition_dir):
+        shutil.rmtree(partition_dir)
+    os.makedirs(partition_dir)
+
+    for chunk_number, chunk in enumerate(read_source(csv_file_path, schema, chunksize=chunksize)):
+        ## Write one spill file per (partition, chunk); a partition is the union of its spill files
+        partitions = patient_partition(chunk[schema['id_column']], n_partitions)
+        for partition, partition_chunk in chunk.groupby(partitions):
+            part_dir = os.path.join(partition_dir, f'part-{partition:05d}')
+            os.makedirs(part_dir, exist_ok=True)
+            spill_file = os.path.join(part_dir, f'chunk-{chunk_number:06d}.parquet')
+            partition_chunk.to_parquet(spill_file, index=False)
+
+        print(f"Partitioned chunk {chunk_number} ({len(chunk)} rows)")
+
+    return sorted(glob.glob(os.path.join(partition_dir, 'part-*')))
+
+
+def read_partition(part_dir, schema=None):
+    """
+    Reads all spill files of one partition into a DataFrame.
+
+    Args:
+        part_dir (str): Path of the partition directory.
+        schema (dict): The schema of the source, used to restore the categorical columns
+            whose categories differ between the chunks.
+
+    Returns:
+        pd.DataFrame: The rows of all the patients in the partition.
+    """
+    spill_files = sorted(glob.glob(os.path.join(part_dir, 'chunk-*.parquet')))
+    df = pd.concat([pd.read_parquet(spill_file) for spill_file in spill_files], ignore_index=True)
+    if schema is not None:
+        df = df.astype({column: dtype for column, dtype in schema['dtypes'].items() if column in df.columns})
+    return df
+
+
+def iter_partitions(partition_dir, schema=None):
+    """
+    Yields the partitions of a partitioned source one at a time.
+
+    Args:
+        partition_dir (str): Directory written by partition_source.
+        schema (dict): The schema of the source.
+
+    Yields:
+        pd.DataFrame: The rows of one partition.
+    """
+    for part_dir in sorted(glob.glob(os.path.join(partition_dir, 'part-*'))):
+        yield read_partition(part_dir, schema)
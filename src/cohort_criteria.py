@@ -0,0 +1,213 @@
+"""
+Cohort criteria of the patient selection scripts.
+
+A cohort is declared as a list of criteria specs (imaging in a day window from the first admission,
+counts of exam days or exam types, discharge outcome, death within N days) that are all required.
+Every criterion compiles to one vectorized boolean mask over the patients, computed from the
+(patient, day, exam type) imaging aggregate and the patient-level outcome table, so a selection over
+the whole RIS table is a few grouped operations. A new kind of criterion is added by registering a
+function with register_criterion, and a new cohort by adding its specs to COHORTS.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+## Imaging exam types of the chest CT and thorax studies
+RIS_EXAMINATION_TYPES = ['CTA', 'CTHATHAB', 'CTHATHOB', 'CTHTH', 'CTHTHABD', 'CTTH', 'CTTHABD', 'CTTHOB', 'CTUB', 'IMPCTTH',
+                         'IMPCTTHAB', 'TH']
+CT_EXAMINATION_TYPES = ['CTA', 'CTHATHAB', 'CTHATHOB', 'CTHTH', 'CTHTHABD', 'CTTH', 'CTTHABD', 'CTTHOB', 'IMPCTTH', 'IMPCTTHAB']
+
+CRITERION_FUNCTIONS = {}
+
+COHORTS = {
+    ## Imaging follow-up after day 150, imaging from day -15 and at least one CT exam type
+    'potential_long_covid': [
+        {'criterion': 'exams', 'after': 150},
+        {'criterion': 'exams', 'after': -15},
+        {'criterion': 'exams', 'exam_types': CT_EXAMINATION_TYPES, 'count': 'exam_types', 'min_count': 1},
+    ],
+    ## Deceased within 60 days from the first admission
+    'deceased': [
+        {'criterion': 'discharge_type', 'values': ['Verstorben']},
+        {'criterion': 'death_within', 'days': 60},
+    ],
+    ## Discharged home without imaging after day 60
+    'discharged_control': [
+        {'criterion': 'discharge_type', 'values': ['Entlassung']},
+        {'criterion': 'exams', 'after': 60, 'max_count': 0},
+    ],
+    ## Discharged home with imaging after day 60, the potential long covid patients of the severe covid selection
+    'discharged_follow_up': [
+        {'criterion': 'discharge_type', 'values': ['Entlassung']},
+        {'criterion': 'exams', 'after': 60},
+    ],
+}
+
+## Outcomes of the patient outcome table, the first matching cohort wins
+OUTCOME_COHORTS = ['deceased', 'discharged_control', 'discharged_follow_up']
+OTHER_OUTCOME = 'other'
+MISSING_OUTCOME = 'missing_general_data'
+
+
+def register_criterion(name):
+    """
+    Registers a criterion function under a name usable in the cohort specs.
+
+    The function receives the imaging events, the patient table and the parameters of the spec, and
+    returns a boolean Series indexed like the patient table.
+
+    Args:
+        name (str): Name of the criterion in the specs.
+    """
+    def decorator(function):
+        CRITERION_FUNCTIONS[name] = function
+        return function
+    return decorator
+
+
+def exam_events(aggregated):
+    """
+    Returns the imaging events of the (patient, day, exam type) aggregate as columns.
+
+    Args:
+        aggregated (pd.Series): Values returned by pivot_engine.aggregate_features over the RIS rows.
+
+    Returns:
+        pd.DataFrame: One row per observed (patient, day, exam type) with 'pseudoid_pid', 'days' and 'exam_type'.
+    """
+    return pd.DataFrame({
+        'pseudoid_pid': aggregated.index.get_level_values(0),
+        'days': aggregated.index.get_level_values(1),
+        'exam_type': aggregated.index.get_level_values(2).astype(str),
+    })
+
+
+@register_criterion('exams')
+def exams(events, patients, after=None, before=None, exam_types=None, count='days', min_count=None, max_count=None):
+    """
+    Requires a number of imaging days (or distinct exam types) within a day window.
+
+    Args:
+        after (int): Only the exams strictly after this day from the first admission.
+        before (int): Only the exams strictly before this day.
+        exam_types (list): Only these exam types.
+        count (str): 'days' counts the distinct exam days, 'exam_types' the distinct exam types.
+        min_count (int): Minimum count, 1 when no bound is given.
+        max_count (int): Maximum count, e.g. 0 to require no exam in the window.
+    """
+    mask = pd.Series(True, index=events.index)
+    if after is not None:
+        mask &= events['days'] > after
+    if before is not None:
+        mask &= events['days'] < before
+    if exam_types is not None:
+        mask &= events['exam_type'].isin(exam_types)
+
+    column = {'days': 'days', 'exam_types': 'exam_type'}[count]
+    counts = events[mask].groupby('pseudoid_pid')[column].nunique().reindex(patients.index, fill_value=0)
+    if min_count is None and max_count is None:
+        min_count = 1
+    selected = pd.Series(True, index=patients.index)
+    if min_count is not None:
+        selected &= counts >= min_count
+    if max_count is not None:
+        selected &= counts <= max_count
+    return selected
+
+
+@register_criterion('discharge_type')
+def discharge_type(events, patients, values):
+    """Requires one of the discharge types of general_data (e.g. 'Verstorben', 'Entlassung')."""
+    return patients['discharge_type'].isin(values)
+
+
+@register_criterion('death_within')
+def death_within(events, patients, days):
+    """Requires a death less than a number of days after the first admission."""
+    return patients['death_day'] < days
+
+
+def select_cohort(events, patients, criteria):
+    """
+    Evaluates the criteria of a cohort for all the patients at once.
+
+    Args:
+        events (pd.DataFrame): The imaging events (see exam_events).
+        patients (pd.DataFrame): One row per candidate patient, indexed by patient id, with the columns
+            used by the criteria ('discharge_type', 'death_day').
+        criteria (list): The criteria specs, all required, e.g. COHORTS['potential_long_covid'].
+
+    Returns:
+        pd.Series: Boolean membership of every patient of the patient table.
+    """
+    selected = pd.Series(True, index=patients.index)
+    for spec in criteria:
+        params = {key: value for key, value in spec.items() if key != 'criterion'}
+        if spec['criterion'] not in CRITERION_FUNCTIONS:
+            raise KeyError(f"Unknown criterion '{spec['criterion']}', registered criteria: {', '.join(CRITERION_FUNCTIONS)}")
+        selected &= CRITERION_FUNCTIONS[spec['criterion']](events, patients, **params).to_numpy()
+    return selected
+
+
+def patient_outcome_table(df, aggregated, general_data, first_hosp_dates, id_column='pseudoid_pid'):
+    """
+    Joins the imaged patients with their general_data outcome and their imaging aggregates.
+
+    Args:
+        df (pd.DataFrame): The RIS rows, every patient with a row is in the table.
+        aggregated (pd.Series): The (patient, day, exam type) aggregate of the RIS rows.
+        general_data (pd.DataFrame): general_data with 'discharge_type' and a datetime 'date_death'. The
+            first row of a patient holds its outcome.
+        first_hosp_dates (pd.Series): First admission date indexed by patient id.
+        id_column (str): Column with the patient id.
+
+    Returns:
+        pd.DataFrame: One row per imaged patient, sorted by patient id, with 'in_general_data',
+            'discharge_type', 'death_day', 'first_day', 'last_day', 'exam_days' and 'ct_types'.
+    """
+    outcomes = general_data.drop_duplicates(id_column, keep='first').set_index(id_column)[['discharge_type', 'date_death']]
+    patients = pd.DataFrame(index=pd.Index(np.sort(df[id_column].unique()), name=id_column))
+    patients = patients.join(outcomes, how='left')
+    patients.insert(0, 'in_general_data', patients.index.isin(outcomes.index))
+    patients['death_day'] = (patients['date_death'] - patients.index.map(first_hosp_dates)).dt.days
+
+    events = exam_events(aggregated)
+    exam_days = events.groupby('pseudoid_pid')['days'].agg(['min', 'max', 'nunique'])
+    exam_days.columns = ['first_day', 'last_day', 'exam_days']
+    ct_types = events[events['exam_type'].isin(CT_EXAMINATION_TYPES)].groupby('pseudoid_pid')['exam_type'].nunique()
+    patients = patients.join(exam_days, how='left')
+    patients['exam_days'] = patients['exam_days'].fillna(0).astype('int64')
+    patients['ct_types'] = ct_types.reindex(patients.index, fill_value=0).astype('int64')
+    return patients.drop(columns='date_death')
+
+
+def classify_outcomes(events, patients, cohorts=OUTCOME_COHORTS):
+    """
+    Assigns every patient of the outcome table to the first of the cohorts it belongs to.
+
+    The patients missing from general_data are reported and get their own outcome.
+
+    Args:
+        events (pd.DataFrame): The imaging events (see exam_events).
+        patients (pd.DataFrame): The table of patient_outcome_table.
+        cohorts (list): Names of the cohorts of COHORTS, in order of precedence.
+
+    Returns:
+        pd.Series: Categorical outcome of every patient.
+    """
+    outcome = pd.Series(OTHER_OUTCOME, index=patients.index, dtype='object')
+    unassigned = pd.Series(True, index=patients.index)
+    for cohort in cohorts:
+        selected = select_cohort(events, patients, COHORTS[cohort]) & unassigned
+        outcome[selected] = cohort
+        unassigned &= ~selected
+
+    missing = ~patients['in_general_data']
+    outcome[missing] = MISSING_OUTCOME
+    if missing.any():
+        examples = ', '.join(str(patient) for patient in patients.index[missing][:5])
+        print(f"{missing.sum()} imaged patients are missing from general_data (e.g. {examples})")
+
+    categories = list(cohorts) + [OTHER_OUTCOME, MISSING_OUTCOME]
+    return outcome.astype(pd.CategoricalDtype(categories)).rename('outcome')
@@ -0,0 +1,154 @@
+"""
+Threshold sweeps of the cohort criteria for sensitivity analyses.
+
+A sweep evaluates a cohort (see cohort_criteria) for every combination of a grid of thresholds in
+one pass. The distinct exam days of every patient are sorted once into a single array of
+(patient, day) keys, so the number of exam days in any window of any patient is the difference of two
+binary searches. Every criterion is evaluated once per value of its own thresholds and the
+combinations only AND the cached masks. The membership of every combination is returned as a
+bitset over the patients.
+"""
+
+import itertools
+import numpy as np
+import pandas as pd
+
+from cohort_criteria import CRITERION_FUNCTIONS
+
+
+class ExamDayIndex:
+    """
+    Sorted distinct exam days of every patient, for window counts by binary search.
+
+    Args:
+        events (pd.DataFrame): The imaging events (see cohort_criteria.exam_events).
+        patients (pd.DataFrame): The patient table, indexed by patient id.
+        exam_types (list): Only index the exams of these types.
+    """
+
+    def __init__(self, events, patients, exam_types=None):
+        if exam_types is not None:
+            events = events[events['exam_type'].isin(exam_types)]
+        codes = patients.index.get_indexer(events['pseudoid_pid'])
+        days = events['days'].to_numpy(dtype='int64')[codes >= 0]
+        codes = codes[codes >= 0].astype('int64')
+
+        self.n_patients = len(patients)
+        self.min_day = int(days.min()) if len(days) else 0
+        max_day = int(days.max()) if len(days) else 0
+        ## One slot below and above the observed days for the thresholds outside the range
+        self.span = max_day - self.min_day + 3
+        self.max_day = max_day
+        self.keys = np.unique(codes * self.span + (days - self.min_day + 1))
+        self.patient_codes = np.arange(self.n_patients, dtype='int64')
+
+    def _threshold_keys(self, day):
+        day = np.clip(day, self.min_day - 1, self.max_day + 1)
+        return self.patient_codes * self.span + (day - self.min_day + 1)
+
+    def count_in_window(self, after=None, before=None):
+        """
+        Counts the distinct exam days of every patient strictly between two days.
+
+        Args:
+            after (int): Only the days strictly after this day.
+            before (int): Only the days strictly before this day.
+
+        Returns:
+            np.ndarray: The count of every patient, in the order of the patient table.
+        """
+        after = self.min_day - 1 if after is None else after
+        before = self.max_day + 1 if before is None else before
+        first = np.searchsorted(self.keys, self._threshold_keys(after), side='right')
+        last = np.searchsorted(self.keys, self._threshold_keys(before), side='left')
+        return np.maximum(last - first, 0)
+
+
+def criterion_mask(spec, events, patients, day_indexes):
+    """
+    Evaluates one criterion spec, through the exam day index for the exam day counts.
+
+    Args:
+        spec (dict): The criterion spec, with scalar thresholds.
+        events (pd.DataFrame): The imaging events.
+        patients (pd.DataFrame): The patient table.
+        day_indexes (dict): Cache of ExamDayIndex per exam type list.
+
+    Returns:
+        np.ndarray: Boolean membership of every patient.
+    """
+    params = {key: value for key, value in spec.items() if key != 'criterion'}
+    if spec['criterion'] != 'exams' or params.get('count', 'days') != 'days':
+        return CRITERION_FUNCTIONS[spec['criterion']](events, patients, **params).to_numpy()
+
+    exam_types = params.get('exam_types')
+    cache_key = None if exam_types is None else tuple(exam_types)
+    if cache_key not in day_indexes:
+        day_indexes[cache_key] = ExamDayIndex(events, patients, exam_types)
+    counts = day_indexes[cache_key].count_in_window(params.get('after'), params.get('before'))
+
+    min_count, max_count = params.get('min_count'), params.get('max_count')
+    if min_count is None and max_count is None:
+        min_count = 1
+    selected = np.ones(len(patients), dtype=bool)
+    if min_count is not None:
+        selected &= counts >= min_count
+    if max_count is not None:
+        selected &= counts <= max_count
+    return selected
+
+
+def sweep_cohort(events, patients, criteria, grid):
+    """
+    Evaluates a cohort for every combination of a grid of thresholds.
+
+    Args:
+        events (pd.DataFrame): The imaging events (see cohort_criteria.exam_events).
+        patients (pd.DataFrame): The patient table, indexed by patient id.
+        criteria (list): The criteria specs of the cohort, e.g. COHORTS['potential_long_covid'].
+        grid (dict): (criterion position, parameter) -> list of values replacing the parameter of the
+            spec, e.g. {(0, 'after'): [120, 150], (2, 'min_count'): [1, 2]}.
+
+    Returns:
+        pd.DataFrame: One row per combination with the thresholds (columns '<criterion>_<position>_<parameter>'),
+            the cohort size in 'patients' and the membership bitset in 'members' (see cohort_members).
+    """
+    for position, parameter in grid:
+        if position >= len(criteria):
+            raise KeyError(f"The grid parameter '{parameter}' refers to criterion {position}, the cohort has {len(criteria)}")
+
+    ## Every criterion is evaluated once per combination of its own thresholds
+    day_indexes = {}
+    criterion_masks = []
+    for position, spec in enumerate(criteria):
+        parameters = [parameter for criterion_position, parameter in grid if criterion_position == position]
+        masks = {}
+        for values in itertools.product(*[grid[(position, parameter)] for parameter in parameters]):
+            masks[values] = criterion_mask({**spec, **dict(zip(parameters, values))}, events, patients, day_indexes)
+        criterion_masks.append((parameters, masks))
+
+    columns = [f"{criteria[position]['criterion']}_{position}_{parameter}" for position, parameter in grid]
+    rows = []
+    for values in itertools.product(*grid.values()):
+        thresholds = dict(zip(grid, values))
+        selected = np.ones(len(patients), dtype=bool)
+        for position, (parameters, masks) in enumerate(criterion_masks):
+            selected &= masks[tuple(thresholds[(position, parameter)] for parameter in parameters)]
+        rows.append(list(values) + [int(selected.sum()), np.packbits(selected).tobytes()])
+
+    return pd.DataFrame(rows, columns=columns + ['patients', 'members'])
+
+
+def cohort_members(members, patients):
+    """
+    Returns the patient ids of a membership bitset of sweep_cohort.
+
+    Args:
+        members (bytes): The bitset of one combination.
+        patients (pd.DataFrame): The patient table the sweep ran on.
+
+    Returns:
+        list: The ids of the member patients.
+    """
+    selected = np.unpackbits(np.frombuffer(members, dtype='uint8'), count=len(patients)).astype(bool)
+    return patients.index[selected].tolist()
@@ -0,0 +1,31 @@
+"""
+Root directories of the IDSC extract and of the patientomics data.
+
+The defaults are the directories of the original workstation. Every root can be redirected with an
+environment variable, e.g. to run the pipeline on the synthetic data of synthetic_idsc_data:
+
+    IDSC_DATA_DIR          the preprocessed IDSC extract (lab_data.csv, ris_data.csv, general_data.csv, ...)
+    PATIENTOMICS_DATA_DIR  the patientomics data (dicts/, 06_clinical_data/, 05_data_exploration/, ...)
+    LONG_COVID_STUDY_DIR   the long covid study data (lung function tests, time series matrices)
+"""
+
+import os
+
+
+def data_root(variable, default):
+    """
+    Returns a root directory, from its environment variable when it is set, with a trailing separator.
+
+    Args:
+        variable (str): Name of the environment variable.
+        default (str): Directory used when the variable is not set.
+
+    Returns:
+        str: The root directory.
+    """
+    return os.path.join(os.environ.get(variable, default), '')
+
+
+IDSC_DATA_DIR = data_root('IDSC_DATA_DIR', "/home/jagh/Documents/01_UB/10_Conferences_submitted/11_Second_paper/00_dataset/03_Insel_dataset/01_Preprocessing_IDSC202101463_data_v13_20221214/")
+PATIENTOMICS_DATA_DIR = data_root('PATIENTOMICS_DATA_DIR', "/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/")
+LONG_COVID_STUDY_DIR = data_root('LONG_COVID_STUDY_DIR', "/data/01_multiomics/02_long_covid_study/")
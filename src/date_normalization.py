@@ -0,0 +1,97 @@
+"""
+Fast normalization of the date columns of the clinical extracts.
+
+Clinical timestamps repeat heavily (one lab request has many results, one day many charted values),
+so the format of a column is detected once, only its unique strings are parsed with that explicit
+format and the parsed values are mapped back to the rows. Values that cannot be parsed are reported
+instead of being silently turned into NaT.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+CANDIDATE_DATE_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+    '%Y-%m-%dT%H:%M:%S',
+    '%d.%m.%Y %H:%M:%S',
+    '%d.%m.%Y %H:%M',
+    '%d.%m.%Y',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y',
+]
+
+
+def detect_date_format(values, candidates=CANDIDATE_DATE_FORMATS, sample_size=1000):
+    """
+    Detects the format of a collection of date strings.
+
+    Args:
+        values (array-like): Unique date strings of the column.
+        candidates (list): Formats tried in order.
+        sample_size (int): Number of values used to test every format.
+
+    Returns:
+        str: The format that parses most of the sampled values, or None if no format parses any.
+    """
+    sample = pd.Series(values).dropna().astype(str)
+    if len(sample) > sample_size:
+        sample = sample.sample(sample_size, random_state=0)
+
+    best_format, best_count = None, 0
+    for date_format in candidates:
+        parsed_count = pd.to_datetime(sample, format=date_format, errors='coerce').notna().sum()
+        if parsed_count == len(sample):
+            return date_format
+        if parsed_count > best_count:
+            best_format, best_count = date_format, parsed_count
+
+    return best_format
+
+
+def normalize_dates(series, date_format=None, report=True):
+    """
+    Converts a date column to datetime, parsing every distinct value only once.
+
+    Args:
+        series (pd.Series): The raw date column.
+        date_format (str): Expected format of the column. It is detected when not given or when
+            it does not match the values of the column.
+        report (bool): Print a summary of the values that failed to parse.
+
+    Returns:
+        tuple: (dates, failures) where dates is the datetime column and failures holds the raw
+            values of the rows that could not be parsed, indexed like the input rows.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series, series.iloc[:0]
+
+    ## Parse the unique strings and map them back to the rows through their codes
+    codes, uniques = pd.factorize(series)
+    uniques = pd.Index(uniques).astype(str)
+
+    parsed_uniques = None
+    if date_format is not None:
+        parsed_uniques = pd.to_datetime(uniques, format=date_format, errors='coerce')
+    if parsed_uniques is None or parsed_uniques.isna().any():
+        detected_format = detect_date_format(uniques)
+        if detected_format is not None and detected_format != date_format:
+            detected_uniques = pd.to_datetime(uniques, format=detected_format, errors='coerce')
+            if parsed_uniques is None or detected_uniques.notna().sum() > parsed_uniques.notna().sum():
+                date_format, parsed_uniques = detected_format, detected_uniques
+    if parsed_uniques is None:
+        parsed_uniques = pd.DatetimeIndex(np.full(len(uniques), np.datetime64('NaT'), dtype='datetime64[ns]'))
+
+    ## Missing values have the code -1 and stay NaT
+    parsed = parsed_uniques.take(codes, allow_fill=True, fill_value=pd.NaT)
+    dates = pd.Series(parsed, index=series.index, name=series.name)
+
+    failures = series[(codes >= 0) & dates.isna().to_numpy()]
+    if report and len(failures) > 0:
+        examples = ', '.join(repr(value) for value in failures.unique()[:5])
+        print(f"Column '{series.name}': {len(failures)} rows failed to parse with format {date_format} (e.g. {examples})")
+
+    return dates, failures
@@ -2,6 +2,10 @@ import pandas as pd
 import os
 import matplotlib.pyplot as plt
 
+from patient_writer import PatientFrameWriter
+from lab_ontology import LAB_CATEGORIES, LabOntology, load_lab_ontology
+from numeric_values import coerce_numeric_columns
+
 
 def read_csv(file_path):
     """
@@ -19,6 +23,7 @@ def read_csv(file_path):
 def preprocess_data(df):
     """
     Preprocesses the DataFrame by converting lab_req_date to datetime format and sorting by lab_req_date.
+    The lab values are converted to numeric once, keeping the censored results ('<0.5') with a flag.
 
     Args:
         df (pd.DataFrame): The input DataFrame.
@@ -27,6 +32,7 @@ def preprocess_data(df):
         pd.DataFrame: The preprocessed DataFrame.
     """
     df['lab_req_date'] = pd.to_datetime(df['lab_req_date'])
+    df, _ = coerce_numeric_columns(df, {'lab_nval': 'float64'}, feature_column='lab_name')
     df = df.sort_values('lab_req_date')
     return df
 
@@ -43,9 +49,10 @@ def categorize_data(df, lab_categories):
         pd.DataFrame: The DataFrame with the lab_categories column added.
     """
     df_lab_categorized = df.copy()
-    df_lab_categorized['lab_categories'] = df_lab_categorized['lab_name'].map(
-        lambda lab_name: next((category for category, features in lab_categories.items() if lab_name in features), 'Unknown')
-    )
+    ## One lookup per distinct lab name through the inverted index of the ontology. The default
+    ## families use the ontology loaded once per process, another family table gets its own
+    lab_ontology = load_lab_ontology() if lab_categories == LAB_CATEGORIES else LabOntology(lab_categories)
+    df_lab_categorized['lab_categories'] = lab_ontology.categorize(df_lab_categorized['lab_name'])
     return df_lab_categorized
 
 
@@ -100,26 +107,25 @@ def group_and_plot_data(df, patient_id, max_days):
         plt.show()
 
 
-def save_csv_per_patient(df, output_dir):
+def save_csv_per_patient(df, output_dir, n_writers=4):
     grouped_df = df.groupby('pseudoid_pid')
 
-    for patient, data in grouped_df:
-        patient_csv = pd.DataFrame()
-
-        for lab_name, lab_data in data.groupby('lab_name'):
-            min_date = lab_data['lab_req_date'].min()
-            lab_data['days'] = (lab_data['lab_req_date'] - min_date).dt.days
+    ## The CSV files are written by background threads while the next patients are pivoted
+    with PatientFrameWriter(n_workers=n_writers) as writer:
+        for patient, data in grouped_df:
+            patient_csv = pd.DataFrame()
 
-            # Convert lab_nval to numeric, handling non-numeric values
-            lab_data['lab_nval'] = pd.to_numeric(lab_data['lab_nval'], errors='coerce')
+            for lab_name, lab_data in data.groupby('lab_name'):
+                min_date = lab_data['lab_req_date'].min()
+                lab_data['days'] = (lab_data['lab_req_date'] - min_date).dt.days
 
-            lab_data = lab_data.pivot_table(index='lab_name', columns='days', values='lab_nval', aggfunc='mean')
-            lab_data.columns = [f'day-{day}' for day in lab_data.columns]
+                lab_data = lab_data.pivot_table(index='lab_name', columns='days', values='lab_nval', aggfunc='mean')
+                lab_data.columns = [f'day-{day}' for day in lab_data.columns]
 
-            patient_csv = pd.concat([patient_csv, lab_data])
+                patient_csv = pd.concat([patient_csv, lab_data])
 
-        patient_csv_file = os.path.join(output_dir, f'patient_{patient}.csv')
-        patient_csv.to_csv(patient_csv_file)
+            patient_csv_file = os.path.join(output_dir, f'patient_{patient}.csv')
+            writer.submit(patient_csv, patient_csv_file)
 
 
 
@@ -132,18 +138,8 @@ df = read_csv(csv_file_path)
 # Step 2: Preprocess and categorize the data
 df = preprocess_data(df)
 
-lab_categories = {
-    'Blood Cells': ['Basophile', 'Lymphozyten', 'Monozyten', 'Neutrophile', 'Erythrozyten',
-                    'Immature-Granulozyten'],
-    'Coagulation': ['aPTT', 'Fibrinogen', 'INR', 'Thrombozyten'],
-    'Liver Function': ['ALAT', 'ASAT', 'G-Glutamyltransferase'],
-    'Inflammation': ['C-reaktives'],
-    'Renal Function': ['eGFR', 'Harnstoff', 'Kreatinin'],
-    'Metabolic Panel': ['Bicarbonat', 'Glucose', 'Kalium', 'Natrium', 'pH'],
-    'Cardiac Markers': ['Troponin-T-hs', 'Troponin-I-hs', 'NT-proBNP'],
-    'Other': ['D-Dimere', 'Lactat', 'LDH', 'MCH', 'MCHC', 'MCV', 'POCT-BNP', 'pO2', 'PCT', 'RDW', 'Immature', 'Ferritin',
-              'Lactat-Dehydrogenase', 'Troponin']
-}
+## The lab families are defined once in the lab ontology
+lab_categories = LAB_CATEGORIES
 
 df_lab_categorized = categorize_data(df, lab_categories)
 
@@ -160,4 +156,8 @@ save_csv_per_patient(df_lab_categorized, output_dir)
 # ## Step 4: Group the dataframe by patient pseudoid_pid
 # patient_id = 1000001
 # max_days = 18
-# group_and_plot_data(df_lab_categorized, patient_id, max_days)
\ No newline at end of file
+# group_and_plot_data(df_lab_categorized, patient_id, max_days)
+
+# ## Step 5: Render the timelines of all the patients to image files, without a display
+# from lab_timeline_plots import render_lab_timelines
+# render_lab_timelines(df_lab_categorized, os.path.join(output_dir, "lab_timelines"), max_days=18)
\ No newline at end of file
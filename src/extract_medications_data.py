@@ -3,6 +3,9 @@ import os
 import matplotlib.pyplot as plt
 import csv
 
+from patient_writer import PatientFrameWriter
+from medication_doses import resolve_medication_doses
+
 
 def read_csv(file_path, sep=','):
     """
@@ -154,31 +157,25 @@ def save_medications_dict_to_csv(medications_dict, output_file):
     print(f"Medications dictionary saved to {output_file}")
 
 
-def csv_med_per_patient(df, output_dir):
+def csv_med_per_patient(df, output_dir, n_writers=4):
     grouped_df = df.groupby('pseudoid_pid')
 
-    for patient, data in grouped_df:
-        patient_csv = pd.DataFrame()
+    ## The CSV files are written by background threads while the next patients are pivoted
+    with PatientFrameWriter(n_workers=n_writers) as writer:
+        for patient, data in grouped_df:
+            patient_csv = pd.DataFrame()
 
-        for med_name, med_data in data.groupby('med_atc'):
-            min_date = med_data['med_date'].min()
-            med_data['days'] = (med_data['med_date'] - min_date).dt.days
+            for med_name, med_data in data.groupby('med_atc', observed=True):
+                min_date = med_data['med_date'].min()
+                med_data['days'] = (med_data['med_date'] - min_date).dt.days
 
-            # Check if any value in 'med_given_dose' column is null
-            if med_data['med_given_dose'].isnull().any():
-                # Convert 'med_given_dose' to numeric, handling non-numeric values
-                med_data['med_given_dose'] = pd.to_numeric(med_data['med_given_dose'], errors='coerce')
-            else:
-                # Convert 'med_dose' to numeric, handling non-numeric values
-                med_data['med_dose'] = pd.to_numeric(med_data['med_dose'], errors='coerce')
+                med_data = med_data.pivot_table(index='med_atc', columns='days', values='med_dose_value', aggfunc='mean')
+                med_data.columns = [f'day-{day}' for day in med_data.columns]
 
-            med_data = med_data.pivot_table(index='med_atc', columns='days', values='med_given_dose', aggfunc='mean')
-            med_data.columns = [f'day-{day}' for day in med_data.columns]
-
-            patient_csv = pd.concat([patient_csv, med_data])
+                patient_csv = pd.concat([patient_csv, med_data])
 
-        patient_csv_file = os.path.join(output_dir, f'patient_{patient}.csv')
-        patient_csv.to_csv(patient_csv_file)
+            patient_csv_file = os.path.join(output_dir, f'patient_{patient}.csv')
+            writer.submit(patient_csv, patient_csv_file)
 
 
 
@@ -192,6 +189,9 @@ df = read_csv(csv_file_path, sep=';')
 # Step 2: Preprocess and categorize the data
 df = preprocess_data(df, 'med_date')
 
+## Resolve the administered/prescribed doses and their units once for the whole table
+df = resolve_medication_doses(df, feature_column='med_atc')
+
 # print("df.head():", df.head())
 
 # Step 3: Categorize the data
@@ -0,0 +1,142 @@
+"""
+Output format of the extracted clinical sources.
+
+A source is extracted either to 'patient_{id}.csv' files in its features directory, to a feature
+store ('<dir>_store', see feature_store) or to a sparse store ('<dir>_sparse', see sparse_features).
+The extractor records the format it wrote last in a marker file next to the features directory, and
+the readers open that format instead of guessing it from the directories that exist, so an output left
+over from an earlier run is never read in place of a newer one.
+"""
+
+import os
+import json
+import time
+
+
+FEATURE_FORMATS = {'csv': '', 'store': '_store', 'sparse': '_sparse'}
+FORMAT_MARKER_SUFFIX = '_format.json'
+
+
+def format_dir(features_dir, output_format):
+    """
+    Returns the directory of a source in an output format.
+
+    Args:
+        features_dir (str): Directory of the 'patient_{id}.csv' files of the source.
+        output_format (str): 'csv', 'store' or 'sparse'.
+
+    Returns:
+        str: The directory of the output.
+    """
+    if output_format not in FEATURE_FORMATS:
+        raise KeyError(f"Unknown output format '{output_format}', available formats: {', '.join(FEATURE_FORMATS)}")
+    if output_format == 'csv':
+        return features_dir
+    return features_dir.rstrip('/') + FEATURE_FORMATS[output_format]
+
+
+def format_marker_path(features_dir):
+    """
+    Returns the path of the format marker of a source, next to its features directory.
+
+    Args:
+        features_dir (str): Directory of the 'patient_{id}.csv' files of the source.
+
+    Returns:
+        str: Path of the marker file.
+    """
+    return features_dir.rstrip('/') + FORMAT_MARKER_SUFFIX
+
+
+def write_format_marker(features_dir, output_format):
+    """
+    Records the output format an extraction wrote.
+
+    Args:
+        features_dir (str): Directory of the 'patient_{id}.csv' files of the source.
+        output_format (str): 'csv', 'store' or 'sparse'.
+    """
+    format_dir(features_dir, output_format)
+    marker = {'format': output_format, 'written_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    ## Write aside and rename, so an interrupted run keeps the previous marker
+    tmp_path = format_marker_path(features_dir) + '.tmp'
+    with open(tmp_path, 'w') as marker_file:
+        json.dump(marker, marker_file)
+    os.replace(tmp_path, format_marker_path(features_dir))
+
+
+def read_format_marker(features_dir):
+    """
+    Reads the output format recorded for a source.
+
+    Args:
+        features_dir (str): Directory of the 'patient_{id}.csv' files of the source.
+
+    Returns:
+        str: The recorded format, None when the source has no marker.
+    """
+    path = format_marker_path(features_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as marker_file:
+        return json.load(marker_file)['format']
+
+
+def newest_patient_file_time(features_dir):
+    """
+    Returns the modification time of the newest 'patient_{id}.csv' file of a features directory.
+
+    Args:
+        features_dir (str): Directory of the 'patient_{id}.csv' files.
+
+    Returns:
+        float: The modification time, None when there is no patient file.
+    """
+    if not os.path.isdir(features_dir):
+        return None
+    times = [entry.stat().st_mtime for entry in os.scandir(features_dir)
+             if entry.name.startswith('patient_') and entry.name.endswith('.csv')]
+    return max(times, default=None)
+
+
+def newest_store_file_time(store_dir):
+    """
+    Returns the modification time of the newest file of a feature store or sparse store.
+
+    Args:
+        store_dir (str): Directory of the store.
+
+    Returns:
+        float: The modification time, None when the store has no file.
+    """
+    times = [os.path.getmtime(os.path.join(root, file_name))
+             for root, _, file_names in os.walk(store_dir) for file_name in file_names]
+    return max(times, default=None)
+
+
+def resolve_feature_format(features_dir, output_format=None):
+    """
+    Returns the output format to read a source from, checking that it is not older than the CSV files.
+
+    Args:
+        features_dir (str): Directory of the 'patient_{id}.csv' files of the source.
+        output_format (str): 'csv', 'store' or 'sparse'. The format recorded by the extractor is used
+            when not given, and 'csv' when the source has no marker.
+
+    Returns:
+        str: The output format.
+    """
+    if output_format is None:
+        output_format = read_format_marker(features_dir) or 'csv'
+    store_dir = format_dir(features_dir, output_format)
+    if output_format == 'csv':
+        return output_format
+
+    if not os.path.isdir(store_dir):
+        raise FileNotFoundError(f"The {output_format} output of '{features_dir}' does not exist: {store_dir}")
+    store_time = newest_store_file_time(store_dir)
+    csv_time = newest_patient_file_time(features_dir)
+    if csv_time is not None and (store_time is None or store_time < csv_time):
+        raise ValueError(f"The {output_format} output '{store_dir}' is older than the patient CSV files of "
+                         f"'{features_dir}', re-extract the source or read it in the 'csv' format")
+    return output_format
@@ -0,0 +1,166 @@
+"""
+Consolidated store of the per-patient feature matrices.
+
+Instead of one 'patient_{id}.csv' file per patient, the day x feature matrices of a source are kept
+in a single Parquet dataset bucketed by patient (hive partitions 'bucket=N'). Every row holds one
+observed cell (pseudoid_pid, days, feature, value), so the readers do one bulk read filtered by
+patient list and day range and split the result into per-patient matrices.
+"""
+
+import os
+import shutil
+import pandas as pd
+
+
+def patient_bucket(patient_ids, n_buckets):
+    """
+    Assigns every patient id to a bucket of the store.
+
+    Args:
+        patient_ids (array-like): The patient ids.
+        n_buckets (int): Number of buckets of the store.
+
+    Returns:
+        pd.Series: The bucket number of every patient id.
+    """
+    return pd.Series(patient_ids).astype('int64') % n_buckets
+
+
+class FeatureStoreWriter:
+    """
+    Buffers the per-patient matrices of a source and writes them into the bucketed store.
+
+    Args:
+        store_dir (str): Directory of the store. An existing store is replaced.
+        n_buckets (int): Number of buckets of the store.
+        flush_rows (int): Number of buffered rows of a bucket that triggers a write.
+    """
+
+    def __init__(self, store_dir, n_buckets=32, flush_rows=500_000):
+        self.store_dir = store_dir
+        self.n_buckets = n_buckets
+        self.flush_rows = flush_rows
+        self.buffers = {}
+        self.buffered_rows = {}
+        self.part_numbers = {}
+
+        if os.path.exists(store_dir):
+            shutil.rmtree(store_dir)
+        os.makedirs(store_dir)
+
+    def add(self, patient, patient_df):
+        """
+        Adds the matrix of one patient, with a 'days' column and one column per feature.
+
+        Args:
+            patient (int): The patient id.
+            patient_df (pd.DataFrame): The day x feature matrix of the patient.
+        """
+        long_df = patient_df.melt(id_vars='days', var_name='feature', value_name='value').dropna(subset=['value'])
+        long_df.insert(0, 'pseudoid_pid', patient)
+
+        bucket = int(patient) % self.n_buckets
+        self.buffers.setdefault(bucket, []).append(long_df)
+        self.buffered_rows[bucket] = self.buffered_rows.get(bucket, 0) + len(long_df)
+        if self.buffered_rows[bucket] >= self.flush_rows:
+            self.flush(bucket)
+
+    def flush(self, bucket):
+        """
+        Writes the buffered rows of a bucket as a new part file.
+
+        Args:
+            bucket (int): The bucket number.
+        """
+        if not self.buffers.get(bucket):
+            return
+
+        bucket_df = pd.concat(self.buffers[bucket], ignore_index=True)
+        bucket_df = bucket_df.astype({'pseudoid_pid': 'int32', 'days': 'int32', 'feature': 'str', 'value': 'float32'})
+
+        bucket_dir = os.path.join(self.store_dir, f'bucket={bucket}')
+        os.makedirs(bucket_dir, exist_ok=True)
+        part_number = self.part_numbers.get(bucket, 0)
+        bucket_df.to_parquet(os.path.join(bucket_dir, f'part-{part_number:05d}.parquet'), index=False)
+
+        self.part_numbers[bucket] = part_number + 1
+        self.buffers[bucket] = []
+        self.buffered_rows[bucket] = 0
+
+    def close(self):
+        """Writes all the buffered rows."""
+        for bucket in list(self.buffers):
+            self.flush(bucket)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_feature_store(store_dir, patient_ids=None, init_day=None, end_day=None, n_buckets=32):
+    """
+    Reads the observed cells of the store in one bulk read.
+
+    Args:
+        store_dir (str): Directory of the store.
+        patient_ids (list): Restrict the read to these patients.
+        init_day (int): First day of the range to read.
+        end_day (int): Last day of the range to read.
+        n_buckets (int): Number of buckets the store was written with.
+
+    Returns:
+        pd.DataFrame: The long (pseudoid_pid, days, feature, value) rows.
+    """
+    filters = []
+    if patient_ids is not None:
+        patient_ids = [int(patient_id) for patient_id in patient_ids]
+        buckets = sorted(patient_bucket(patient_ids, n_buckets).unique().tolist())
+        filters += [('bucket', 'in', buckets), ('pseudoid_pid', 'in', patient_ids)]
+    if init_day is not None:
+        filters.append(('days', '>=', init_day))
+    if end_day is not None:
+        filters.append(('days', '<=', end_day))
+
+    long_df = pd.read_parquet(store_dir, columns=['pseudoid_pid', 'days', 'feature', 'value'], filters=filters or None)
+    return long_df.reset_index(drop=True)
+
+
+def to_patient_frames(long_df):
+    """
+    Splits the long rows of the store into the per-patient day x feature matrices.
+
+    Args:
+        long_df (pd.DataFrame): Rows returned by read_feature_store.
+
+    Returns:
+        dict: Patient id -> DataFrame with a 'days' column and one column per feature of the patient,
+            sorted by day, like the 'patient_{id}.csv' files.
+    """
+    ## Pivot all the patients at once, then split by patient and drop the features a patient never had
+    wide_df = long_df.pivot_table(index=['pseudoid_pid', 'days'], columns='feature', values='value', observed=True)
+    wide_df.columns.name = None
+
+    patient_frames = {}
+    for patient, patient_df in wide_df.groupby(level='pseudoid_pid'):
+        patient_df = patient_df.dropna(axis=1, how='all').reset_index(level='days').reset_index(drop=True)
+        patient_frames[patient] = patient_df.sort_values(by=['days']).reset_index(drop=True)
+    return patient_frames
+
+
+def read_patient_frames(store_dir, patient_ids=None, init_day=None, end_day=None, n_buckets=32):
+    """
+    Reads the day x feature matrices of a list of patients from the store.
+
+    Args:
+        store_dir (str): Directory of the store.
+        patient_ids (list): Restrict the read to these patients.
+        init_day (int): First day of the range to read.
+        end_day (int): Last day of the range to read.
+        n_buckets (int): Number of buckets the store was written with.
+
+    Returns:
+        dict: Patient id -> day x feature DataFrame.
+    """
+    return to_patient_frames(read_feature_store(store_dir, patient_ids, init_day, end_day, n_buckets))
@@ -0,0 +1,117 @@
+"""
+Laboratory ontology shared by the lab categorization and the feature ordering.
+
+The ontology is built once from the lab families (family -> lab names) and the canonical feature
+order of 'lab_parameter_grouping.csv'. It holds an inverted lab_name -> (family, code) index, so a
+whole lab table is categorized with one mapping over its distinct lab names instead of scanning the
+family lists for every row.
+"""
+
+import functools
+import numpy as np
+import pandas as pd
+
+
+UNKNOWN_FAMILY = 'Unknown'
+
+LAB_CATEGORIES = {
+    'Blood Cells': ['Basophile', 'Lymphozyten', 'Monozyten', 'Neutrophile', 'Erythrozyten',
+                    'Immature-Granulozyten'],
+    'Coagulation': ['aPTT', 'Fibrinogen', 'INR', 'Thrombozyten'],
+    'Liver Function': ['ALAT', 'ASAT', 'G-Glutamyltransferase'],
+    'Inflammation': ['C-reaktives'],
+    'Renal Function': ['eGFR', 'Harnstoff', 'Kreatinin'],
+    'Metabolic Panel': ['Bicarbonat', 'Glucose', 'Kalium', 'Natrium', 'pH'],
+    'Cardiac Markers': ['Troponin-T-hs', 'Troponin-I-hs', 'NT-proBNP'],
+    'Other': ['D-Dimere', 'Lactat', 'LDH', 'MCH', 'MCHC', 'MCV', 'POCT-BNP', 'pO2', 'PCT', 'RDW', 'Immature', 'Ferritin',
+              'Lactat-Dehydrogenase', 'Troponin']
+}
+
+
+class LabOntology:
+    """
+    Inverted index of the lab names and canonical order of the lab features.
+
+    Args:
+        lab_categories (dict): Family -> list of lab names. A lab name listed in several families
+            belongs to the first one.
+        feature_order (list): Canonical order of the lab features (the 'lab_parameter' column of
+            'lab_parameter_grouping.csv').
+    """
+
+    def __init__(self, lab_categories=LAB_CATEGORIES, feature_order=()):
+        self.families = list(lab_categories) + [UNKNOWN_FAMILY]
+        self.unknown_code = len(self.families) - 1
+        self.family_code_of = {}
+        for family_code, lab_names in enumerate(lab_categories.values()):
+            for lab_name in lab_names:
+                self.family_code_of.setdefault(lab_name, family_code)
+
+        self.feature_order = list(feature_order)
+        self.code_of = {}
+        for code, lab_name in enumerate(self.feature_order):
+            self.code_of.setdefault(lab_name, code)
+
+    def categorize(self, lab_names):
+        """
+        Maps every lab name to its family in one pass over the distinct names.
+
+        Args:
+            lab_names (pd.Series): The lab names of the rows.
+
+        Returns:
+            pd.Series: Categorical family of every row, 'Unknown' for the names outside the ontology.
+        """
+        codes, uniques = pd.factorize(lab_names)
+        ## The extra last entry makes the missing lab names (code -1) unknown as well
+        family_codes = np.array([self.family_code_of.get(lab_name, self.unknown_code) for lab_name in uniques]
+                                + [self.unknown_code], dtype='int64')
+        families = pd.Categorical.from_codes(family_codes[codes], categories=self.families)
+        return pd.Series(families, index=lab_names.index, name='lab_categories')
+
+    def feature_codes(self, lab_names):
+        """
+        Maps every lab name to its position in the canonical feature order.
+
+        Args:
+            lab_names (pd.Series): The lab names of the rows.
+
+        Returns:
+            pd.Series: int code of every row, -1 for the names outside the canonical order.
+        """
+        codes, uniques = pd.factorize(lab_names)
+        unique_codes = np.array([self.code_of.get(lab_name, -1) for lab_name in uniques] + [-1], dtype='int64')
+        return pd.Series(unique_codes[codes], index=lab_names.index, name='lab_code')
+
+    def sort_columns(self, df, leading_columns=('patient_id',)):
+        """
+        Orders the feature columns of a DataFrame in the canonical order.
+
+        Args:
+            df (pd.DataFrame): DataFrame with one column per lab feature.
+            leading_columns (tuple): Columns kept first, before the features.
+
+        Returns:
+            pd.DataFrame: The DataFrame with the leading columns and the canonical features, like
+                reindexing by the 'lab_parameter' column of 'lab_parameter_grouping.csv'.
+        """
+        return df.reindex(columns=list(leading_columns) + self.feature_order)
+
+
+@functools.lru_cache(maxsize=None)
+def load_lab_ontology(grouping_file=None, parameter_column='lab_parameter'):
+    """
+    Loads the lab ontology once per grouping file.
+
+    Args:
+        grouping_file (str): Path of 'lab_parameter_grouping.csv' with the canonical feature order.
+            Without it the ontology only holds the lab families.
+        parameter_column (str): Column of the grouping file with the lab features.
+
+    Returns:
+        LabOntology: The shared ontology.
+    """
+    feature_order = ()
+    if grouping_file is not None:
+        feature_order = pd.read_csv(grouping_file, sep=',', header=0)[parameter_column].tolist()
+    return LabOntology(LAB_CATEGORIES, feature_order)
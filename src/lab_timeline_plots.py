@@ -0,0 +1,172 @@
+"""
+Headless batch rendering of the patient lab timelines.
+
+Batch counterpart of group_and_plot_data in extract_clinical_data: every (patient, lab category)
+timeline is rendered to an image file in a process pool whose workers use the non-interactive Agg
+backend, so importing the module does not change the backend of the caller. Every worker keeps one
+figure per number of subplots and clears it between renders instead of creating a new figure, and the
+per-point value annotations are skipped above a point-count threshold.
+"""
+
+import os
+import re
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from lab_ontology import load_lab_ontology
+
+
+## Figures reused by the renders of a worker, keyed by number of subplots
+_FIGURES = {}
+
+
+def init_render_worker():
+    """Selects the non-interactive Agg backend in a render worker, no display is needed."""
+    matplotlib.use('Agg')
+
+
+def get_figure(num_rows):
+    """
+    Returns a cleared figure with one subplot per row, reused across the renders of the process.
+
+    Args:
+        num_rows (int): Number of subplots.
+
+    Returns:
+        tuple: (fig, axes) with axes as a flat array.
+    """
+    if num_rows not in _FIGURES:
+        fig, axes = plt.subplots(nrows=num_rows, ncols=1, figsize=(8, 10), sharex=True, squeeze=False)
+        _FIGURES[num_rows] = (fig, axes.flatten())
+    fig, axes = _FIGURES[num_rows]
+    for ax in axes:
+        ax.cla()
+    return fig, axes
+
+
+def add_lab_days(df, id_column='pseudoid_pid', date_column='lab_req_date', lab_column='lab_name'):
+    """
+    Adds the days since the first measurement of every (patient, lab) pair, for the whole table at once.
+
+    Args:
+        df (pd.DataFrame): The lab rows.
+        id_column (str): Column with the patient id.
+        date_column (str): Column with the measurement dates.
+        lab_column (str): Column with the lab names.
+
+    Returns:
+        pd.DataFrame: The rows with a 'days' column.
+    """
+    dates = pd.to_datetime(df[date_column])
+    first_dates = dates.groupby([df[id_column], df[lab_column]], observed=True).transform('min')
+    return df.assign(days=(dates - first_dates).dt.days)
+
+
+def safe_file_name(name):
+    """Replaces the characters that are not safe in a file name."""
+    return re.sub(r'[^A-Za-z0-9._-]+', '_', str(name))
+
+
+def render_patient(patient_id, patient_data, output_dir, max_days, annotate_max_points=50, image_format='png'):
+    """
+    Renders the lab timelines of one patient, one image per lab category.
+
+    Args:
+        patient_id (int): The patient id.
+        patient_data (pd.DataFrame): The rows of the patient with 'lab_categories' and 'days' columns.
+        output_dir (str): Directory for the images.
+        max_days (int): Maximum number of days to plot.
+        annotate_max_points (int): Annotate the values only when a lab has at most this many points.
+        image_format (str): Image format of the files.
+
+    Returns:
+        list: Paths of the rendered images.
+    """
+    image_files = []
+    patient_data = patient_data[patient_data['days'] <= max_days]
+    for lab_category, category_data in patient_data.groupby('lab_categories', observed=True, sort=False):
+        lab_groups = list(category_data.groupby('lab_name', observed=True, sort=False))
+        if not lab_groups:
+            continue
+        fig, axes = get_figure(len(lab_groups))
+
+        for ax, (lab_name, lab_data) in zip(axes, lab_groups):
+            ax.set_title(lab_name)
+            lab_data = lab_data.sort_values(by='lab_nval')
+            ax.scatter(lab_data['days'], lab_data['lab_nval'], marker='o')
+
+            ## Text artists dominate the render time of the dense timelines
+            if len(lab_data) <= annotate_max_points:
+                for x, y in zip(lab_data['days'], lab_data['lab_nval']):
+                    ax.text(x, y, str(y), ha='center', va='bottom')
+
+        fig.suptitle(f'Patient ID: {patient_id} - Lab Category: {lab_category}')
+        fig.tight_layout()
+        image_file = os.path.join(output_dir, f'patient_{patient_id}_{safe_file_name(lab_category)}.{image_format}')
+        fig.savefig(image_file, format=image_format)
+        image_files.append(image_file)
+    return image_files
+
+
+def render_patient_batch(batch_df, output_dir, max_days, annotate_max_points=50, image_format='png'):
+    """
+    Renders the lab timelines of a batch of patients in one worker.
+
+    Args:
+        batch_df (pd.DataFrame): The rows of the patients of the batch.
+        output_dir (str): Directory for the images.
+        max_days (int): Maximum number of days to plot.
+        annotate_max_points (int): Annotate the values only when a lab has at most this many points.
+        image_format (str): Image format of the files.
+
+    Returns:
+        int: Number of rendered images.
+    """
+    n_images = 0
+    for patient_id, patient_data in batch_df.groupby('pseudoid_pid', sort=False):
+        n_images += len(render_patient(patient_id, patient_data, output_dir, max_days, annotate_max_points, image_format))
+    return n_images
+
+
+def render_lab_timelines(df, output_dir, max_days, patient_ids=None, n_workers=None, batch_size=64,
+                         annotate_max_points=50, image_format='png'):
+    """
+    Renders the lab timelines of all (or a list of) patients to image files.
+
+    Args:
+        df (pd.DataFrame): The lab rows, with or without the 'lab_categories' column of categorize_data.
+        output_dir (str): Directory for the images, 'patient_{id}_{category}.{format}'.
+        max_days (int): Maximum number of days to plot.
+        patient_ids (list): Restrict the rendering to these patients.
+        n_workers (int): Number of worker processes, all the CPUs by default.
+        batch_size (int): Number of patients sent to a worker at once.
+        annotate_max_points (int): Annotate the values only when a lab has at most this many points.
+        image_format (str): Image format of the files.
+
+    Returns:
+        int: Number of rendered images.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if patient_ids is not None:
+        df = df[df['pseudoid_pid'].isin(patient_ids)]
+    if 'lab_categories' not in df.columns:
+        df = df.assign(lab_categories=load_lab_ontology().categorize(df['lab_name']))
+    df = add_lab_days(df)
+
+    ## Contiguous patients per batch, so a batch is a slice of the sorted table
+    df = df.sort_values('pseudoid_pid', kind='stable')
+    unique_ids = df['pseudoid_pid'].unique()
+    batch_starts = np.searchsorted(df['pseudoid_pid'].to_numpy(), unique_ids[::batch_size])
+    batch_stops = np.append(batch_starts[1:], len(df))
+
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=init_render_worker) as executor:
+        futures = [executor.submit(render_patient_batch, df.iloc[start:stop], output_dir, max_days,
+                                   annotate_max_points, image_format)
+                   for start, stop in zip(batch_starts, batch_stops)]
+        n_images = sum(future.result() for future in futures)
+
+    print(f"{n_images} lab timelines rendered to {output_dir}")
+    return n_images
@@ -4,6 +4,14 @@ import os
 import matplotlib.pyplot as plt
 import csv
 
+from date_normalization import normalize_dates
+from timeline_alignment import add_admission_days
+from pivot_engine import aggregate_features, split_patient_matrices
+from cohort_criteria import COHORTS, RIS_EXAMINATION_TYPES, exam_events, select_cohort
+from cohort_sweep import sweep_cohort
+from output_sinks import CsvSink, patient_row_slices
+from data_paths import IDSC_DATA_DIR, PATIENTOMICS_DATA_DIR
+
 
 def read_csv(file_path, sep=','):
     """
@@ -20,7 +28,8 @@ def read_csv(file_path, sep=','):
 
 def preprocess_data(df, column_name):
     """
-    Preprocesses the DataFrame by converting lab_req_date to datetime format and sorting by column_name.
+    Preprocesses the DataFrame by converting column_name to datetime format and sorting by column_name.
+    The date format is detected once and only the unique dates are parsed; rows that fail to parse are reported.
 
     Args:
         df (pd.DataFrame): The input DataFrame.
@@ -28,7 +37,7 @@ def preprocess_data(df, column_name):
     Returns:
         pd.DataFrame: The preprocessed DataFrame.
     """
-    df[column_name] = pd.to_datetime(df[column_name])
+    df[column_name], _ = normalize_dates(df[column_name])
     df = df.sort_values(column_name)
     return df
 
@@ -61,28 +70,23 @@ def feature_extractor_per_patient_OLD(df, output_dir, feature_column_name, date_
 
 
 def feature_extractor_per_patient(df, output_dir, feature_column_name, date_column_name, value_column_name):
-    grouped_df = df.groupby('pseudoid_pid')
-
-
     ## Read the hospitalization timeline csv file
     general_data_file_name = "general_data"
-    hosp_timeline_file_name = "/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/dicts/" + general_data_file_name + "_hosp_timeline.csv" 
+    hosp_timeline_file_name = PATIENTOMICS_DATA_DIR + "dicts/" + general_data_file_name + "_hosp_timeline.csv" 
     hosp_timeline_df = read_csv(hosp_timeline_file_name, sep=',')
     # hosp_timeline = hosp_timeline_df[['pseudoid_pid', 'date_admission_hosp', 'date_discharge_hosp']]
 
     ## Preprocess the date column
     hosp_timeline_data = preprocess_data(hosp_timeline_df, 'date_admission_hosp')
 
+    ## derive the days from the first hospitalization date for all the rows at once
+    df = add_admission_days(df, hosp_timeline_data, date_column_name)
+    grouped_df = df.groupby('pseudoid_pid')
+
 
     for patient, data in grouped_df:
         patient_df = pd.DataFrame()
 
-        ## Get the hospitalization timeline for the patient
-        patient_hosp_timeline = hosp_timeline_data[hosp_timeline_data['pseudoid_pid'] == patient]
-
-        ## Get the first hospitalization date
-        first_hosp_date = patient_hosp_timeline['date_admission_hosp'].min()
-
         # ## Get the last hospitalization date
         # last_hosp_date = patient_hosp_timeline['date_discharge_hosp'].max()
 
@@ -92,10 +96,6 @@ def feature_extractor_per_patient(df, output_dir, feature_column_name, date_colu
 
         ## Function 
         for feature_name, feature_data in data.groupby(feature_column_name):
-            min_date = first_hosp_date
-            ## derive the days from the first hospitalization date
-            feature_data['days'] = (feature_data[date_column_name] - min_date).dt.days
-
             ## Convert value to numeric, handling non-numeric values
             feature_data[value_column_name] = pd.to_numeric(feature_data[value_column_name], errors='coerce')
 
@@ -140,7 +140,7 @@ def sort_dataframe_columns(dataframe):
 
 
 ##############################################################################################################
-def launcher_pipeline(file_name, sep, feature_column_name, date_column_name, value_column_name):
+def launcher_pipeline(file_name, sep, feature_column_name, date_column_name, value_column_name, sweep_grid=None):
     """
     Script to select the potential long covid patients from the dataset.
 
@@ -150,13 +150,18 @@ def launcher_pipeline(file_name, sep, feature_column_name, date_column_name, val
     
     Step 2: Calculate the days from the first hospitalization date
 
-    Step 3: Filter the patients medical imaging ('ris_examination_type') follow-up with the following criteria:
-        - At least 2 medical imaging in the first 60 days from the first hospitalization date
-        - At least 1 medical imaging after 120 days from the first hospitalization date
+    Step 3: Filter the patients medical imaging ('ris_examination_type') follow-up with the following criteria,
+    evaluated for all the patients at once from their (patient, day, exam type) aggregate:
+        - At least 1 medical imaging after 150 days from the first hospitalization date
+        - At least 1 medical imaging from 15 days before the first hospitalization date
+        - At least 1 CT exam type (cohort_criteria.CT_EXAMINATION_TYPES)
+
+    With a sweep_grid ((criterion position, parameter) -> values, see cohort_sweep.sweep_cohort) the cohort
+    size and members of every threshold combination are also saved to 'potential_long_covid_threshold_sweep.csv'.
     """
 
     # # Step 1: Read the CSV file into a DataFrame
-    dir_CDA_features = "/home/jagh/Documents/01_UB/10_Conferences_submitted/11_Second_paper/00_dataset/03_Insel_dataset/01_Preprocessing_IDSC202101463_data_v13_20221214/"
+    dir_CDA_features = IDSC_DATA_DIR
     csv_file_path = os.path.join(dir_CDA_features, file_name + ".csv")
     df = read_csv(csv_file_path, sep=sep)
 
@@ -174,160 +179,66 @@ def launcher_pipeline(file_name, sep, feature_column_name, date_column_name, val
     df = df[df['ris_examination_begin'] >= '2020-03-01']
 
     ## Step 3.2: Filter the patients with 'ris_examination_type' == 'CTA, CTTH, TH'
-    df = df[df['ris_examination_type'].isin(['CTA', 'CTHATHAB', 'CTHATHOB', 'CTHTH', 'CTHTHABD', 'CTTH', 'CTTHABD', 'CTTHOB', 'CTUB', 'IMPCTTH', 'IMPCTTHAB', 'TH'])]
+    df = df[df['ris_examination_type'].isin(RIS_EXAMINATION_TYPES)]
     # print("df: ", df.head())
 
 
     ##############################################################
     ##############################################################
     ## Step 4: Calculate the days from the first hospitalization date
-    grouped_df = df.groupby('pseudoid_pid')
 
     ## Read the hospitalization timeline csv file
     general_data_file_name = "general_data"
-    hosp_timeline_file_name = "/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/dicts/" + general_data_file_name + "_hosp_timeline.csv" 
+    hosp_timeline_file_name = PATIENTOMICS_DATA_DIR + "dicts/" + general_data_file_name + "_hosp_timeline.csv" 
     hosp_timeline_df = read_csv(hosp_timeline_file_name, sep=',')
 
     ## Preprocess the date column
     hosp_timeline_data = preprocess_data(hosp_timeline_df, 'date_admission_hosp')
 
+    ## derive the days from the first hospitalization date for all the rows at once
+    df = add_admission_days(df, hosp_timeline_data, date_column_name)
 
     ##############################################################
-    ## Set the store list
-    potential_long_covid_patients = []
-    potential_long_covid_patients.append('pseudoid_pid')
-
-    ## Set the full data list
-    long_covid_selected = pd.DataFrame()
-
-    for patient, data in grouped_df:
-        patient_df = pd.DataFrame()
-        full_data = pd.DataFrame()
-
-        ## Get the hospitalization timeline for the patient
-        patient_hosp_timeline = hosp_timeline_data[hosp_timeline_data['pseudoid_pid'] == patient]
-
-        ## Get the first hospitalization date
-        first_hosp_date = patient_hosp_timeline['date_admission_hosp'].min()
-
-        ## Filter the patients medical imaging ('ris_examination_type') follow-up with the following criteria:
-        for feature_name, feature_data in data.groupby(feature_column_name):
-            min_date = first_hosp_date
-
-            ## derive the days from the first hospitalization date
-            feature_data['days'] = (feature_data[date_column_name] - min_date).dt.days
-
-            ##############
-            ## Get the additional data
-            full_data = pd.concat([full_data, feature_data])
-            ##############
-
-            ## Convert value to numeric, handling non-numeric values
-            feature_data[value_column_name] = pd.to_numeric(feature_data[value_column_name], errors='coerce')
-
-            feature_data = feature_data.pivot_table(index=feature_column_name, columns='days', values=value_column_name, aggfunc='mean')
-            feature_data.columns = [f'{day}' for day in feature_data.columns]
-
-            patient_df = pd.concat([patient_df, feature_data])
-
-            ## sort the columns
-            # patient_df = patient_df.reindex(sorted(patient_df.columns), axis=1)
-            patient_df = patient_df.reindex(sorted(patient_df.columns, key=lambda x: int(x) if x.isdigit() else float('inf')), axis=1)
-
-
-        # ##############################################################
-        # ## Step 5: Save patients containing at least 1 colume with header name => 120 days
-        # other_df = patient_df[patient_df.columns[patient_df.columns.str.contains('30')]]
-        # # print("other_df: ", other_df.head())
-
-
-        # ##############################################################
-        patient_df.columns = pd.to_numeric(patient_df.columns, errors='coerce')
-
-        ###############
-        ## Criteria 1: Filter columns based on column headers greater than 120
-        filtered_criteria_1 = [col for col in patient_df.columns if col > 150]
-        
-        # Check if any columns meet the criteria
-        if filtered_criteria_1:
-            # filtered_df = patient_df[filtered_criteria_1]
-            # print("Filtered dataframe saved successfully.")
-
-            ###############
-            ## Criteria 2: Check if there are more that two CTs between 0 and 60
-            filtered_criteria_2 = [col for col in patient_df.columns if col > -15]
-
-            if len(filtered_criteria_2) >= 1:
-                # print("patient_df: ", patient_df.head())
-
-                ###############
-                ## Criteria 3: Check if there are more that two images labaled as 'CTA' or 'CTTH in the patient_df
-                patient_df_t = patient_df.T
-                # print("patient_df_t: ", patient_df_t.head())
-
-                total_count = 0
-                columns = patient_df_t.columns.tolist()
-
-                ##  List of items to count
-                items_to_count = [
-                    'CTA', 'CTHATHAB', 'CTHATHOB', 'CTHTH', 'CTHTHABD',
-                    'CTTH', 'CTTHABD', 'CTTHOB', 'IMPCTTH', 'IMPCTTHAB'
-                ]
-
-                ## Count the items in the columns
-                for item in items_to_count:
-                    item_count = columns.count(item)
-                    total_count += item_count
-
-                # ## Print the total count
-                # if total_count > 0:
-                #     print("+ Positive total_count:", total_count)
-                # else:
-                #     print("+ Negative total_count:", total_count)
-                
-
-                ## Parameter to include at least 2 CTA or CTTH in total
-                if total_count >= 1:
-                    # Save filtered dataframe to a CSV file
-                    output_dir = "/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/03_long_covid_potential_patients/"
-                    patient_df_file = os.path.join(output_dir, f'patient_{patient}.csv')
-
-                    # Create the directory if it doesn't exist
-                    os.makedirs(output_dir, exist_ok=True)
-                    
-                    ## Transpose the patient_df dataframe
-                    patient_df_t2 = patient_df.T
-
-
-                    # set the patient_df_t2 index with the column name 'days' in the first column
-                    patient_df_t2.index.name = 'days'
-                    patient_df_t2.to_csv(patient_df_file)
-
-                    ####################
-                    # ## Save the additional data to the dataframe
-                    # full_patient_df_t = full_data
-                    # full_patient_df_t.to_csv(patient_df_file, index=False)
-
-                    ## Add selected patient to the long covid selected dataframe
-                    long_covid_selected = pd.concat([long_covid_selected, full_data])
-                
-                    ####################
-                    ## Added the patient to the list of potential long covid patients
-                    potential_long_covid_patients.append(patient)
-
-        else:
-            # print("No columns with headers greater than 5 found.")
-            pass
-
-    ## Save the list of potential long covid patients to a CSV file
+    ## Step 5: Aggregate the imaging of all the patients at once into (patient, day, exam type) means
+    aggregated = aggregate_features(df, feature_column_name, value_column_name)
+    patients = pd.DataFrame(index=pd.Index(df['pseudoid_pid'].unique(), name='pseudoid_pid')).sort_index()
+
+    ## Criteria (see cohort_criteria.COHORTS):
+    ##    - follow-up imaging after day 150
+    ##    - imaging from day -15
+    ##    - at least one CT exam type
+    events = exam_events(aggregated)
+    selected = select_cohort(events, patients, COHORTS['potential_long_covid'])
+    potential_long_covid_patients = patients.index[selected].tolist()
+    print(f"{len(potential_long_covid_patients)} potential long covid patients out of {len(patients)}")
+
+    output_dir = PATIENTOMICS_DATA_DIR + "03_long_covid_potential_patients/"
+    os.makedirs(output_dir, exist_ok=True)
+
+    ## Sensitivity of the cohort to its thresholds, all the combinations in one pass
+    if sweep_grid is not None:
+        sweep_df = sweep_cohort(events, patients, COHORTS['potential_long_covid'], sweep_grid)
+        sweep_df['members'] = sweep_df['members'].map(bytes.hex)
+        sweep_df.to_csv(os.path.join(output_dir, 'potential_long_covid_threshold_sweep.csv'), index=False)
+        print(sweep_df.drop(columns='members').to_string(index=False))
+
+    ## Step 6: Save the day x exam type matrix of the selected patients only, with their imaging rows
+    ## (grouped by exam type) and ids appended to the list files as they are written
     potential_long_covid_patients_file = os.path.join(output_dir, f'potential_long_covid_patients_pseudoid_pid.csv')
-    potential_long_covid_patients_df = pd.DataFrame(potential_long_covid_patients)
-    potential_long_covid_patients_df.to_csv(potential_long_covid_patients_file, index=False)
-
-    ####################
-    ## Save the additional data to the dataframe
     long_covid_selected_file = os.path.join(output_dir, f'potential_long_covid_patients_ris_information.csv')
-    long_covid_selected.to_csv(long_covid_selected_file, index=False)
+    df = df.sort_values(['pseudoid_pid', feature_column_name], kind='stable')
+    selected_aggregated = aggregated[aggregated.index.get_level_values(0).isin(potential_long_covid_patients)]
+
+    with CsvSink(potential_long_covid_patients_file, columns=[0]) as patients_sink, \
+            CsvSink(long_covid_selected_file, columns=df.columns) as ris_sink:
+        patients_sink.write(pd.DataFrame(['pseudoid_pid']))
+        ## Every selected patient has imaging, so both iterate the same sorted patients
+        patient_rows = patient_row_slices(df, potential_long_covid_patients)
+        for (patient, patient_df), (_, patient_ris) in zip(split_patient_matrices(selected_aggregated), patient_rows):
+            patient_df_file = os.path.join(output_dir, f'patient_{patient}.csv')
+            patient_df.to_csv(patient_df_file, index=False)
+            patients_sink.write(pd.DataFrame([patient]))
+            ris_sink.write(patient_ris)
 
 
 ################################################################################################################
@@ -341,3 +252,6 @@ value_column_name = 'value'
 
 launcher_pipeline(file_name, sep, feature_column_name, date_column_name, value_column_name)
 
+# ## Sensitivity analysis: follow-up after day 120 or 150, imaging from day -15 or within days -15..60, 1 or 2 CT types
+# sweep_grid = {(0, 'after'): [120, 150], (1, 'before'): [None, 60], (2, 'min_count'): [1, 2]}
+# launcher_pipeline(file_name, sep, feature_column_name, date_column_name, value_column_name, sweep_grid=sweep_grid)
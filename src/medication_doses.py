@@ -0,0 +1,140 @@
+"""
+Dose resolution of the IDSC medications extract.
+
+The administered dose ('med_given_dose') and the prescribed dose ('med_dose') are parsed and
+coalesced once for the whole table: the administered dose is used when present, the prescribed dose
+otherwise. Doses written with a unit ('500 mg', '0,5 g', '1000 IE') are converted to a canonical unit
+per dimension, so the per-patient extraction only aggregates one numeric column. The doses of an ATC
+code in another dimension than its most frequent unit are dropped, so mg, ml and IE doses of the same
+code are never averaged together.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+## Leading number (with '.' or ',' as decimal separator) and an optional unit
+DOSE_PATTERN = r'^\s*([-+]?(?:\d+(?:[.,]\d*)?|[.,]\d+)(?:[eE][-+]?\d+)?)\s*([^\d\s].*?)?\s*$'
+
+## Unit -> (canonical unit, factor to the canonical unit)
+DOSE_UNITS = {
+    'g': ('mg', 1000.0),
+    'mg': ('mg', 1.0),
+    'mcg': ('mg', 1e-3),
+    'ug': ('mg', 1e-3),
+    'µg': ('mg', 1e-3),
+    'μg': ('mg', 1e-3),
+    'ng': ('mg', 1e-6),
+    'l': ('ml', 1000.0),
+    'ml': ('ml', 1.0),
+    'ie': ('IE', 1.0),
+    'iu': ('IE', 1.0),
+    'u': ('IE', 1.0),
+    'mmol': ('mmol', 1.0),
+}
+
+
+def parse_doses(series, report=True):
+    """
+    Parses a raw dose column into numeric values in a canonical unit.
+
+    Args:
+        series (pd.Series): The raw dose column, numeric or strings with an optional unit.
+        report (bool): Print a summary of the values that failed to parse.
+
+    Returns:
+        tuple: (values, units, failures) where values is the float dose in the canonical unit, units the
+            canonical unit (missing for doses without unit) and failures the raw values of the rows that
+            could not be parsed, indexed like the input rows.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        values = series.astype('float64')
+        return values, pd.Series(np.nan, index=series.index, dtype='object'), series.iloc[:0]
+
+    ## Parse the unique strings and map them back to the rows through their codes
+    codes, uniques = pd.factorize(series)
+    parts = pd.Series(pd.Index(uniques).astype(str)).str.extract(DOSE_PATTERN)
+
+    numbers = pd.to_numeric(parts[0].str.replace(',', '.', regex=False), errors='coerce')
+    raw_units = parts[1].str.lower()
+    canonical = raw_units.map(lambda unit: DOSE_UNITS.get(unit, (None, np.nan)) if isinstance(unit, str) else (np.nan, 1.0))
+    unit_uniques = canonical.str[0]
+    value_uniques = numbers * canonical.str[1].astype('float64')
+
+    ## Missing values have the code -1 and stay missing
+    values = pd.Series(value_uniques.reindex(codes).to_numpy(dtype='float64'), index=series.index, name=series.name)
+    units = pd.Series(unit_uniques.reindex(codes).to_numpy(), index=series.index, name=series.name)
+
+    failures = series[(codes >= 0) & values.isna().to_numpy()]
+    if report and len(failures) > 0:
+        examples = ', '.join(repr(value) for value in failures.unique()[:5])
+        print(f"Column '{series.name}': {len(failures)} doses failed to parse (e.g. {examples})")
+
+    return values, units, failures
+
+
+def keep_dominant_units(features, values, units, report=True):
+    """
+    Keeps the doses of every feature in its most frequent canonical unit.
+
+    The doses of a feature in another unit (e.g. ml doses of an ATC code dosed in mg) cannot be averaged
+    with the others and are set missing. The doses without unit are kept.
+
+    Args:
+        features (pd.Series): The feature keys (e.g. the ATC codes).
+        values (pd.Series): The doses in their canonical unit.
+        units (pd.Series): The canonical unit of every row, missing for the doses without unit.
+        report (bool): Print a summary of the dropped doses.
+
+    Returns:
+        pd.Series: The doses, missing for the rows in another unit than the unit of their feature.
+    """
+    with_unit = (units.notna() & features.notna()).to_numpy()
+    if not with_unit.any():
+        return values
+    unit_counts = pd.DataFrame({'feature': features[with_unit].astype(str), 'unit': units[with_unit].astype(str)})
+    unit_counts = unit_counts.groupby(['feature', 'unit']).size().reset_index(name='count')
+    ## Ties go to the first unit in alphabetical order, so the choice does not depend on the row order
+    unit_counts = unit_counts.sort_values(['count', 'unit'], ascending=[False, True], kind='stable')
+    dominant_units = unit_counts.drop_duplicates('feature').set_index('feature')['unit']
+
+    row_units = features.astype('object').map(dominant_units)
+    other_unit = with_unit & (units.astype('object') != row_units).to_numpy() & values.notna().to_numpy()
+    if report and other_unit.any():
+        examples = ', '.join(f"{feature} in {unit}" for feature, unit in
+                             pd.DataFrame({'f': features[other_unit], 'u': units[other_unit]}).drop_duplicates().to_numpy()[:5])
+        print(f"{other_unit.sum()} doses in another unit than the main unit of their feature are dropped (e.g. {examples})")
+    return values.mask(other_unit)
+
+
+def resolve_medication_doses(df, dose_columns=('med_given_dose', 'med_dose'), value_column='med_dose_value',
+                             unit_column='med_dose_unit', feature_column=None, report=True):
+    """
+    Coalesces the dose columns of the medications into one normalized numeric dose.
+
+    Args:
+        df (pd.DataFrame): The medications rows.
+        dose_columns (tuple): Dose columns in order of precedence, the first parsed dose of a row is used.
+        value_column (str): Name of the added float32 dose column.
+        unit_column (str): Name of the added canonical unit column.
+        feature_column (str): Column with the feature keys. When given, only the doses in the most
+            frequent unit of their feature are kept (see keep_dominant_units). In chunked reads the most
+            frequent unit is taken per chunk.
+        report (bool): Print a summary of the doses that failed to parse.
+
+    Returns:
+        pd.DataFrame: The rows with the dose and unit columns added.
+    """
+    values = pd.Series(np.nan, index=df.index, dtype='float64')
+    units = pd.Series(np.nan, index=df.index, dtype='object')
+    for column in dose_columns:
+        if column not in df.columns:
+            continue
+        column_values, column_units, _ = parse_doses(df[column], report=report)
+        missing = values.isna()
+        values = values.where(~missing, column_values)
+        units = units.where(~missing, column_units)
+
+    if feature_column is not None and feature_column in df.columns:
+        values = keep_dominant_units(df[feature_column], values, units, report=report)
+    return df.assign(**{value_column: values.astype('float32'), unit_column: units.astype('category')})
@@ -0,0 +1,159 @@
+"""
+Numeric coercion of the value columns of the IDSC extracts, with censored results.
+
+The value columns are parsed once per source over their distinct raw strings. Results reported
+below or above the measurement range ('<0.5', '>1000', '<= 3') keep their bound as value and get a
+censoring flag, instead of being turned into NaN by pd.to_numeric. The raw strings that are still not
+numeric are counted per feature into a reject table and flagged, so the rules on missing values can
+tell them apart from the values that were missing in the extract.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+
+## Optional censoring sign and a number with '.' or ',' as decimal separator
+CENSORED_PATTERN = r'^\s*([<>]=?)?\s*([-+]?(?:\d+(?:[.,]\d*)?|[.,]\d+)(?:[eE][-+]?\d+)?)\s*$'
+
+## Censoring flag of the parsed values
+NOT_CENSORED = 0
+LEFT_CENSORED = -1
+RIGHT_CENSORED = 1
+
+REJECT_COLUMNS = ['feature', 'raw_value', 'count']
+
+
+def censored_column_name(column):
+    """Returns the name of the censoring flag column of a value column."""
+    return column + '_censored'
+
+
+def rejected_column_name(column):
+    """Returns the name of the column flagging the raw values of a value column that were not numeric."""
+    return column + '_rejected'
+
+
+def parse_censored(series):
+    """
+    Parses a raw value column into numeric values and censoring flags.
+
+    Args:
+        series (pd.Series): The raw values, numeric or strings like '12.5', '<0.5' or '>1000'.
+
+    Returns:
+        tuple: (values, censored, rejected) where values is the float64 value (the bound for the censored
+            results), censored the int8 flag (-1 below the bound, 1 above, 0 otherwise) and rejected a boolean
+            mask of the non-blank raw values that could not be parsed.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        return (series.astype('float64'), pd.Series(NOT_CENSORED, index=series.index, dtype='int8'),
+                pd.Series(False, index=series.index))
+
+    ## Parse the unique strings and map them back to the rows through their codes
+    codes, uniques = pd.factorize(series)
+    raw_values = pd.Series(pd.Index(uniques).astype(str))
+    parts = raw_values.str.extract(CENSORED_PATTERN)
+    numbers = pd.to_numeric(parts[1].str.replace(',', '.', regex=False), errors='coerce')
+    signs = parts[0].str[0].map({'<': LEFT_CENSORED, '>': RIGHT_CENSORED}).fillna(NOT_CENSORED)
+
+    ## The extra last entry keeps the missing values (code -1) missing and not censored
+    value_uniques = np.append(numbers.to_numpy(dtype='float64'), np.nan)
+    sign_uniques = np.append(signs.to_numpy(dtype='int8'), np.int8(NOT_CENSORED))
+    values = pd.Series(value_uniques[codes], index=series.index, name=series.name)
+    censored = pd.Series(sign_uniques[codes], index=series.index, name=censored_column_name(str(series.name)))
+    ## Blank strings are missing values, not rejects
+    rejected_uniques = np.append(numbers.isna().to_numpy() & (raw_values.str.strip() != '').to_numpy(), False)
+    rejected = pd.Series(rejected_uniques[codes], index=series.index)
+    return values, censored, rejected
+
+
+def count_rejects(df, column, rejected, feature_column=None):
+    """
+    Counts the rejected raw strings of a value column per feature.
+
+    Args:
+        df (pd.DataFrame): The rows, with the raw value column.
+        column (str): The value column.
+        rejected (pd.Series): Boolean mask of the rejected rows (see parse_censored).
+        feature_column (str): Column with the feature names, the counts are per raw string only without it.
+
+    Returns:
+        pd.DataFrame: One row per (feature, raw value) with its count, most frequent first.
+    """
+    if not rejected.any():
+        return pd.DataFrame(columns=REJECT_COLUMNS)
+    rows = df.loc[rejected.to_numpy()]
+    features = rows[feature_column].astype(str) if feature_column in df.columns else pd.Series('', index=rows.index)
+    counts = pd.DataFrame({'feature': features.to_numpy(), 'raw_value': rows[column].astype(str).to_numpy()})
+    counts = counts.groupby(['feature', 'raw_value'], sort=False).size().reset_index(name='count')
+    return counts.sort_values('count', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def coerce_numeric_columns(df, numeric_columns, feature_column=None, report=True):
+    """
+    Coerces the value columns of a source in one pass, keeping the censored results.
+
+    Args:
+        df (pd.DataFrame): The rows of the source.
+        numeric_columns (dict): Value column -> dtype of the coerced values.
+        feature_column (str): Column with the feature names, used for the reject table.
+        report (bool): Print a summary of the rejected values.
+
+    Returns:
+        tuple: (df, rejects) where df has the coerced columns, a '<column>_censored' int8 flag and a
+            '<column>_rejected' boolean flag per column, and rejects is the reject table of all the
+            columns (see count_rejects). The rejected values are NaN like the raw missing values, the
+            flag tells them apart.
+    """
+    rejects = []
+    for column, dtype in numeric_columns.items():
+        if column not in df.columns:
+            continue
+        values, censored, rejected = parse_censored(df[column])
+        column_rejects = count_rejects(df, column, rejected, feature_column)
+        if report and not column_rejects.empty:
+            examples = ', '.join(repr(value) for value in column_rejects['raw_value'].unique()[:5])
+            print(f"Column '{column}': {column_rejects['count'].sum()} values are not numeric (e.g. {examples})")
+        rejects.append(column_rejects.assign(column=column))
+        df = df.assign(**{column: values.astype(dtype), censored_column_name(column): censored,
+                          rejected_column_name(column): rejected.to_numpy()})
+
+    rejects = pd.concat(rejects, ignore_index=True) if rejects else pd.DataFrame(columns=['column'] + REJECT_COLUMNS)
+    return df, rejects[['column'] + REJECT_COLUMNS]
+
+
+def reject_table_path(csv_file_path):
+    """
+    Returns the path of the reject table of a source file, next to its columnar cache.
+
+    Args:
+        csv_file_path (str): Path to the source CSV file.
+
+    Returns:
+        str: Path of the reject table.
+    """
+    base_name = os.path.splitext(os.path.basename(csv_file_path))[0]
+    return os.path.join(os.path.dirname(os.path.abspath(csv_file_path)), '.rejects', base_name + '_numeric_rejects.csv')
+
+
+def write_reject_table(rejects, reject_file):
+    """
+    Sums the reject tables of the chunks of a source and writes them to a CSV file.
+
+    Args:
+        rejects (list): Reject tables returned by coerce_numeric_columns.
+        reject_file (str): Path of the CSV file.
+
+    Returns:
+        pd.DataFrame: The summed reject table.
+    """
+    rejects = [table for table in rejects if not table.empty]
+    if rejects:
+        table = pd.concat(rejects, ignore_index=True).groupby(['column', 'feature', 'raw_value'], sort=False)['count'].sum()
+        table = table.reset_index().sort_values('count', ascending=False, kind='stable')
+    else:
+        table = pd.DataFrame(columns=['column'] + REJECT_COLUMNS)
+    os.makedirs(os.path.dirname(reject_file), exist_ok=True)
+    table.to_csv(reject_file, index=False)
+    return table
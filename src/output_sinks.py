@@ -0,0 +1,148 @@
+"""
+Append-only output sinks for row batches.
+
+The selection scripts hand the rows of every selected patient to a sink as they are produced. The
+sink buffers the batches and appends them to its CSV or Parquet file once the buffer holds enough
+rows, so the memory stays bounded by the buffer and the cost is linear in the number of written rows,
+instead of growing one DataFrame with pd.concat for every selected patient.
+"""
+
+import os
+import abc
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class TableSink(abc.ABC):
+    """
+    Buffered append-only sink, base of the CSV and Parquet sinks.
+
+    Args:
+        output_file (str): Path of the output file. An existing file is replaced.
+        columns (list): Columns of the output, written as header even when no row is written. Taken
+            from the first batch when not given.
+        flush_rows (int): Number of buffered rows that triggers a flush.
+    """
+
+    def __init__(self, output_file, columns=None, flush_rows=100_000):
+        self.output_file = output_file
+        self.columns = None if columns is None else list(columns)
+        self.flush_rows = flush_rows
+        self.rows_written = 0
+        self._buffer = []
+        self._buffered_rows = 0
+        self._opened = False
+        os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+
+    def write(self, batch):
+        """
+        Appends a batch of rows, flushing the buffer when it is full.
+
+        Args:
+            batch (pd.DataFrame): The rows, with the columns of the sink.
+        """
+        if self.columns is None:
+            self.columns = list(batch.columns)
+        if len(batch) == 0:
+            return
+        self._buffer.append(batch[self.columns])
+        self._buffered_rows += len(batch)
+        if self._buffered_rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        """Appends the buffered rows to the output file."""
+        if not self._buffer and self._opened:
+            return
+        frame = pd.concat(self._buffer, ignore_index=True) if self._buffer else pd.DataFrame(columns=self.columns or [])
+        self._append(frame, first=not self._opened)
+        self._opened = True
+        self.rows_written += len(frame)
+        self._buffer = []
+        self._buffered_rows = 0
+
+    def close(self):
+        """Flushes the remaining rows and closes the output file."""
+        self.flush()
+
+    @abc.abstractmethod
+    def _append(self, frame, first):
+        """Appends a frame to the output file, the first call creates the file."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CsvSink(TableSink):
+    """Append-only CSV sink, the header is written with the first flush."""
+
+    def __init__(self, output_file, columns=None, flush_rows=100_000, **to_csv_kwargs):
+        super().__init__(output_file, columns, flush_rows)
+        self.to_csv_kwargs = {'index': False, **to_csv_kwargs}
+
+    def _append(self, frame, first):
+        frame.to_csv(self.output_file, mode='w' if first else 'a', header=first, **self.to_csv_kwargs)
+
+
+class ParquetSink(TableSink):
+    """Append-only Parquet sink, every flush is written as one row group."""
+
+    def __init__(self, output_file, columns=None, flush_rows=100_000, compression='zstd'):
+        super().__init__(output_file, columns, flush_rows)
+        self.compression = compression
+        self._writer = None
+
+    def _append(self, frame, first):
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.output_file, table.schema, compression=self.compression)
+        else:
+            ## Later batches are cast to the schema of the first one (e.g. all-null columns)
+            table = table.cast(self._writer.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        super().close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def open_sink(output_file, columns=None, flush_rows=100_000):
+    """
+    Opens the sink matching the extension of the output file ('.parquet' or '.csv').
+
+    Args:
+        output_file (str): Path of the output file.
+        columns (list): Columns of the output.
+        flush_rows (int): Number of buffered rows that triggers a flush.
+
+    Returns:
+        TableSink: The sink, to use as a context manager.
+    """
+    if output_file.endswith('.parquet'):
+        return ParquetSink(output_file, columns, flush_rows)
+    return CsvSink(output_file, columns, flush_rows)
+
+
+def patient_row_slices(df, patient_ids, id_column='pseudoid_pid'):
+    """
+    Returns the rows of every patient of a table sorted by patient, as slices.
+
+    Args:
+        df (pd.DataFrame): The rows, sorted by patient id.
+        patient_ids (list): The patients, in the order of the yielded slices.
+        id_column (str): Column with the patient id.
+
+    Yields:
+        tuple: (patient, DataFrame with the rows of the patient)
+    """
+    sorted_ids = df[id_column].to_numpy()
+    starts = sorted_ids.searchsorted(patient_ids, side='left')
+    stops = sorted_ids.searchsorted(patient_ids, side='right')
+    for patient, start, stop in zip(patient_ids, starts, stops):
+        yield patient, df.iloc[start:stop]
@@ -0,0 +1,150 @@
+"""
+Patient row-range index over the cached IDSC extracts.
+
+The typed source is rewritten once per extract as a Parquet file sorted by patient, together with a
+sidecar index that maps every pseudoid_pid to its row range and row groups. Cohort-restricted runs
+then read only the row groups holding the requested patients instead of the whole extract.
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from clinical_cache import cache_paths, source_fingerprint, read_source_cached
+
+
+INDEX_VERSION = 3
+
+
+def index_paths(csv_file_path, cache_dir=None):
+    """
+    Returns the paths of the patient-sorted data, its row-range index and its cache key.
+
+    Args:
+        csv_file_path (str): Path to the source CSV file.
+        cache_dir (str): Directory of the cache. Defaults to '.cache' next to the source file.
+
+    Returns:
+        tuple: (data_path, index_path, key_path)
+    """
+    parquet_path, _ = cache_paths(csv_file_path, cache_dir)
+    base_path = os.path.splitext(parquet_path)[0] + '.by_patient'
+    return base_path + '.parquet', base_path + '.index.parquet', base_path + '.json'
+
+
+def build_patient_index(df, data_path, index_path, id_column='pseudoid_pid', row_group_size=100_000):
+    """
+    Writes a DataFrame sorted by patient and the row-range index of every patient.
+
+    Args:
+        df (pd.DataFrame): The typed source DataFrame.
+        data_path (str): Path of the patient-sorted Parquet file.
+        index_path (str): Path of the index Parquet file.
+        id_column (str): Column with the patient id.
+        row_group_size (int): Number of rows per Parquet row group.
+
+    Returns:
+        pd.DataFrame: The index with the start/stop row and first/last row group of every patient.
+    """
+    ## A stable sort keeps the original row order (e.g. by date) inside every patient
+    df = df.sort_values(id_column, kind='stable').reset_index(drop=True)
+    df.to_parquet(data_path, index=False, row_group_size=row_group_size)
+
+    patient_ids = df[id_column].to_numpy()
+    unique_ids, start_rows = np.unique(patient_ids, return_index=True)
+    stop_rows = np.append(start_rows[1:], len(patient_ids))
+
+    patient_index = pd.DataFrame({
+        id_column: unique_ids,
+        'start_row': start_rows,
+        'stop_row': stop_rows,
+        'first_row_group': start_rows // row_group_size,
+        'last_row_group': (stop_rows - 1) // row_group_size,
+    })
+    patient_index.to_parquet(index_path, index=False)
+    return patient_index
+
+
+def ensure_patient_index(csv_file_path, schema, cache_dir=None, row_group_size=100_000):
+    """
+    Builds the patient index of a source once and reuses it while the source does not change.
+
+    Args:
+        csv_file_path (str): Path to the source CSV file.
+        schema (dict): The schema of the source (see source_schemas.SOURCE_SCHEMAS).
+        cache_dir (str): Directory of the cache. Defaults to '.cache' next to the source file.
+        row_group_size (int): Number of rows per Parquet row group.
+
+    Returns:
+        tuple: (data_path, index_path)
+    """
+    data_path, index_path, key_path = index_paths(csv_file_path, cache_dir)
+    index_key = {
+        'version': INDEX_VERSION,
+        'source': source_fingerprint(csv_file_path),
+        'schema': schema,
+        'row_group_size': row_group_size,
+    }
+
+    if os.path.exists(data_path) and os.path.exists(index_path) and os.path.exists(key_path):
+        with open(key_path, 'r') as file:
+            if json.load(file) == index_key:
+                return data_path, index_path
+
+    df = read_source_cached(csv_file_path, schema, cache_dir=cache_dir)
+    build_patient_index(df, data_path, index_path, id_column=schema['id_column'], row_group_size=row_group_size)
+    with open(key_path, 'w') as file:
+        json.dump(index_key, file)
+    print(f"Patient index saved to {index_path}")
+
+    return data_path, index_path
+
+
+def read_patients(data_path, index_path, patient_ids, id_column='pseudoid_pid'):
+    """
+    Reads only the rows of the requested patients from a patient-sorted Parquet file.
+
+    Args:
+        data_path (str): Path of the patient-sorted Parquet file.
+        index_path (str): Path of the index Parquet file.
+        patient_ids (list): The patients to read, cast to the id dtype of the index.
+        id_column (str): Column with the patient id.
+
+    Returns:
+        pd.DataFrame: The rows of the requested patients.
+    """
+    patient_index = pd.read_parquet(index_path)
+    ## Cast the requested ids to the id dtype of the index, so str ids match the int32 ids
+    patient_ids = pd.Series(list(patient_ids)).astype(patient_index[id_column].dtype)
+    patient_index = patient_index[patient_index[id_column].isin(patient_ids)]
+    if patient_index.empty:
+        ## The empty frame is built from the schema, without reading any row
+        return pq.ParquetFile(data_path).schema_arrow.empty_table().to_pandas()
+
+    ## Collect the row groups spanned by the requested patients
+    row_groups = set()
+    for first_row_group, last_row_group in zip(patient_index['first_row_group'], patient_index['last_row_group']):
+        row_groups.update(range(first_row_group, last_row_group + 1))
+
+    table = pq.ParquetFile(data_path).read_row_groups(sorted(row_groups))
+    df = table.to_pandas()
+    return df[df[id_column].isin(patient_index[id_column])].reset_index(drop=True)
+
+
+def read_source_patients(csv_file_path, schema, patient_ids, cache_dir=None):
+    """
+    Reads the rows of a cohort of patients from a registered source through its patient index.
+
+    Args:
+        csv_file_path (str): Path to the source CSV file.
+        schema (dict): The schema of the source (see source_schemas.SOURCE_SCHEMAS).
+        patient_ids (list): The patients to read.
+        cache_dir (str): Directory of the cache. Defaults to '.cache' next to the source file.
+
+    Returns:
+        pd.DataFrame: The typed rows of the requested patients.
+    """
+    data_path, index_path = ensure_patient_index(csv_file_path, schema, cache_dir=cache_dir)
+    return read_patients(data_path, index_path, patient_ids, id_column=schema['id_column'])
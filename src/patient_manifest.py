@@ -0,0 +1,191 @@
+"""
+Per-patient content manifest for the incremental re-extraction of the clinical sources.
+
+Every output directory keeps a manifest with one content hash per patient, computed from the
+patient's input rows and first admission date. When a new drop of the extract arrives, only the
+patients whose hash changed (rows added, removed or modified) are recomputed and rewritten, and the
+outputs of the patients that disappeared from the drop are deleted.
+"""
+
+import os
+import pandas as pd
+
+from timeline_alignment import first_admission_dates
+
+
+## Bump when the extraction rules change, so every patient is recomputed once
+MANIFEST_VERSION = 1
+MANIFEST_FILE_NAME = '_manifest.parquet'
+
+
+def manifest_path(output_dir):
+    """
+    Returns the path of the manifest of an output directory.
+
+    Args:
+        output_dir (str): Directory with the 'patient_{id}.csv' files.
+
+    Returns:
+        str: Path of the manifest Parquet file.
+    """
+    return os.path.join(output_dir, MANIFEST_FILE_NAME)
+
+
+def patient_content_hashes(df, hosp_timeline_data=None, id_column='pseudoid_pid'):
+    """
+    Computes a content hash of the input rows of every patient.
+
+    The row hashes are summed per patient, so the hash does not depend on the row order of the drop.
+    The row count, the first admission date (the origin of the day offsets) and MANIFEST_VERSION are
+    hashed together with the sum.
+
+    Args:
+        df (pd.DataFrame): The preprocessed source rows.
+        hosp_timeline_data (pd.DataFrame): The hospitalization timeline.
+        id_column (str): Column with the patient id.
+
+    Returns:
+        pd.Series: uint64 content hash indexed by patient id.
+    """
+    row_hashes = pd.util.hash_pandas_object(df, index=False)
+    ## uint64 sums wrap around, which keeps the combination order-independent
+    patient_hashes = row_hashes.groupby(df[id_column].to_numpy()).agg(['sum', 'size'])
+    patient_hashes['version'] = MANIFEST_VERSION
+
+    if hosp_timeline_data is not None:
+        admission_dates = first_admission_dates(hosp_timeline_data, id_column)
+        patient_hashes['admission'] = patient_hashes.index.map(admission_dates)
+
+    content_hashes = pd.util.hash_pandas_object(patient_hashes, index=True)
+    content_hashes.index.name = id_column
+    return content_hashes
+
+
+def read_manifest(output_dir, id_column='pseudoid_pid'):
+    """
+    Reads the manifest of an output directory.
+
+    Args:
+        output_dir (str): Directory with the 'patient_{id}.csv' files.
+        id_column (str): Column with the patient id.
+
+    Returns:
+        pd.Series: The content hash of every extracted patient, empty when there is no manifest.
+    """
+    path = manifest_path(output_dir)
+    if not os.path.exists(path):
+        return pd.Series(dtype='uint64', name='content_hash').rename_axis(id_column)
+    manifest_df = pd.read_parquet(path)
+    return manifest_df.set_index(id_column)['content_hash']
+
+
+def write_manifest(output_dir, content_hashes, id_column='pseudoid_pid'):
+    """
+    Writes the manifest of an output directory.
+
+    Args:
+        output_dir (str): Directory with the 'patient_{id}.csv' files.
+        content_hashes (pd.Series): The content hash of every extracted patient.
+        id_column (str): Column with the patient id.
+    """
+    manifest_df = content_hashes.rename('content_hash').rename_axis(id_column).reset_index()
+    manifest_df = manifest_df.sort_values(id_column)
+    ## Write aside and rename, so an interrupted run keeps the previous manifest
+    tmp_path = manifest_path(output_dir) + '.tmp'
+    manifest_df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, manifest_path(output_dir))
+
+
+def diff_manifest(content_hashes, previous_hashes):
+    """
+    Compares the content hashes of a new drop with the previous manifest.
+
+    Args:
+        content_hashes (pd.Series): The content hashes of the new drop.
+        previous_hashes (pd.Series): The content hashes of the previous manifest.
+
+    Returns:
+        tuple: (changed, removed) arrays of patient ids. 'changed' holds the new and modified
+            patients, 'removed' the patients that are no longer in the drop.
+    """
+    ## Compare only the patients in both, a reindex would turn the uint64 hashes into lossy floats
+    common = content_hashes.index.intersection(previous_hashes.index)
+    modified = common[content_hashes.loc[common].to_numpy() != previous_hashes.loc[common].to_numpy()]
+    added = content_hashes.index.difference(previous_hashes.index)
+    removed = previous_hashes.index.difference(content_hashes.index)
+    return added.union(modified).to_numpy(), removed.to_numpy()
+
+
+def remove_patient_outputs(output_dir, patient_ids):
+    """
+    Deletes the 'patient_{id}.csv' files of a list of patients.
+
+    Args:
+        output_dir (str): Directory with the 'patient_{id}.csv' files.
+        patient_ids (array-like): The patients whose output is deleted.
+
+    Returns:
+        int: Number of deleted files.
+    """
+    n_removed = 0
+    for patient in patient_ids:
+        patient_df_file = os.path.join(output_dir, f'patient_{patient}.csv')
+        if os.path.exists(patient_df_file):
+            os.remove(patient_df_file)
+            n_removed += 1
+    return n_removed
+
+
+class PatientManifest:
+    """
+    Selects the patients to recompute in an incremental run and updates the manifest at the end.
+
+    Args:
+        output_dir (str): Directory with the 'patient_{id}.csv' files and the manifest.
+        hosp_timeline_data (pd.DataFrame): The hospitalization timeline.
+        id_column (str): Column with the patient id.
+    """
+
+    def __init__(self, output_dir, hosp_timeline_data=None, id_column='pseudoid_pid'):
+        self.output_dir = output_dir
+        self.hosp_timeline_data = hosp_timeline_data
+        self.id_column = id_column
+        self.previous_hashes = read_manifest(output_dir, id_column)
+        self.content_hashes = []
+        self.n_changed = 0
+
+    def select_changed(self, df):
+        """
+        Returns the rows of the new and modified patients and deletes their previous outputs.
+
+        Args:
+            df (pd.DataFrame): The preprocessed source rows, whole patients only.
+
+        Returns:
+            pd.DataFrame: The rows of the patients to recompute.
+        """
+        content_hashes = patient_content_hashes(df, self.hosp_timeline_data, self.id_column)
+        self.content_hashes.append(content_hashes)
+
+        changed, _ = diff_manifest(content_hashes, self.previous_hashes)
+        self.n_changed += len(changed)
+        ## A modified patient may produce no output anymore, so its previous file is always deleted
+        remove_patient_outputs(self.output_dir, changed)
+        return df[df[self.id_column].isin(changed)]
+
+    def commit(self):
+        """
+        Deletes the outputs of the patients that disappeared and writes the new manifest.
+
+        Returns:
+            dict: Number of changed and removed patients.
+        """
+        if self.content_hashes:
+            content_hashes = pd.concat(self.content_hashes)
+        else:
+            content_hashes = pd.Series(dtype='uint64').rename_axis(self.id_column)
+
+        removed = self.previous_hashes.index.difference(content_hashes.index)
+        remove_patient_outputs(self.output_dir, removed)
+        write_manifest(self.output_dir, content_hashes, self.id_column)
+        return {'changed': self.n_changed, 'removed': len(removed)}
@@ -0,0 +1,208 @@
+"""
+Lazy per-patient access to the extracted clinical sources.
+
+A PatientTimeline loads the day x feature matrix of a source the first time it is accessed and
+exposes day-window and feature slices of it. PatientTimelines keeps the recently used patients in a
+size-bounded LRU cache, so the selection, matrix building and plotting steps that revisit the same
+patients read them from memory instead of the file system.
+
+Every source is read from its sparse store ('<dir>_sparse'), its feature store ('<dir>_store') or its
+'patient_{id}.csv' files, in the format the extractor recorded (see feature_sources).
+"""
+
+import os
+from collections import OrderedDict
+import pandas as pd
+
+from feature_store import read_patient_frames
+from feature_sources import format_dir, resolve_feature_format
+from sparse_features import SparseFeatures
+
+
+class PatientTimeline:
+    """
+    The clinical sources of one patient, loaded on first access.
+
+    Args:
+        patient_id (int): The patient id.
+        load_source (callable): Function (source, patient_id) -> DataFrame or None.
+        source_names (list): Names of the available sources.
+    """
+
+    def __init__(self, patient_id, load_source, source_names):
+        self.patient_id = patient_id
+        self.source_names = list(source_names)
+        self._load_source = load_source
+        self._frames = {}
+
+    def source(self, source):
+        """
+        Returns the day x feature matrix of a source, loading it on first access.
+
+        Args:
+            source (str): Name of the source.
+
+        Returns:
+            pd.DataFrame: The matrix with a 'days' column, None when the patient has no data in the source.
+        """
+        if source not in self.source_names:
+            raise KeyError(f"Unknown source '{source}', available sources: {', '.join(self.source_names)}")
+        if source not in self._frames:
+            self._frames[source] = self._load_source(source, self.patient_id)
+        return self._frames[source]
+
+    def window(self, source, init_day=None, end_day=None, features=None):
+        """
+        Returns the rows of a source within a day window, optionally restricted to some features.
+
+        Args:
+            source (str): Name of the source.
+            init_day (int): First day of the window.
+            end_day (int): Last day of the window.
+            features (list): Feature columns to keep, in this order. Missing features are NaN columns.
+
+        Returns:
+            pd.DataFrame: The 'days' column and the selected features of the rows in the window.
+        """
+        frame = self.source(source)
+        if frame is None:
+            frame = pd.DataFrame(columns=['days'])
+
+        mask = pd.Series(True, index=frame.index)
+        if init_day is not None:
+            mask &= frame['days'] >= init_day
+        if end_day is not None:
+            mask &= frame['days'] <= end_day
+        frame = frame[mask]
+
+        if features is not None:
+            frame = frame.reindex(columns=['days'] + list(features))
+        return frame.copy()
+
+    def loaded_sources(self):
+        """Returns the names of the sources already loaded."""
+        return list(self._frames)
+
+
+class PatientTimelines:
+    """
+    Size-bounded LRU cache of PatientTimeline objects.
+
+    Args:
+        source_dirs (dict): Source name -> directory of its 'patient_{id}.csv' files, e.g.
+            {'lab_data': '.../06_clinical_data/lab_data_features/'}.
+        cache_size (int): Maximum number of patients kept in memory.
+        source_formats (dict): Source name -> output format ('csv', 'store' or 'sparse'). The format
+            recorded by the extractor is read for the other sources.
+    """
+
+    def __init__(self, source_dirs, cache_size=256, source_formats=None):
+        self.source_dirs = dict(source_dirs)
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._timelines = OrderedDict()
+        self._sparse_stores = {}
+        self.source_formats = dict(source_formats or {})
+        self._resolved_formats = {}
+
+    def source_format(self, source):
+        """
+        Returns the output format a source is read from, checked once against the patient CSV files.
+
+        Args:
+            source (str): Name of the source.
+
+        Returns:
+            str: 'csv', 'store' or 'sparse'.
+        """
+        if source not in self._resolved_formats:
+            self._resolved_formats[source] = resolve_feature_format(self.source_dirs[source], self.source_formats.get(source))
+        return self._resolved_formats[source]
+
+    def _load_source(self, source, patient_id):
+        features_dir = self.source_dirs[source]
+        source_format = self.source_format(source)
+
+        if source_format == 'sparse':
+            ## The sparse store is opened once and sliced per patient
+            if source not in self._sparse_stores:
+                self._sparse_stores[source] = SparseFeatures(format_dir(features_dir, 'sparse'))
+            sparse_store = self._sparse_stores[source]
+            if int(patient_id) not in sparse_store.patient_ranges:
+                return None
+            return sparse_store.patient_frame(patient_id)
+        if source_format == 'store':
+            return read_patient_frames(format_dir(features_dir, 'store'), [patient_id]).get(patient_id)
+
+        filename = os.path.join(features_dir, f'patient_{patient_id}.csv')
+        if not os.path.exists(filename):
+            return None
+        return pd.read_csv(filename, sep=',', header=0)
+
+    def __getitem__(self, patient_id):
+        """
+        Returns the timeline of a patient, from the cache when it was recently used.
+
+        Args:
+            patient_id (int): The patient id.
+
+        Returns:
+            PatientTimeline: The timeline of the patient.
+        """
+        if patient_id in self._timelines:
+            self.hits += 1
+            self._timelines.move_to_end(patient_id)
+            return self._timelines[patient_id]
+
+        self.misses += 1
+        timeline = PatientTimeline(patient_id, self._load_source, self.source_dirs)
+        self._timelines[patient_id] = timeline
+        if len(self._timelines) > self.cache_size:
+            self._timelines.popitem(last=False)
+        return timeline
+
+    def __contains__(self, patient_id):
+        return patient_id in self._timelines
+
+    def __len__(self):
+        return len(self._timelines)
+
+    def source_frames(self, source):
+        """
+        Returns a patient id -> DataFrame mapping of one source, usable as the 'patient_frames' of the
+        matrix building scripts.
+
+        Args:
+            source (str): Name of the source.
+
+        Returns:
+            SourceFrames: The mapping, backed by the cache.
+        """
+        return SourceFrames(self, source)
+
+    def clear(self):
+        """Empties the cache, the formats of the sources are resolved again on the next access."""
+        self._timelines.clear()
+        self._sparse_stores.clear()
+        self._resolved_formats.clear()
+
+
+class SourceFrames:
+    """
+    Read-only patient id -> DataFrame view of one source of a PatientTimelines cache.
+
+    Args:
+        timelines (PatientTimelines): The cache.
+        source (str): Name of the source.
+    """
+
+    def __init__(self, timelines, source):
+        self.timelines = timelines
+        self.source = source
+
+    def __getitem__(self, patient_id):
+        frame = self.timelines[patient_id].source(self.source)
+        if frame is None:
+            raise KeyError(patient_id)
+        return frame
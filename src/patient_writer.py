@@ -0,0 +1,107 @@
+"""
+Parallel writer for the per-patient output files.
+
+The finished patient frames are handed to a pool of worker threads (or processes) through a bounded
+queue, so the serialization and the disk I/O of the 'patient_{id}.csv' files overlap with the
+computation of the next patients. When the queue is full the producer waits (backpressure), which
+bounds the number of frames held in memory.
+"""
+
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+def write_frame_csv(frame, output_file, to_csv_kwargs):
+    """
+    Writes one frame to a CSV file.
+
+    Args:
+        frame (pd.DataFrame): The frame to write.
+        output_file (str): Path of the CSV file.
+        to_csv_kwargs (dict): Extra arguments for DataFrame.to_csv.
+    """
+    frame.to_csv(output_file, **to_csv_kwargs)
+
+
+class PatientFrameWriter:
+    """
+    Writes patient frames to CSV files in the background.
+
+    Args:
+        n_workers (int): Number of worker threads or processes.
+        max_pending (int): Maximum number of frames waiting to be written.
+        use_processes (bool): Write with worker processes instead of threads.
+    """
+
+    def __init__(self, n_workers=4, max_pending=64, use_processes=False):
+        self.errors = []
+        self.use_processes = use_processes
+
+        if use_processes:
+            self.executor = ProcessPoolExecutor(max_workers=n_workers)
+            self.pending = threading.BoundedSemaphore(max_pending)
+        else:
+            self.queue = queue.Queue(maxsize=max_pending)
+            self.workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(n_workers)]
+            for worker in self.workers:
+                worker.start()
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            try:
+                write_frame_csv(*item)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+
+    def _on_done(self, future):
+        self.pending.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def submit(self, frame, output_file, **to_csv_kwargs):
+        """
+        Queues a frame to be written, waiting while the queue is full.
+
+        Args:
+            frame (pd.DataFrame): The frame to write.
+            output_file (str): Path of the CSV file.
+            **to_csv_kwargs: Extra arguments for DataFrame.to_csv (e.g. index=False).
+        """
+        if self.use_processes:
+            self.pending.acquire()
+            future = self.executor.submit(write_frame_csv, frame, output_file, to_csv_kwargs)
+            future.add_done_callback(self._on_done)
+        else:
+            self.queue.put((frame, output_file, to_csv_kwargs))
+
+    def close(self, raise_errors=True):
+        """
+        Waits for all the queued frames to be written and stops the workers.
+
+        Args:
+            raise_errors (bool): Raise if any frame failed to write.
+        """
+        if self.use_processes:
+            self.executor.shutdown(wait=True)
+        else:
+            for _ in self.workers:
+                self.queue.put(None)
+            for worker in self.workers:
+                worker.join()
+
+        if raise_errors and self.errors:
+            raise RuntimeError(f"{len(self.errors)} patient files failed to write, first error: {self.errors[0]}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        ## Do not hide the exception that interrupted the producer
+        self.close(raise_errors=exc_type is None)
@@ -0,0 +1,89 @@
+"""
+Whole-table pivot engine for the per-patient feature matrices.
+
+The (patient, day, feature) aggregate of a whole source is computed with one grouped aggregation and
+then split into the per-patient day x feature matrices, instead of one pivot_table call and one
+concat per patient and feature.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def decimal_float64(values):
+    """
+    Widens float32 values to the float64 of their shortest decimal representation.
+
+    The compact float32 value columns of the source schemas hold the parsed raw values ('6.935'). A plain
+    cast would carry the float32 rounding error into the aggregates (6.934999942779541), so the distinct
+    values are widened through their decimal representation, which is the float64 the raw string parses to.
+
+    Args:
+        values (pd.Series): The values.
+
+    Returns:
+        pd.Series: The float64 values.
+    """
+    if values.dtype != 'float32':
+        return values.astype('float64')
+    codes, uniques = pd.factorize(values)
+    ## The extra last entry keeps the missing values (code -1) missing
+    decimal_uniques = np.append(np.asarray(uniques, dtype='float32').astype(str).astype('float64'), np.nan)
+    return pd.Series(decimal_uniques[codes], index=values.index, name=values.name)
+
+
+def aggregate_features(df, feature_column_name, value_column_name, id_column='pseudoid_pid', days_column='days',
+                       aggfunc='mean'):
+    """
+    Aggregates the values of a whole source per patient, day and feature.
+
+    Args:
+        df (pd.DataFrame): The events with the days column derived from the hospitalization timeline.
+        feature_column_name (str): Column with the feature names.
+        value_column_name (str): Column with the feature values.
+        id_column (str): Column with the patient id.
+        days_column (str): Column with the day offsets.
+        aggfunc (str): Aggregation of the values of the same patient, day and feature.
+
+    Returns:
+        pd.Series: The aggregated values indexed by (patient, day, feature), sorted, without missing values.
+    """
+    ## Rows without a day offset (patients missing from the timeline) cannot be placed in a matrix
+    df = df[df[days_column].notna()]
+
+    ## Aggregate in float64, the float32 means of the value columns differ from the raw values in the last digits
+    values = decimal_float64(pd.to_numeric(df[value_column_name], errors='coerce'))
+    keys = [df[id_column], df[days_column].astype('int64'), df[feature_column_name]]
+    aggregated = values.groupby(keys, observed=True, sort=True).agg(aggfunc)
+    aggregated.index.names = [id_column, days_column, feature_column_name]
+    return aggregated.dropna()
+
+
+def split_patient_matrices(aggregated, days_column='days'):
+    """
+    Splits the aggregated values into the day x feature matrix of every patient.
+
+    Args:
+        aggregated (pd.Series): Values returned by aggregate_features.
+        days_column (str): Name of the days column of the matrices.
+
+    Yields:
+        tuple: (patient, DataFrame with the days column first and one column per feature, sorted by day)
+    """
+    ## The aggregate is sorted by patient, so every patient is one contiguous slice
+    patient_ids = aggregated.index.get_level_values(0)
+    boundaries = np.flatnonzero(patient_ids[1:] != patient_ids[:-1]) + 1
+    starts = np.concatenate([[0], boundaries])
+    stops = np.concatenate([boundaries, [len(aggregated)]])
+
+    for start, stop in zip(starts, stops):
+        if start == stop:
+            continue
+        patient_values = aggregated.iloc[start:stop].droplevel(0)
+        ## Keep the features in their sorted (category) order, like a groupby over the features
+        patient_df = patient_values.unstack(level=-1).sort_index(axis=1)
+        patient_df = patient_df.loc[:, patient_df.notna().any()]
+        patient_df.columns = patient_df.columns.astype(str)
+        patient_df.columns.name = None
+        patient_df = patient_df.reset_index()
+        yield patient_ids[start], patient_df
@@ -0,0 +1,158 @@
+"""
+Sub-day resampling of the high-frequency PDMS streams (o2_data_pdms, oxygen_supply).
+
+The charted values are assigned to fixed-width bins (1h, 4h, 1d, ...) counted from the first
+hospital admission of the patient, with integer arithmetic over the whole stream, and aggregated per
+(patient, bin, feature) with several aggregations in one grouped pass. The source is processed one
+patient partition at a time (see clinical_partitions), so months of ICU monitoring per patient are
+resampled in a memory bounded by the partition size.
+"""
+
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+from timeline_alignment import first_admission_dates
+
+
+DEFAULT_AGGFUNCS = ('mean', 'min', 'max', 'count')
+
+NS_PER_HOUR = pd.Timedelta('1h').value
+NS_PER_DAY = pd.Timedelta('1D').value
+
+
+def bin_name(bin_width):
+    """
+    Returns the name of a bin width used in the output paths, e.g. '4h' or '1d'.
+
+    Args:
+        bin_width (str): The bin width, any pd.Timedelta string.
+
+    Returns:
+        str: The normalized name.
+    """
+    hours = pd.Timedelta(bin_width).value / NS_PER_HOUR
+    if hours % 24 == 0:
+        return f'{int(hours // 24)}d'
+    if hours == int(hours):
+        return f'{int(hours)}h'
+    return f'{int(pd.Timedelta(bin_width).value // 60_000_000_000)}min'
+
+
+def assign_bins(dates, origins, bin_width):
+    """
+    Assigns every timestamp to a bin counted from its origin.
+
+    Args:
+        dates (pd.Series): The timestamps of the rows.
+        origins (pd.Series): The origin (first admission) of every row.
+        bin_width (str): The bin width, any pd.Timedelta string.
+
+    Returns:
+        tuple: (bins, valid) where bins holds the int64 bin number of every row (negative before the
+            origin) and valid marks the rows with both a timestamp and an origin.
+    """
+    offsets = (pd.to_datetime(dates) - pd.to_datetime(origins)).to_numpy(dtype='timedelta64[ns]')
+    valid = ~np.isnat(offsets)
+    ## Floor division keeps the bins before the origin aligned (e.g. -1h30 falls in bin -2 of 1h)
+    bins = np.floor_divide(offsets.astype('int64'), pd.Timedelta(bin_width).value)
+    return bins, valid
+
+
+def resample_stream(df, hosp_timeline_data, date_column_name, feature_column_name, value_column_name,
+                    bin_width='4h', aggfuncs=DEFAULT_AGGFUNCS, id_column='pseudoid_pid',
+                    admission_column='date_admission_hosp'):
+    """
+    Resamples the values of a stream into fixed-width bins from the first admission.
+
+    Args:
+        df (pd.DataFrame): The rows of the stream, whole patients.
+        hosp_timeline_data (pd.DataFrame): The hospitalization timeline.
+        date_column_name (str): Column with the charting timestamps.
+        feature_column_name (str): Column with the feature names.
+        value_column_name (str): Column with the values.
+        bin_width (str): The bin width, any pd.Timedelta string ('1h', '4h', '1D').
+        aggfuncs (tuple): Aggregations computed per bin.
+        id_column (str): Column with the patient id.
+        admission_column (str): Column with the admission date in the timeline.
+
+    Returns:
+        pd.DataFrame: One row per (patient, bin, feature) with the bin number, its start in hours from
+            the admission, its day offset and one column per aggregation.
+    """
+    origins = df[id_column].map(first_admission_dates(hosp_timeline_data, id_column, admission_column))
+    bins, valid = assign_bins(df[date_column_name], origins, bin_width)
+
+    values = pd.to_numeric(df[value_column_name], errors='coerce').astype('float32')[valid]
+    keys = [df[id_column][valid].rename(id_column), pd.Series(bins[valid], index=values.index, name='bin'),
+            df[feature_column_name][valid].rename('feature')]
+    resampled = values.groupby(keys, observed=True, sort=True).agg(list(aggfuncs)).reset_index()
+
+    bin_start = resampled['bin'].to_numpy() * pd.Timedelta(bin_width).value
+    resampled.insert(2, 'bin_start_hours', (bin_start / NS_PER_HOUR).astype('float32'))
+    resampled.insert(3, 'days', np.floor_divide(bin_start, NS_PER_DAY).astype('int32'))
+    resampled['feature'] = resampled['feature'].astype(str)
+    return resampled
+
+
+def resample_partitions(partitions, hosp_timeline_data, date_column_name, feature_column_name, value_column_name,
+                        output_dirs, aggfuncs=DEFAULT_AGGFUNCS, id_column='pseudoid_pid'):
+    """
+    Resamples a partitioned stream into several bin widths, one partition at a time.
+
+    Args:
+        partitions (iterable): The partitions of the stream (see clinical_partitions.iter_partitions).
+        hosp_timeline_data (pd.DataFrame): The hospitalization timeline.
+        date_column_name (str): Column with the charting timestamps.
+        feature_column_name (str): Column with the feature names.
+        value_column_name (str): Column with the values.
+        output_dirs (dict): Bin width -> output directory. Existing directories are replaced.
+        aggfuncs (tuple): Aggregations computed per bin.
+        id_column (str): Column with the patient id.
+
+    Returns:
+        dict: Bin width -> number of resampled rows written.
+    """
+    for output_dir in output_dirs.values():
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        os.makedirs(output_dir)
+
+    n_rows = {bin_width: 0 for bin_width in output_dirs}
+    for part_number, partition_df in enumerate(partitions):
+        ## Every partition is read once and resampled into all the bin widths
+        for bin_width, output_dir in output_dirs.items():
+            resampled = resample_stream(partition_df, hosp_timeline_data, date_column_name, feature_column_name,
+                                        value_column_name, bin_width, aggfuncs, id_column)
+            if resampled.empty:
+                continue
+            resampled.to_parquet(os.path.join(output_dir, f'part-{part_number:05d}.parquet'), index=False)
+            n_rows[bin_width] += len(resampled)
+    return n_rows
+
+
+def read_resampled(resampled_dir, patient_ids=None, features=None, init_hour=None, end_hour=None):
+    """
+    Reads a resampled stream.
+
+    Args:
+        resampled_dir (str): Directory written by resample_partitions.
+        patient_ids (list): Restrict the read to these patients.
+        features (list): Restrict the read to these features.
+        init_hour (float): First bin start, in hours from the admission.
+        end_hour (float): Last bin start, in hours from the admission.
+
+    Returns:
+        pd.DataFrame: The resampled rows.
+    """
+    filters = []
+    if patient_ids is not None:
+        filters.append(('pseudoid_pid', 'in', [int(patient_id) for patient_id in patient_ids]))
+    if features is not None:
+        filters.append(('feature', 'in', list(features)))
+    if init_hour is not None:
+        filters.append(('bin_start_hours', '>=', init_hour))
+    if end_hour is not None:
+        filters.append(('bin_start_hours', '<=', end_hour))
+    return pd.read_parquet(resampled_dir, filters=filters or None).reset_index(drop=True)
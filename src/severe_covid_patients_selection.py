@@ -4,6 +4,13 @@ import os
 import matplotlib.pyplot as plt
 import csv
 
+from date_normalization import normalize_dates
+from timeline_alignment import add_admission_days, first_admission_dates
+from data_paths import IDSC_DATA_DIR, PATIENTOMICS_DATA_DIR
+from pivot_engine import aggregate_features
+from cohort_criteria import RIS_EXAMINATION_TYPES, classify_outcomes, exam_events, patient_outcome_table
+from output_sinks import CsvSink, patient_row_slices
+
 
 def read_csv(file_path, sep=','):
     """
@@ -20,7 +27,8 @@ def read_csv(file_path, sep=','):
 
 def preprocess_data(df, column_name):
     """
-    Preprocesses the DataFrame by converting lab_req_date to datetime format and sorting by column_name.
+    Preprocesses the DataFrame by converting column_name to datetime format and sorting by column_name.
+    The date format is detected once and only the unique dates are parsed; rows that fail to parse are reported.
 
     Args:
         df (pd.DataFrame): The input DataFrame.
@@ -28,7 +36,7 @@ def preprocess_data(df, column_name):
     Returns:
         pd.DataFrame: The preprocessed DataFrame.
     """
-    df[column_name] = pd.to_datetime(df[column_name])
+    df[column_name], _ = normalize_dates(df[column_name])
     df = df.sort_values(column_name)
     return df
 
@@ -61,28 +69,23 @@ def feature_extractor_per_patient_OLD(df, output_dir, feature_column_name, date_
 
 
 def feature_extractor_per_patient(df, output_dir, feature_column_name, date_column_name, value_column_name):
-    grouped_df = df.groupby('pseudoid_pid')
-
-
     ## Read the hospitalization timeline csv file
     general_data_file_name = "general_data"
-    hosp_timeline_file_name = "/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/dicts/" + general_data_file_name + "_hosp_timeline.csv" 
+    hosp_timeline_file_name = PATIENTOMICS_DATA_DIR + "dicts/" + general_data_file_name + "_hosp_timeline.csv" 
     hosp_timeline_df = read_csv(hosp_timeline_file_name, sep=',')
     # hosp_timeline = hosp_timeline_df[['pseudoid_pid', 'date_admission_hosp', 'date_discharge_hosp']]
 
     ## Preprocess the date column
     hosp_timeline_data = preprocess_data(hosp_timeline_df, 'date_admission_hosp')
 
+    ## derive the days from the first hospitalization date for all the rows at once
+    df = add_admission_days(df, hosp_timeline_data, date_column_name)
+    grouped_df = df.groupby('pseudoid_pid')
+
 
     for patient, data in grouped_df:
         patient_df = pd.DataFrame()
 
-        ## Get the hospitalization timeline for the patient
-        patient_hosp_timeline = hosp_timeline_data[hosp_timeline_data['pseudoid_pid'] == patient]
-
-        ## Get the first hospitalization date
-        first_hosp_date = patient_hosp_timeline['date_admission_hosp'].min()
-
         # ## Get the last hospitalization date
         # last_hosp_date = patient_hosp_timeline['date_discharge_hosp'].max()
 
@@ -92,10 +95,6 @@ def feature_extractor_per_patient(df, output_dir, feature_column_name, date_colu
 
         ## Function 
         for feature_name, feature_data in data.groupby(feature_column_name):
-            min_date = first_hosp_date
-            ## derive the days from the first hospitalization date
-            feature_data['days'] = (feature_data[date_column_name] - min_date).dt.days
-
             ## Convert value to numeric, handling non-numeric values
             feature_data[value_column_name] = pd.to_numeric(feature_data[value_column_name], errors='coerce')
 
@@ -141,6 +140,24 @@ def sort_dataframe_columns(dataframe):
 
 
 
+def save_cohort(df, patients, selected, patients_file, ris_file):
+    """
+    Streams the ids and discharge types of a cohort and the imaging rows of its patients to CSV files.
+
+    Args:
+        df (pd.DataFrame): The imaging rows, sorted by patient.
+        patients (pd.DataFrame): The patient outcome table.
+        selected (np.ndarray): Boolean membership of the patients of the table.
+        patients_file (str): Path of the list of patients.
+        ris_file (str): Path of the imaging rows of the patients.
+    """
+    with CsvSink(patients_file, columns=[0]) as patients_sink, CsvSink(ris_file, columns=df.columns) as ris_sink:
+        patients_sink.write(pd.DataFrame(['pseudoid_pid, discharge_type']))
+        for patient, patient_ris in patient_row_slices(df, patients.index[selected]):
+            patients_sink.write(pd.DataFrame({0: [(patient, patients.at[patient, 'discharge_type'])]}))
+            ris_sink.write(patient_ris)
+
+
 ##############################################################################################################
 def launcher_pipeline(file_name, sep, feature_column_name, date_column_name, value_column_name):
     """
@@ -158,7 +175,7 @@ def launcher_pipeline(file_name, sep, feature_column_name, date_column_name, val
     """
 
     # # Step 1: Read the CSV file into a DataFrame
-    dir_CDA_features = "/home/jagh/Documents/01_UB/10_Conferences_submitted/11_Second_paper/00_dataset/03_Insel_dataset/01_Preprocessing_IDSC202101463_data_v13_20221214/"
+    dir_CDA_features = IDSC_DATA_DIR
     csv_file_path = os.path.join(dir_CDA_features, file_name + ".csv")
     df = read_csv(csv_file_path, sep=sep)
 
@@ -176,7 +193,7 @@ def launcher_pipeline(file_name, sep, feature_column_name, date_column_name, val
     df = df[df['ris_examination_begin'] >= '2020-03-01']
 
     ## Step 3.2: Filter the patients with 'ris_examination_type' == 'CTA, CTTH, TH'
-    df = df[df['ris_examination_type'].isin(['CTA', 'CTHATHAB', 'CTHATHOB', 'CTHTH', 'CTHTHABD', 'CTTH', 'CTTHABD', 'CTTHOB', 'CTUB', 'IMPCTTH', 'IMPCTTHAB', 'TH'])]
+    df = df[df['ris_examination_type'].isin(RIS_EXAMINATION_TYPES)]
     # print("df: ", df.head())
 
 
@@ -187,12 +204,11 @@ def launcher_pipeline(file_name, sep, feature_column_name, date_column_name, val
     ##############################################################
     ##############################################################
     ## Step 4: Calculate the days from the first hospitalization date
-    grouped_df = df.groupby('pseudoid_pid')
 
     ## Read the hospitalization timeline csv file
     general_data_file_name = "general_data"
     # hosp_timeline_file_name = "/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/dicts/" + general_data_file_name + "_hosp_timeline.csv" 
-    hosp_timeline_file_name = "/home/jagh/Documents/01_UB/10_Conferences_submitted/11_Second_paper/00_dataset/03_Insel_dataset/01_Preprocessing_IDSC202101463_data_v13_20221214/" + general_data_file_name + ".csv" 
+    hosp_timeline_file_name = IDSC_DATA_DIR + general_data_file_name + ".csv" 
     hosp_timeline_df = read_csv(hosp_timeline_file_name, sep=';')
 
     # ## Filter the hosp_timeline_df by patients that was discharged 'discharge_type' as Verstorben or Zuhause
@@ -201,134 +217,36 @@ def launcher_pipeline(file_name, sep, feature_column_name, date_column_name, val
     ## Preprocess the date column
     hosp_timeline_data = preprocess_data(hosp_timeline_df, 'date_admission_hosp')
 
-    # ## Set the store list
-    # potential_long_covid_patients = []
-    # potential_long_covid_patients.append('pseudoid_pid')
-
-    # ## Set the full data list
-    # long_covid_selected = pd.DataFrame()
-
-    ## Set the store list for pseudoid_pid and discharge_type
-    deceased_patients = []
-    deceased_patients.append('pseudoid_pid, discharge_type')
-    ## Set the dataframe to store the ris_information
-    ris_deceased_patients_selected = pd.DataFrame()
-
+    ## derive the days from the first hospitalization date for all the rows at once
+    first_hosp_dates = first_admission_dates(hosp_timeline_data)
+    df = add_admission_days(df, hosp_timeline_data, date_column_name)
 
-    ## Set the store list for pseudoid_pid and discharge_type
-    discharged_patients_home = []
-    discharged_patients_home.append('pseudoid_pid, discharge_type')
-    ## Set the dataframe to store the ris_information
-    ris_discharged_patients_selected = pd.DataFrame()
+    ## Normalize the date_death column once for all the patients
+    hosp_timeline_df['date_death'], _ = normalize_dates(hosp_timeline_df['date_death'].replace('NULL', np.nan))
 
-    
-    for patient, data in grouped_df:
-        patient_df = pd.DataFrame()
-        full_data = pd.DataFrame()
-
-        ## Get the hospitalization timeline for the patient
-        patient_hosp_timeline = hosp_timeline_data[hosp_timeline_data['pseudoid_pid'] == patient]
-
-        ## Get the first hospitalization date
-        first_hosp_date = patient_hosp_timeline['date_admission_hosp'].min()
-
-        ###########################################################
-        ## Get the discharge_tye for the pseudoid_pid == patient
-        row = hosp_timeline_df[hosp_timeline_df['pseudoid_pid'] == patient]
-        discharge_type = row[['discharge_type']]
-
-        ## Get the date_death for the pseudoid_pid == patient
-        date_death = row[['date_death']]
-        ## Normalize the date_death column
-        date_death = pd.to_datetime(date_death['date_death'], errors='coerce')
-        delta_date_death = (date_death - first_hosp_date).dt.days
-        # print("delta_date_death: ", delta_date_death.values[0])
-        #############################################################
-        
-
-        ## Filter the patients medical imaging ('ris_examination_type') follow-up with the following criteria:
-        for feature_name, feature_data in data.groupby(feature_column_name):
-            min_date = first_hosp_date
-
-            ## derive the days from the first hospitalization date
-            feature_data['days'] = (feature_data[date_column_name] - min_date).dt.days
-
-            # ## derive the days from the first hospitalization date
-            # feature_data['days'] = (feature_data[date_column_name] - min_date).dt.days
+    ##############################################################
+    ## Step 5: Join the imaged patients with their general_data outcome (first row per patient) and RIS aggregates
+    aggregated = aggregate_features(df, feature_column_name, value_column_name)
+    events = exam_events(aggregated)
+    patients = patient_outcome_table(df, aggregated, hosp_timeline_df, first_hosp_dates)
 
-            ##############
-            ## Get the additional data
-            full_data = pd.concat([full_data, feature_data])
-            ##############
+    ## Step 6: Classify the outcome of all the patients at once (see cohort_criteria.COHORTS)
+    ##    - deceased: 'Verstorben' within 60 days from the first hospitalization date
+    ##    - discharged control: 'Entlassung' without medical imaging after 60 days
+    ##    - discharged follow-up: 'Entlassung' with medical imaging after 60 days, potential long covid patients
+    patients['outcome'] = classify_outcomes(events, patients)
+    print(patients['outcome'].value_counts(sort=False).to_string())
+    discharged_control = (patients['outcome'] == 'discharged_control').to_numpy()
 
-            ## Convert value to numeric, handling non-numeric values
-            feature_data[value_column_name] = pd.to_numeric(feature_data[value_column_name], errors='coerce')
+    ## The imaging rows grouped by patient and exam type, the cohorts are streamed from contiguous slices
+    df = df.sort_values(['pseudoid_pid', feature_column_name], kind='stable')
 
-            feature_data = feature_data.pivot_table(index=feature_column_name, columns='days', values=value_column_name, aggfunc='mean')
-            feature_data.columns = [f'{day}' for day in feature_data.columns]
+    output_dir = PATIENTOMICS_DATA_DIR + "05_data_exploration/02_preprocessing_NC/"                  
+    os.makedirs(output_dir, exist_ok=True)
 
-            patient_df = pd.concat([patient_df, feature_data])
+    ## Save the outcome table of all the imaged patients
+    patients.to_csv(os.path.join(output_dir, 'patient_outcomes.csv'))
 
-            ## sort the columns
-            # patient_df = patient_df.reindex(sorted(patient_df.columns), axis=1)
-            patient_df = patient_df.reindex(sorted(patient_df.columns, key=lambda x: int(x) if x.isdigit() else float('inf')), axis=1)
-
-
-
-        ##############################################################
-        patient_df.columns = pd.to_numeric(patient_df.columns, errors='coerce')
-
-        ## Add the discharge_type to the full_data dataframe
-        try:
-            if discharge_type.values[0][0] == 'Verstorben':
-                ## check if the patient died before 60 days of the first day of hospitalization
-                if delta_date_death.values[0] < 60:
-                    ## Added the patient to the list of deceased_patients
-                    deceased_patients.append((patient, discharge_type.values[0][0]))
-                    # print("+ delta_date_death: ", delta_date_death.values[0])
-
-                    ## Add selected patient to the ris_deceased_patients_selected dataframe
-                    ris_deceased_patients_selected = pd.concat([ris_deceased_patients_selected, full_data])
-                
-            elif discharge_type.values[0][0] == 'Entlassung':
-
-                ## Criteria 1: Filter columns based on column headers greater than 120
-                filtered_criteria_1 = [col for col in patient_df.columns if col > 60]
-
-                if filtered_criteria_1:
-                    print("Potential long covid patient: ", patient)
-                    
-                else:
-                    print("Control patient: ", patient)
-                    ## Added the patient to the list of discharged_patients_home
-                    discharged_patients_home.append((patient, discharge_type.values[0][0]))   
-                    # print("+ delta MI: ", patient_df.columns[-1])
-
-                    ## Add selected patient to the ris_discharged_patients_selected dataframe
-                    ris_discharged_patients_selected = pd.concat([ris_discharged_patients_selected, full_data])
-                
-
-
-                # if len(filtered_criteria_1) > 0:
-                # ## check if the patient has not medical imaging after 120 days of the first day of hospitalization
-                # if patient_df.columns[-1] > 60:
-                #     print("+ delta MI: ", patient_df.columns[-1])
-                # elif patient_df.columns[-2] > 60:
-                #     print("+ delta MI: ", patient_df.columns[-2])
-                # else:
-                #     ## Added the patient to the list of discharged_patients_home
-                #     discharged_patients_home.append((patient, discharge_type.values[0][0]))   
-                #     # print("+ delta MI: ", patient_df.columns[-1])
-
-                #     ## Add selected patient to the ris_discharged_patients_selected dataframe
-                #     ris_discharged_patients_selected = pd.concat([ris_discharged_patients_selected, full_data])
-                
-        except IndexError:
-            # full_data['discharge_type'] = 'NaN'
-            pass
-
-        
-    output_dir = "/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/05_data_exploration/02_preprocessing_NC/"                  
     # ## Save the list of potential long covid patients to a CSV file
     # potential_long_covid_patients_file = os.path.join(output_dir, f'potential_severe_pseudoid_pid.csv')
     # potential_long_covid_patients_df = pd.DataFrame(potential_long_covid_patients)
@@ -339,23 +257,16 @@ def launcher_pipeline(file_name, sep, feature_column_name, date_column_name, val
     # long_covid_selected_file = os.path.join(output_dir, f'potential_long_covid_patients_ris_information.csv')
     # long_covid_selected.to_csv(long_covid_selected_file, index=False)
     
-    # ## Save the list of deceased_patients to a CSV file
+    # ## Save the list of deceased_patients and their ris information to CSV files
     # deceased_patients_file = os.path.join(output_dir, f'deceased_patients_pseudoid_pid.csv')
-    # deceased_patients_df = pd.DataFrame(deceased_patients)
-    # deceased_patients_df.to_csv(deceased_patients_file, index=False)
-
-    # ## Save the ris information of the deceased_patients to a CSV file
     # ris_deceased_patients_selected_file = os.path.join(output_dir, f'deceased_patients_ris_information.csv')
-    # ris_deceased_patients_selected.to_csv(ris_deceased_patients_selected_file, index=False)
+    # deceased = (patients['outcome'] == 'deceased').to_numpy()
+    # save_cohort(df, patients, deceased, deceased_patients_file, ris_deceased_patients_selected_file)
 
-    ## Save the list of discharged_patients_home to a CSV file
+    ## Save the list of discharged_patients_home and their ris information to CSV files
     discharged_patients_home_file = os.path.join(output_dir, f'discharged_patients_home_pseudoid_pid.csv')
-    discharged_patients_home_df = pd.DataFrame(discharged_patients_home)
-    discharged_patients_home_df.to_csv(discharged_patients_home_file, index=False)
-
-    ## Save the ris information of the discharged_patients_home to a CSV file
     ris_discharged_patients_selected_file = os.path.join(output_dir, f'discharged_patients_home_ris_information.csv')
-    ris_discharged_patients_selected.to_csv(ris_discharged_patients_selected_file, index=False)
+    save_cohort(df, patients, discharged_control, discharged_patients_home_file, ris_discharged_patients_selected_file)
 
 
 
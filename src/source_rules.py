@@ -0,0 +1,146 @@
+"""
+Per-source row rules of the clinical feature extraction.
+
+Every source registers a list of rules (drop features by name pattern, drop patients by null policy,
+clip values) that are applied as vectorized masks over the whole table before the extraction, instead
+of source-specific branches inside the per-patient loop. A new kind of rule is added by registering a
+function with register_rule, and a new rule of a source by adding its spec to SOURCE_RULES.
+"""
+
+import numpy as np
+import pandas as pd
+
+from numeric_values import rejected_column_name
+
+
+RULE_FUNCTIONS = {}
+
+## Rules applied to every source
+COMMON_RULES = [
+    {'rule': 'drop_features', 'pattern': 'Creatinin'},
+]
+
+SOURCE_RULES = {
+    'vasopressors': [
+        {'rule': 'drop_patients_with_null', 'column': 'amount'},
+    ],
+}
+
+
+def register_rule(name, kind='filter'):
+    """
+    Registers a rule function under a name usable in the rule specs.
+
+    A 'filter' rule returns a boolean mask of the rows to keep, a 'transform' rule returns the modified
+    DataFrame. Both receive the DataFrame, the source context and the parameters of the spec.
+
+    Args:
+        name (str): Name of the rule in the specs.
+        kind (str): 'filter' or 'transform'.
+    """
+    if kind not in ('filter', 'transform'):
+        raise ValueError(f"Unknown rule kind '{kind}'")
+
+    def decorator(function):
+        RULE_FUNCTIONS[name] = (kind, function)
+        return function
+    return decorator
+
+
+def matches_pattern(series, pattern):
+    """
+    Returns the rows whose value contains a pattern, evaluated once per category for categorical columns.
+
+    Args:
+        series (pd.Series): The column to match.
+        pattern (str): Substring to look for.
+
+    Returns:
+        np.ndarray: Boolean mask of the matching rows.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        matching_categories = series.cat.categories.astype(str).str.contains(pattern, regex=False)
+        return np.isin(series.cat.codes.to_numpy(), np.flatnonzero(matching_categories))
+    return series.astype(str).str.contains(pattern, regex=False).to_numpy()
+
+
+@register_rule('drop_features')
+def drop_features(df, context, pattern):
+    """Drops the rows of the features whose name contains the pattern."""
+    return ~matches_pattern(df[context['feature_column']], pattern)
+
+
+@register_rule('drop_patients_with_null')
+def drop_patients_with_null(df, context, column=None):
+    """
+    Drops all the rows of the patients with a missing value in the column (the value column by default).
+
+    Only the values missing in the extract count, not the raw strings the numeric coercion rejected.
+    """
+    column = column or context['value_column']
+    id_column = context['id_column']
+    missing = df[column].isna()
+    if rejected_column_name(column) in df.columns:
+        missing &= ~df[rejected_column_name(column)]
+    null_patients = df.loc[missing, id_column].unique()
+    return ~df[id_column].isin(null_patients).to_numpy()
+
+
+@register_rule('clip_values', kind='transform')
+def clip_values(df, context, lower=None, upper=None, column=None):
+    """Clips the values of the column (the value column by default) to a range."""
+    column = column or context['value_column']
+    return df.assign(**{column: pd.to_numeric(df[column], errors='coerce').clip(lower, upper)})
+
+
+def get_source_rules(file_name):
+    """
+    Returns the rule specs of a source, the common rules first.
+
+    Args:
+        file_name (str): Name of the source.
+
+    Returns:
+        list: The rule specs.
+    """
+    return COMMON_RULES + SOURCE_RULES.get(file_name, [])
+
+
+def apply_source_rules(df, file_name, feature_column_name, value_column_name, id_column='pseudoid_pid', rules=None):
+    """
+    Applies the rules of a source to the whole table.
+
+    The filter masks are evaluated on the input table and combined, so the rows are filtered once.
+    The transform rules are applied afterwards, in their order.
+
+    Args:
+        df (pd.DataFrame): The source rows.
+        file_name (str): Name of the source.
+        feature_column_name (str): Column with the feature names.
+        value_column_name (str): Column with the feature values.
+        id_column (str): Column with the patient id.
+        rules (list): Rule specs to apply instead of the registered rules of the source.
+
+    Returns:
+        pd.DataFrame: The filtered and transformed rows.
+    """
+    context = {'feature_column': feature_column_name, 'value_column': value_column_name, 'id_column': id_column}
+    rules = get_source_rules(file_name) if rules is None else rules
+
+    keep = np.ones(len(df), dtype=bool)
+    transforms = []
+    for spec in rules:
+        if spec['rule'] not in RULE_FUNCTIONS:
+            raise KeyError(f"Unknown rule '{spec['rule']}', registered rules: {', '.join(RULE_FUNCTIONS)}")
+        kind, function = RULE_FUNCTIONS[spec['rule']]
+        params = {key: value for key, value in spec.items() if key != 'rule'}
+        if kind == 'filter':
+            keep &= np.asarray(function(df, context, **params), dtype=bool)
+        else:
+            transforms.append((function, params))
+
+    if not keep.all():
+        df = df[keep]
+    for function, params in transforms:
+        df = function(df, context, **params)
+    return df
@@ -0,0 +1,175 @@
+"""
+Registry of the IDSC clinical data sources.
+
+Every source declares its separator, its id/feature/date/value columns, explicit compact dtypes and
+the format of its date column. The reader applies the schema while loading the CSV file, so the
+feature names are categorical, the patient ids int32 and the values float32 instead of the
+object/int64/float64 columns inferred by pandas. The value columns keep their censored results
+('<0.5', '>1000') with a censoring flag, see numeric_values.
+"""
+
+import pandas as pd
+
+from date_normalization import normalize_dates
+from medication_doses import resolve_medication_doses
+from numeric_values import coerce_numeric_columns, reject_table_path, write_reject_table
+
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SOURCE_SCHEMAS = {
+    'lab_data': {
+        'sep': ';',
+        'id_column': 'pseudoid_pid',
+        'feature_column': 'lab_name',
+        'date_column': 'lab_req_date',
+        'value_column': 'lab_nval',
+        'dtypes': {'pseudoid_pid': 'int32', 'lab_name': 'category'},
+        'numeric_columns': {'lab_nval': 'float32'},
+        'date_format': DATETIME_FORMAT,
+    },
+    'medications': {
+        'sep': ';',
+        'id_column': 'pseudoid_pid',
+        'feature_column': 'med_atc',
+        'date_column': 'med_date',
+        'value_column': 'med_dose_value',
+        'dtypes': {'pseudoid_pid': 'int32', 'med_atc': 'category', 'med_medication': 'category'},
+        'numeric_columns': {},
+        ## Administered dose first, prescribed dose otherwise, parsed with their units (see medication_doses)
+        'dose_columns': ['med_given_dose', 'med_dose'],
+        'date_format': DATETIME_FORMAT,
+    },
+    'vasopressors': {
+        'sep': ';',
+        'id_column': 'pseudoid_pid',
+        'feature_column': 'atc_code',
+        'date_column': 'date',
+        'value_column': 'amount',
+        'dtypes': {'pseudoid_pid': 'int32', 'atc_code': 'category'},
+        'numeric_columns': {'amount': 'float32'},
+        'date_format': DATETIME_FORMAT,
+    },
+    'o2_data_pdms': {
+        'sep': ';',
+        'id_column': 'pseudoid_pid',
+        'feature_column': 'name',
+        'date_column': 'datetime',
+        'value_column': 'value',
+        'dtypes': {'pseudoid_pid': 'int32', 'name': 'category'},
+        'numeric_columns': {'value': 'float32'},
+        'date_format': DATETIME_FORMAT,
+    },
+    'oxygen_supply': {
+        'sep': ';',
+        'id_column': 'pseudoid_pid',
+        'feature_column': 'name',
+        'date_column': 'date',
+        'value_column': 'dose',
+        'dtypes': {'pseudoid_pid': 'int32', 'name': 'category'},
+        'numeric_columns': {'dose': 'float32'},
+        'date_format': DATETIME_FORMAT,
+    },
+    'o2_gabe': {
+        'sep': ';',
+        'id_column': 'pseudoid_pid',
+        'feature_column': 'type',
+        'date_column': 'date',
+        'value_column': 'value',
+        'dtypes': {'pseudoid_pid': 'int32', 'type': 'category'},
+        'numeric_columns': {'value': 'float32'},
+        'date_format': DATETIME_FORMAT,
+    },
+    'ris_data': {
+        'sep': ',',
+        'id_column': 'pseudoid_pid',
+        'feature_column': 'ris_examination_type',
+        'date_column': 'ris_examination_begin',
+        'value_column': 'value',
+        'dtypes': {'pseudoid_pid': 'int32', 'ris_examination_type': 'category'},
+        'numeric_columns': {'value': 'float32'},
+        'date_format': DATETIME_FORMAT,
+    },
+}
+
+
+def get_source_schema(file_name):
+    """
+    Returns the schema of a registered source.
+
+    Args:
+        file_name (str): Name of the source file, without extension.
+
+    Returns:
+        dict: The schema of the source.
+    """
+    if file_name not in SOURCE_SCHEMAS:
+        raise KeyError(f"Unknown source '{file_name}', registered sources: {', '.join(SOURCE_SCHEMAS)}")
+    return SOURCE_SCHEMAS[file_name]
+
+
+def apply_schema(df, schema, rejects=None):
+    """
+    Casts the columns of a DataFrame to the compact dtypes of a source schema.
+
+    Args:
+        df (pd.DataFrame): DataFrame read from the source file.
+        schema (dict): The schema of the source.
+        rejects (list): When given, receives the reject table of the value columns (see numeric_values).
+
+    Returns:
+        pd.DataFrame: The DataFrame with the schema dtypes applied.
+    """
+    dtypes = {column: dtype for column, dtype in schema['dtypes'].items() if column in df.columns}
+    df = df.astype(dtypes)
+
+    ## Coerce the value columns once for the whole table instead of per patient and feature
+    df, column_rejects = coerce_numeric_columns(df, schema['numeric_columns'], schema['feature_column'])
+    if rejects is not None:
+        rejects.append(column_rejects)
+
+    ## Resolve the doses once for the whole table into the value column, in the main unit of every feature
+    if schema.get('dose_columns'):
+        df = resolve_medication_doses(df, schema['dose_columns'], schema['value_column'],
+                                      feature_column=schema['feature_column'])
+
+    date_column = schema['date_column']
+    df[date_column], _ = normalize_dates(df[date_column], schema['date_format'])
+
+    return df
+
+
+def read_source(csv_file_path, schema, reject_file=None, **read_csv_kwargs):
+    """
+    Reads a source CSV file with the dtypes declared in its schema.
+
+    The reject table of the value columns is written once the whole file is read, by default to
+    '.rejects/<source>_numeric_rejects.csv' next to the source file.
+
+    Args:
+        csv_file_path (str): Path to the source CSV file.
+        schema (dict): The schema of the source.
+        reject_file (str): Path of the reject table.
+        **read_csv_kwargs: Extra arguments for pd.read_csv (e.g. chunksize).
+
+    Returns:
+        pd.DataFrame: The typed DataFrame, or an iterator of typed chunks when chunksize is given.
+    """
+    if reject_file is None:
+        reject_file = reject_table_path(csv_file_path)
+    reader = pd.read_csv(csv_file_path, sep=schema['sep'], dtype=schema['dtypes'], **read_csv_kwargs)
+    if 'chunksize' in read_csv_kwargs:
+        return iter_source_chunks(reader, schema, reject_file)
+
+    rejects = []
+    df = apply_schema(reader, schema, rejects)
+    write_reject_table(rejects, reject_file)
+    return df
+
+
+def iter_source_chunks(reader, schema, reject_file):
+    """Applies the schema to the chunks of a source and writes the reject table of all the chunks."""
+    rejects = []
+    for chunk in reader:
+        yield apply_schema(chunk, schema, rejects)
+    write_reject_table(rejects, reject_file)
@@ -0,0 +1,262 @@
+"""
+Sparse storage of the per-patient day x feature matrices.
+
+The wide 'patient_{id}.csv' files have one row per day offset and one column per feature and are mostly
+NaN. The sparse store keeps only the observed cells of a source, CSR-style:
+
+    features.parquet   the feature vocabulary (feature_index -> feature), in sorted order
+    patients.parquet   one row per patient with the [start, stop) range of its entries
+    entries.parquet    (feature_index, days, value) of every observed cell, sorted by patient and day
+
+The loaders slice the entries of a patient and densify only the requested day window.
+"""
+
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scipy import sparse
+
+
+def smallest_int_dtype(values, dtypes=('int16', 'int32')):
+    """
+    Returns the smallest integer dtype able to hold the values.
+
+    Args:
+        values (np.ndarray): The integer values.
+        dtypes (tuple): Candidate dtypes, smallest first.
+
+    Returns:
+        str: The dtype name.
+    """
+    if len(values) == 0:
+        return dtypes[0]
+    for dtype in dtypes:
+        info = np.iinfo(dtype)
+        if values.min() >= info.min and values.max() <= info.max:
+            return dtype
+    return 'int64'
+
+
+class SparseFeatureWriter:
+    """
+    Collects the aggregated (patient, day, feature) values of a source and writes the sparse store.
+
+    Args:
+        sparse_dir (str): Directory of the store. An existing store is replaced.
+    """
+
+    def __init__(self, sparse_dir):
+        self.sparse_dir = sparse_dir
+        self.vocabulary = {}
+        self.parts = []
+
+        if os.path.exists(sparse_dir):
+            shutil.rmtree(sparse_dir)
+        os.makedirs(sparse_dir)
+
+    def add(self, aggregated):
+        """
+        Adds the values returned by pivot_engine.aggregate_features for a set of patients.
+
+        Args:
+            aggregated (pd.Series): Values indexed by (patient, day, feature).
+        """
+        codes, uniques = pd.factorize(aggregated.index.get_level_values(2))
+        index_map = np.array([self.vocabulary.setdefault(str(feature), len(self.vocabulary)) for feature in uniques],
+                             dtype='int64')
+        self.parts.append((
+            aggregated.index.get_level_values(0).to_numpy(dtype='int64'),
+            aggregated.index.get_level_values(1).to_numpy(dtype='int64'),
+            index_map[codes],
+            aggregated.to_numpy(dtype='float32'),
+        ))
+
+    def close(self):
+        """Sorts the collected cells and writes the vocabulary, the patient ranges and the entries."""
+        if self.parts:
+            patient_ids, days, feature_index, values = (np.concatenate(columns) for columns in zip(*self.parts))
+        else:
+            patient_ids, days, feature_index, values = (np.array([], dtype=dtype) for dtype in ('int64', 'int64', 'int64', 'float32'))
+
+        ## Renumber the features in sorted order, the column order of the dense matrices
+        features = np.array(list(self.vocabulary), dtype=object)
+        order = np.argsort(features, kind='stable')
+        rank = np.empty(len(order), dtype='int64')
+        rank[order] = np.arange(len(order))
+        feature_index = rank[feature_index] if len(feature_index) else feature_index
+
+        entry_order = np.lexsort((feature_index, days, patient_ids))
+        patient_ids, days, feature_index, values = (
+            patient_ids[entry_order], days[entry_order], feature_index[entry_order], values[entry_order])
+
+        unique_ids, start_rows = np.unique(patient_ids, return_index=True)
+        stop_rows = np.append(start_rows[1:], len(patient_ids)).astype('int64')
+
+        pd.DataFrame({'feature_index': np.arange(len(features)), 'feature': features[order].astype(str)}).to_parquet(
+            os.path.join(self.sparse_dir, 'features.parquet'), index=False)
+        pd.DataFrame({'pseudoid_pid': unique_ids, 'start_row': start_rows, 'stop_row': stop_rows}).to_parquet(
+            os.path.join(self.sparse_dir, 'patients.parquet'), index=False)
+        entries = pa.table({
+            'feature_index': feature_index.astype(smallest_int_dtype(feature_index)),
+            'days': days.astype(smallest_int_dtype(days)),
+            'value': values,
+        })
+        pq.write_table(entries, os.path.join(self.sparse_dir, 'entries.parquet'), compression='zstd')
+        self.parts = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+class SparseFeatures:
+    """
+    Reader of a sparse store, densifying the matrices of the patients on demand.
+
+    Args:
+        sparse_dir (str): Directory of the store.
+    """
+
+    def __init__(self, sparse_dir):
+        self.features = pd.read_parquet(os.path.join(sparse_dir, 'features.parquet'))['feature'].to_numpy()
+        patients = pd.read_parquet(os.path.join(sparse_dir, 'patients.parquet'))
+        self.patient_ranges = dict(zip(patients['pseudoid_pid'].tolist(),
+                                       zip(patients['start_row'].tolist(), patients['stop_row'].tolist())))
+        entries = pq.read_table(os.path.join(sparse_dir, 'entries.parquet'), memory_map=True)
+        self.feature_index = entries.column('feature_index').to_numpy()
+        self.days = entries.column('days').to_numpy()
+        self.values = entries.column('value').to_numpy()
+
+    @property
+    def patient_ids(self):
+        """The patients of the store, in ascending order."""
+        return list(self.patient_ranges)
+
+    def patient_entries(self, patient, init_day=None, end_day=None):
+        """
+        Returns the observed cells of a patient within a day window.
+
+        Args:
+            patient (int): The patient id.
+            init_day (int): First day of the window.
+            end_day (int): Last day of the window.
+
+        Returns:
+            tuple: (feature_index, days, values) arrays, sorted by day.
+        """
+        start, stop = self.patient_ranges.get(int(patient), (0, 0))
+        feature_index, days, values = self.feature_index[start:stop], self.days[start:stop], self.values[start:stop]
+
+        ## The entries of a patient are sorted by day, so the window is a contiguous slice
+        lower = 0 if init_day is None else np.searchsorted(days, init_day, side='left')
+        upper = len(days) if end_day is None else np.searchsorted(days, end_day, side='right')
+        return feature_index[lower:upper], days[lower:upper], values[lower:upper]
+
+    def patient_frame(self, patient, init_day=None, end_day=None):
+        """
+        Returns the matrix of a patient like its 'patient_{id}.csv' file: the observed days and features only.
+
+        Args:
+            patient (int): The patient id.
+            init_day (int): First day of the window.
+            end_day (int): Last day of the window.
+
+        Returns:
+            pd.DataFrame: A 'days' column and one column per observed feature, sorted by day.
+        """
+        feature_index, days, values = self.patient_entries(patient, init_day, end_day)
+        day_values, rows = np.unique(days, return_inverse=True)
+        feature_values, columns = np.unique(feature_index, return_inverse=True)
+
+        matrix = np.full((len(day_values), len(feature_values)), np.nan, dtype='float32')
+        matrix[rows, columns] = values
+        patient_df = pd.DataFrame(matrix.astype('float64'), columns=self.features[feature_values])
+        patient_df.insert(0, 'days', day_values.astype('int64'))
+        return patient_df
+
+    def densify(self, patient, init_day, end_day, features=None):
+        """
+        Returns the dense matrix of a patient over every day of a window.
+
+        Args:
+            patient (int): The patient id.
+            init_day (int): First day of the window.
+            end_day (int): Last day of the window.
+            features (list): Columns of the matrix, all the features of the store by default.
+
+        Returns:
+            pd.DataFrame: A 'days' column with every day of the window and one column per feature, NaN
+                where the feature was not observed.
+        """
+        columns = self.features if features is None else np.asarray(features, dtype=object)
+        column_lookup = pd.Index(self.features).get_indexer(columns)
+        column_of_feature = np.full(len(self.features), -1, dtype='int64')
+        column_of_feature[column_lookup[column_lookup >= 0]] = np.flatnonzero(column_lookup >= 0)
+
+        feature_index, days, values = self.patient_entries(patient, init_day, end_day)
+        selected = column_of_feature[feature_index] >= 0
+
+        matrix = np.full((end_day - init_day + 1, len(columns)), np.nan, dtype='float32')
+        matrix[days[selected] - init_day, column_of_feature[feature_index[selected]]] = values[selected]
+        patient_df = pd.DataFrame(matrix, columns=columns)
+        patient_df.insert(0, 'days', np.arange(init_day, end_day + 1))
+        return patient_df
+
+    def to_csr(self, patient_ids, init_day, end_day):
+        """
+        Returns the cells of a list of patients within a day window as one CSR matrix.
+
+        Args:
+            patient_ids (list): The patients, in the order of the row blocks.
+            init_day (int): First day of the window.
+            end_day (int): Last day of the window.
+
+        Returns:
+            tuple: (matrix, rows) where matrix is a scipy CSR matrix with one row per (patient, day) of the
+                window and one column per feature, and rows the DataFrame of the (pseudoid_pid, days) of
+                every row. Unobserved cells are implicit zeros, observed zeros are stored explicitly.
+        """
+        n_days = end_day - init_day + 1
+        row_blocks, column_blocks, value_blocks = [], [], []
+        for position, patient in enumerate(patient_ids):
+            feature_index, days, values = self.patient_entries(patient, init_day, end_day)
+            row_blocks.append(position * n_days + (days.astype('int64') - init_day))
+            column_blocks.append(feature_index.astype('int64'))
+            value_blocks.append(values)
+
+        shape = (len(patient_ids) * n_days, len(self.features))
+        if row_blocks:
+            coo = sparse.coo_matrix((np.concatenate(value_blocks), (np.concatenate(row_blocks), np.concatenate(column_blocks))),
+                                    shape=shape)
+        else:
+            coo = sparse.coo_matrix(shape, dtype='float32')
+        rows = pd.DataFrame({
+            'pseudoid_pid': np.repeat(np.asarray(patient_ids), n_days),
+            'days': np.tile(np.arange(init_day, end_day + 1), len(patient_ids)),
+        })
+        return coo.tocsr(), rows
+
+
+def read_sparse_patient_frames(sparse_dir, patient_ids=None, init_day=None, end_day=None):
+    """
+    Reads the day x feature matrices of a list of patients from the sparse store.
+
+    Args:
+        sparse_dir (str): Directory of the store.
+        patient_ids (list): Restrict the read to these patients.
+        init_day (int): First day of the window.
+        end_day (int): Last day of the window.
+
+    Returns:
+        dict: Patient id -> day x feature DataFrame, like feature_store.read_patient_frames.
+    """
+    store = SparseFeatures(sparse_dir)
+    patient_ids = store.patient_ids if patient_ids is None else [int(patient_id) for patient_id in patient_ids]
+    return {patient: store.patient_frame(patient, init_day, end_day)
+            for patient in patient_ids if patient in store.patient_ranges}
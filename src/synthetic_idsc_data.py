@@ -0,0 +1,281 @@
+"""
+Generator of synthetic IDSC-shaped data.
+
+Writes lab_data, medications, vasopressors, ris_data and general_data files with the columns,
+separators and date formats of the IDSC extract, plus the hospitalization timeline, the lab feature
+grouping and the cohort lists read by the matrix building scripts, laid out under the roots of
+data_paths. The patients are generated in chunks and appended to the files, so 100k patients are
+written in a bounded memory. No real patient data is involved.
+
+    python synthetic_idsc_data.py --output-dir /tmp/idsc_synthetic --patients 10000
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+from lab_ontology import LAB_CATEGORIES
+
+
+FIRST_PATIENT_ID = 1000001
+ADMISSION_START = pd.Timestamp('2020-03-01')
+
+LAB_NAMES = [lab_name for lab_names in LAB_CATEGORIES.values() for lab_name in lab_names] + ['Creatinin-Clearance']
+MEDICATIONS = {'N02BE01': 'Paracetamol', 'B01AB05': 'Enoxaparin', 'J01CR02': 'Amoxicillin', 'H02AB02': 'Dexamethason',
+               'A02BC02': 'Pantoprazol', 'C03CA01': 'Furosemid'}
+DOSE_UNITS = ['mg', 'g', 'mcg', 'ml', 'IE']
+VASOPRESSORS = ['C01CA03', 'C01CA24', 'C01CA04']
+EXAMINATION_TYPES = ['CTA', 'CTHATHAB', 'CTHATHOB', 'CTHTH', 'CTHTHABD', 'CTTH', 'CTTHABD', 'CTTHOB', 'CTUB', 'IMPCTTH',
+                     'IMPCTTHAB', 'TH', 'MRI', 'RX', 'US']
+DISCHARGE_TYPES = ['Entlassung', 'Verstorben', 'Altersheim', 'Andere']
+DISCHARGE_WEIGHTS = [0.75, 0.1, 0.1, 0.05]
+
+
+def format_dates(dates):
+    """
+    Formats datetime64 values like the IDSC extract ('%Y-%m-%d %H:%M:%S').
+
+    Args:
+        dates (np.ndarray): datetime64 values.
+
+    Returns:
+        np.ndarray: The formatted strings.
+    """
+    return np.char.replace(np.datetime_as_string(dates.astype('datetime64[s]'), unit='s'), 'T', ' ')
+
+
+def with_missing(values, missingness, rng):
+    """
+    Replaces a fraction of the values with missing values.
+
+    Args:
+        values (np.ndarray): The values.
+        missingness (float): Fraction of missing values.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        np.ndarray: The values as objects, with None at the missing positions.
+    """
+    values = values.astype(object)
+    values[rng.random(len(values)) < missingness] = None
+    return values
+
+
+def generate_patients(patient_ids, rng):
+    """
+    Generates the admission, discharge and outcome of a chunk of patients.
+
+    Args:
+        patient_ids (np.ndarray): The patient ids.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        pd.DataFrame: One row per patient with datetime64 admission, discharge, covid19 begin and death dates.
+    """
+    n_patients = len(patient_ids)
+    admissions = ADMISSION_START.to_datetime64() + (rng.integers(0, 700 * 24, n_patients) * np.timedelta64(1, 'h'))
+    stay_days = rng.gamma(2.0, 5.0, n_patients).astype('int64') + 1
+    discharge_types = rng.choice(DISCHARGE_TYPES, n_patients, p=DISCHARGE_WEIGHTS)
+
+    deaths = np.full(n_patients, np.datetime64('NaT'), dtype='datetime64[ns]')
+    deceased = discharge_types == 'Verstorben'
+    deaths[deceased] = admissions[deceased] + rng.integers(1, 120, deceased.sum()) * np.timedelta64(1, 'D')
+
+    return pd.DataFrame({
+        'pseudoid_pid': patient_ids,
+        'date_admission_hosp': admissions.astype('datetime64[ns]'),
+        'date_discharge_hosp': (admissions + stay_days * np.timedelta64(1, 'D')).astype('datetime64[ns]'),
+        'covid19_begin': (admissions - rng.integers(0, 10, n_patients) * np.timedelta64(1, 'D')).astype('datetime64[ns]'),
+        'discharge_type': discharge_types,
+        'date_death': deaths,
+    })
+
+
+def generate_events(patients, events_per_patient, span_days, rng):
+    """
+    Draws the patient and date of the events of a chunk of patients.
+
+    Args:
+        patients (pd.DataFrame): The patients of generate_patients.
+        events_per_patient (float): Mean number of events per patient.
+        span_days (tuple): (first, last) day of the events relative to the admission.
+        rng (np.random.Generator): The random generator.
+
+    Returns:
+        tuple: (patient_ids, dates) arrays with one entry per event.
+    """
+    n_events = rng.poisson(events_per_patient, len(patients))
+    patient_ids = np.repeat(patients['pseudoid_pid'].to_numpy(), n_events)
+    admissions = np.repeat(patients['date_admission_hosp'].to_numpy(), n_events)
+    ## Most events are charted during the stay, the rest over the whole span
+    offsets = np.where(rng.random(len(patient_ids)) < 0.7,
+                       rng.exponential(7 * 24, len(patient_ids)),
+                       rng.uniform(span_days[0] * 24, span_days[1] * 24, len(patient_ids)))
+    dates = admissions + (offsets * 3600).astype('int64') * np.timedelta64(1, 's')
+    return patient_ids, dates
+
+
+def lab_rows(patients, events_per_patient, missingness, span_days, rng):
+    patient_ids, dates = generate_events(patients, events_per_patient, span_days, rng)
+    n_rows = len(patient_ids)
+    values = np.round(rng.lognormal(3.0, 1.0, n_rows), 2).astype(str)
+    ## Censored results as reported by the lab
+    censored = rng.random(n_rows) < 0.02
+    values[censored] = np.where(rng.random(censored.sum()) < 0.5, '<0.5', '>1000')
+    return pd.DataFrame({
+        'pseudoid_pid': patient_ids,
+        'lab_name': rng.choice(LAB_NAMES, n_rows),
+        'lab_req_date': format_dates(dates),
+        'lab_nval': with_missing(values, missingness, rng),
+    })
+
+
+def medication_rows(patients, events_per_patient, missingness, span_days, rng):
+    patient_ids, dates = generate_events(patients, events_per_patient, span_days, rng)
+    n_rows = len(patient_ids)
+    atc_codes = rng.choice(list(MEDICATIONS), n_rows)
+    doses = (rng.integers(1, 10, n_rows) * 0.5).astype(str)
+    with_unit = rng.random(n_rows) < 0.4
+    doses[with_unit] = np.char.add(np.char.add(doses[with_unit], ' '), rng.choice(DOSE_UNITS, with_unit.sum()))
+    return pd.DataFrame({
+        'pseudoid_pid': patient_ids,
+        'med_atc': atc_codes,
+        'med_medication': pd.Series(atc_codes).map(MEDICATIONS).to_numpy(),
+        'med_date': format_dates(dates),
+        'med_dose': with_missing(doses, missingness, rng),
+        'med_given_dose': with_missing(np.round(rng.random(n_rows) * 500, 1), max(missingness, 0.5), rng),
+    })
+
+
+def vasopressor_rows(patients, events_per_patient, missingness, span_days, rng):
+    ## Only a fraction of the patients needs vasopressors
+    patients = patients[rng.random(len(patients)) < 0.2]
+    patient_ids, dates = generate_events(patients, events_per_patient, span_days, rng)
+    n_rows = len(patient_ids)
+    return pd.DataFrame({
+        'pseudoid_pid': patient_ids,
+        'atc_code': rng.choice(VASOPRESSORS, n_rows),
+        'date': format_dates(dates),
+        'amount': with_missing(np.round(rng.random(n_rows) * 10, 2), missingness / 10, rng),
+    })
+
+
+def ris_rows(patients, rng):
+    ## A few examinations per patient, with a long follow-up for part of the cohort
+    n_exams = rng.integers(1, 8, len(patients))
+    patient_ids = np.repeat(patients['pseudoid_pid'].to_numpy(), n_exams)
+    admissions = np.repeat(patients['date_admission_hosp'].to_numpy(), n_exams)
+    follow_up_days = np.repeat(np.where(rng.random(len(patients)) < 0.3, 360, 50), n_exams)
+    offsets = rng.uniform(-30, 1, len(patient_ids)) * 24 + rng.random(len(patient_ids)) * follow_up_days * 24
+    dates = admissions + (offsets * 3600).astype('int64') * np.timedelta64(1, 's')
+    return pd.DataFrame({
+        'pseudoid_pid': patient_ids,
+        'ris_examination_type': rng.choice(EXAMINATION_TYPES, len(patient_ids)),
+        'ris_examination_begin': format_dates(dates),
+        'value': 1.0,
+    })
+
+
+def append_csv(df, file_path, sep, first_chunk):
+    """Writes the first chunk of a file with its header and appends the next ones."""
+    df.to_csv(file_path, sep=sep, index=False, mode='w' if first_chunk else 'a', header=first_chunk)
+
+
+def generate_idsc_dataset(idsc_dir, patientomics_dir, long_covid_dir, n_patients=1000, events_per_patient=50,
+                          missingness=0.05, span_days=(-30, 365), chunk_patients=10_000, seed=0):
+    """
+    Writes a synthetic IDSC dataset under the given roots.
+
+    Args:
+        idsc_dir (str): Root of the IDSC extract (data_paths.IDSC_DATA_DIR).
+        patientomics_dir (str): Root of the patientomics data (data_paths.PATIENTOMICS_DATA_DIR).
+        long_covid_dir (str): Root of the long covid study data (data_paths.LONG_COVID_STUDY_DIR).
+        n_patients (int): Number of patients.
+        events_per_patient (float): Mean number of lab events per patient, the other sources scale from it.
+        missingness (float): Fraction of missing values.
+        span_days (tuple): (first, last) day of the events relative to the admission.
+        chunk_patients (int): Number of patients generated at once.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        dict: Number of rows written per file.
+    """
+    rng = np.random.default_rng(seed)
+    dicts_dir = os.path.join(patientomics_dir, 'dicts')
+    plcp_dir = os.path.join(patientomics_dir, '05_data_exploration', '01_preprocessing_116_PLCP')
+    matrices_dir = os.path.join(long_covid_dir, '04_lung_function_tests', '03_FirstAnalysis', '02_time_series_matrices')
+    for directory in [idsc_dir, dicts_dir, plcp_dir, matrices_dir,
+                      os.path.join(patientomics_dir, '05_data_exploration', '02_preprocessing_NC'),
+                      os.path.join(patientomics_dir, '03_long_covid_potential_patients')]:
+        os.makedirs(directory, exist_ok=True)
+
+    sources = {
+        'lab_data': (lambda patients: lab_rows(patients, events_per_patient, missingness, span_days, rng), ';'),
+        'medications': (lambda patients: medication_rows(patients, events_per_patient / 2, missingness, span_days, rng), ';'),
+        'vasopressors': (lambda patients: vasopressor_rows(patients, events_per_patient / 2, missingness, span_days, rng), ';'),
+        'ris_data': (lambda patients: ris_rows(patients, rng), ','),
+    }
+    n_rows = {name: 0 for name in ['general_data', 'general_data_hosp_timeline'] + list(sources)}
+    deceased_ids, cohort_ids = [], []
+
+    for chunk_start in range(0, n_patients, chunk_patients):
+        first_chunk = chunk_start == 0
+        patient_ids = np.arange(FIRST_PATIENT_ID + chunk_start, FIRST_PATIENT_ID + min(chunk_start + chunk_patients, n_patients))
+        patients = generate_patients(patient_ids, rng)
+
+        general_data = patients.copy()
+        general_data.insert(0, 'study_id', patient_ids - FIRST_PATIENT_ID)
+        for column in ['date_admission_hosp', 'date_discharge_hosp', 'covid19_begin']:
+            general_data[column] = format_dates(general_data[column].to_numpy())
+        general_data['date_death'] = np.where(patients['date_death'].isna(), 'NULL',
+                                              format_dates(patients['date_death'].fillna(ADMISSION_START).to_numpy()))
+        append_csv(general_data, os.path.join(idsc_dir, 'general_data.csv'), ';', first_chunk)
+
+        ## Part of the patients has a second admission in the timeline
+        readmitted = general_data[rng.random(len(general_data)) < 0.2].copy()
+        readmitted['date_admission_hosp'] = format_dates(
+            patients.loc[readmitted.index, 'date_discharge_hosp'].to_numpy() + rng.integers(10, 200, len(readmitted)) * np.timedelta64(1, 'D'))
+        timeline = pd.concat([general_data, readmitted])[['study_id', 'pseudoid_pid', 'date_admission_hosp',
+                                                            'date_discharge_hosp', 'covid19_begin']]
+        append_csv(timeline, os.path.join(dicts_dir, 'general_data_hosp_timeline.csv'), ',', first_chunk)
+        n_rows['general_data'] += len(general_data)
+        n_rows['general_data_hosp_timeline'] += len(timeline)
+
+        for name, (make_rows, sep) in sources.items():
+            rows = make_rows(patients)
+            append_csv(rows, os.path.join(idsc_dir, name + '.csv'), sep, first_chunk)
+            n_rows[name] += len(rows)
+
+        deceased_ids.append(patient_ids[patients['discharge_type'].to_numpy() == 'Verstorben'])
+        cohort_ids.append(patient_ids[rng.random(len(patient_ids)) < 0.1])
+        print(f"Generated patients {patient_ids[0]}-{patient_ids[-1]}")
+
+    ## Inputs of the matrix building scripts
+    pd.DataFrame({'lab_parameter': LAB_NAMES,
+                  'lab_group': [next(family for family, lab_names in LAB_CATEGORIES.items() if lab_name in lab_names)
+                                if lab_name in sum(LAB_CATEGORIES.values(), []) else 'Other' for lab_name in LAB_NAMES]}
+                 ).to_csv(os.path.join(dicts_dir, 'lab_parameter_grouping.csv'), index=False)
+    pd.DataFrame({'pseudoid_pid': np.concatenate(deceased_ids)}).to_csv(
+        os.path.join(plcp_dir, 'deceased_patients_pseudoid_pid.csv'), index=False)
+    pd.DataFrame({'pseudoid_pid': np.concatenate(cohort_ids)}).to_csv(
+        os.path.join(matrices_dir, '03_LongCovid_IDS_keys_clinical_data_OnlyLabDATA.csv'), index=False)
+
+    return n_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic IDSC-shaped dataset.")
+    parser.add_argument('--output-dir', required=True, help="Directory of the dataset, with the idsc/, patientomics/ and long_covid/ roots")
+    parser.add_argument('--patients', type=int, default=1000, help="Number of patients")
+    parser.add_argument('--events-per-patient', type=float, default=50, help="Mean number of lab events per patient")
+    parser.add_argument('--missingness', type=float, default=0.05, help="Fraction of missing values")
+    parser.add_argument('--span-days', type=int, nargs=2, default=(-30, 365), help="First and last day of the events from the admission")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the random generator")
+    args = parser.parse_args()
+
+    n_rows = generate_idsc_dataset(os.path.join(args.output_dir, 'idsc'), os.path.join(args.output_dir, 'patientomics'),
+                                   os.path.join(args.output_dir, 'long_covid'), n_patients=args.patients,
+                                   events_per_patient=args.events_per_patient, missingness=args.missingness,
+                                   span_days=tuple(args.span_days), seed=args.seed)
+    print(pd.Series(n_rows, name='rows').to_string())
@@ -3,6 +3,24 @@ import pandas as pd
 import os
 import matplotlib.pyplot as plt
 import csv
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from date_normalization import normalize_dates
+from clinical_cache import read_csv_cached, read_source_cached
+from clinical_partitions import partition_source, iter_partitions
+from source_schemas import get_source_schema
+from patient_index import read_source_patients
+from feature_store import FeatureStoreWriter
+from sparse_features import SparseFeatureWriter
+from timeline_alignment import add_admission_days
+from pivot_engine import aggregate_features, split_patient_matrices
+from patient_writer import PatientFrameWriter
+from patient_manifest import PatientManifest
+from feature_sources import format_dir, write_format_marker
+from source_rules import apply_source_rules
+from resampling import DEFAULT_AGGFUNCS, bin_name, resample_partitions
+from data_paths import IDSC_DATA_DIR, PATIENTOMICS_DATA_DIR
 
 
 def read_csv(file_path, sep=','):
@@ -20,7 +38,8 @@ def read_csv(file_path, sep=','):
 
 def preprocess_data(df, column_name):
     """
-    Preprocesses the DataFrame by converting lab_req_date to datetime format and sorting by column_name.
+    Preprocesses the DataFrame by converting column_name to datetime format and sorting by column_name.
+    The date format is detected once and only the unique dates are parsed; rows that fail to parse are reported.
 
     Args:
         df (pd.DataFrame): The input DataFrame.
@@ -28,7 +47,7 @@ def preprocess_data(df, column_name):
     Returns:
         pd.DataFrame: The preprocessed DataFrame.
     """
-    df[column_name] = pd.to_datetime(df[column_name])
+    df[column_name], _ = normalize_dates(df[column_name])
     df = df.sort_values(column_name)
     return df
 
@@ -44,7 +63,7 @@ def feature_extractor_per_patient_OLD(df, output_dir, feature_column_name, date_
     for patient, data in grouped_df:
         patient_dt = pd.DataFrame()
 
-        for feature_name, feature_data in data.groupby(feature_column_name):
+        for feature_name, feature_data in data.groupby(feature_column_name, observed=True):
             min_date = feature_data[date_column_name].min()
             feature_data['days'] = (feature_data[date_column_name] - min_date).dt.days
 
@@ -61,278 +80,339 @@ def feature_extractor_per_patient_OLD(df, output_dir, feature_column_name, date_
 
 
 
-def feature_extractor_per_patient(df, output_dir, feature_column_name, date_column_name, value_column_name):
-    grouped_df = df.groupby('pseudoid_pid')
+def load_hosp_timeline():
+    """
+    Reads the hospitalization timeline and converts its date columns.
 
+    Returns:
+        pd.DataFrame: The hospitalization timeline with 'date_admission_hosp' and 'covid19_begin' as datetime.
+    """
     ## Read the hospitalization timeline csv file
     general_data_file_name = "general_data"
-    hosp_timeline_file_name = "/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/dicts/" + general_data_file_name + "_hosp_timeline.csv" 
-    hosp_timeline_df = read_csv(hosp_timeline_file_name, sep=',')
+    hosp_timeline_file_name = PATIENTOMICS_DATA_DIR + "dicts/" + general_data_file_name + "_hosp_timeline.csv" 
+    hosp_timeline_df = read_csv_cached(hosp_timeline_file_name, sep=',', date_columns=['date_admission_hosp', 'covid19_begin'])
     # hosp_timeline = hosp_timeline_df[['pseudoid_pid', 'date_admission_hosp', 'date_discharge_hosp']]
 
     ## Preprocess the date format for 'date_admission_hosp' column
     hosp_timeline_data = preprocess_data(hosp_timeline_df, 'date_admission_hosp')
 
-    ##############################################################
-    ##############################################################
     ## Preprocess the date format for 'covid19_begin' column 
     hosp_timeline_data = preprocess_data(hosp_timeline_data, 'covid19_begin')
-    ##############################################################
-    ##############################################################
-    
-
-    for patient, data in grouped_df:
-        patient_df = pd.DataFrame()
-        print("patient: ", patient)
-
-        ## Get the hospitalization timeline for the patient
-        patient_hosp_timeline = hosp_timeline_data[hosp_timeline_data['pseudoid_pid'] == patient]
-
-        ## Get the first hospitalization date
-        first_hosp_date = patient_hosp_timeline['date_admission_hosp'].min()
-        print("first_hosp_date: ", first_hosp_date)
-
-
+    return hosp_timeline_data
 
-        #########################################################################################################
-        #########################################################################################################
-        #########################################################################################################
-
-        ## Check if the file_name = "vasopressors"
-        if file_name == "vasopressors":
-
-            ##Check if data['amount'] is null
-            if data['amount'].isnull().any():                
-                ## pass to the next iteration
-                pass
 
+def feature_extractor_per_patient(df, output_dir, feature_column_name, date_column_name, value_column_name,
+                                  file_name, hosp_timeline_data=None, store_writer=None, n_writers=4,
+                                  sparse_writer=None):
+    """
+    Aligns the features of every patient with the first hospitalization date and saves them per patient.
 
+    Args:
+        df (pd.DataFrame): The preprocessed source DataFrame.
+        output_dir (str): Directory for the 'patient_{id}.csv' files.
+        feature_column_name (str): Column with the feature names.
+        date_column_name (str): Column with the feature dates.
+        value_column_name (str): Column with the feature values.
+        file_name (str): Name of the source, used to look up its rules in source_rules.
+        hosp_timeline_data (pd.DataFrame): The hospitalization timeline. It is read when not given.
+        store_writer (FeatureStoreWriter): Add the matrices to this feature store instead of writing CSV files.
+        n_writers (int): Number of background threads writing the CSV files.
+        sparse_writer (SparseFeatureWriter): Add the aggregated cells to this sparse store instead of writing CSV files.
+    """
+    if hosp_timeline_data is None:
+        hosp_timeline_data = load_hosp_timeline()
+
+    ## Alingning the dates with the hospitalization timeline:
+    ## derive the days from the first hospitalization date for all the rows at once
+    df = add_admission_days(df, hosp_timeline_data, date_column_name)
+
+    ## Apply the row rules of the source (e.g. skip the 'Creatinin' features, the vasopressors
+    ## patients with a null 'amount') as masks over the whole table, see source_rules
+    df = apply_source_rules(df, file_name, feature_column_name, value_column_name)
+
+    # ## Alingning the dates with the covid19_begin_date
+    # df = add_admission_days(df, hosp_timeline_data, date_column_name, admission_column='covid19_begin')
+
+    ## Aggregate the (patient, day, feature) values of the whole source at once,
+    ## then split the result into the day x feature matrix of every patient
+    aggregated = aggregate_features(df, feature_column_name, value_column_name)
+
+    ## The sparse store keeps the aggregated cells as they are, no per-patient matrix is built
+    if sparse_writer is not None:
+        sparse_writer.add(aggregated)
+        return
+
+    ## The CSV files are written by background threads while the next matrices are computed
+    with PatientFrameWriter(n_workers=n_writers) as writer:
+        for patient, patient_df in split_patient_matrices(aggregated):
+            if store_writer is not None:
+                store_writer.add(patient, patient_df)
             else:
-                
-
-                ##############################################################
-                ##############################################################
-                ## Get the covid begin date
-                # covid19_begin_date = patient_hosp_timeline['covid19_begin']       
-                # print("covid19_begin_date: ", covid19_begin_date.values[0])
-                ##############################################################
-                ##############################################################
-
-
-                # ## Get the last hospitalization date
-                # last_hosp_date = patient_hosp_timeline['date_discharge_hosp'].max()
-
-                # ## Get the first and last hospitalization dates for the patient
-                # patient_hosp_timeline = patient_hosp_timeline[(patient_hosp_timeline['date_admission_hosp'] == first_hosp_date) | (patient_hosp_timeline['date_discharge_hosp'] == last_hosp_date)]
-                # print("patient_hosp_timeline: ", patient_hosp_timeline)
-
-
-
-                ## Function 
-                for feature_name, feature_data in data.groupby(feature_column_name):
-                    
-
-                    if 'Creatinin' in feature_name:
-                        # print('feature_name: ', feature_name)
-                        pass
-                    else:
-
-                        ##############################################################
-                        ##############################################################
-                        ## Alingning the dates with the hospitalization timeline
-                        min_date = first_hosp_date
-                        ## derive the days from the first hospitalization date
-                        feature_data['days'] = (feature_data[date_column_name] - first_hosp_date).dt.days
-                        print("++ feature_data: ", feature_data)
-                        #############################################################
-                        ##############################################################
-
-
-                        ##############################################################
-                        ##############################################################
-                        # ## Alingning the dates with the covid19_begin_date
-                        # min_date = covid19_begin_date
-                        # ## derive the days from the covid19_begin_date
-                        # feature_data['days'] = (feature_data[date_column_name] - covid19_begin_date.values[0]).dt.days
-                        # # feature_data['days'] = (covid19_begin_date - feature_data[date_column_name]).dt.days
-                        ##############################################################
-
-
-                        # ## Assuming covid19_begin_date is a Pandas datetime object
-                        # covid19_begin_date = pd.to_datetime(covid19_begin_date)
-
-                        # ## Convert the DatetimeArray to a NumPy array before subtraction
-                        # # feature_data['days'] = (covid19_begin_date - feature_data[date_column_name]).dt.days
-                        # feature_data['days'] = (feature_data[date_column_name] - covid19_begin_date).dt.days
-                        ##############################################################
-
-                        ##############################################################
-                        ##############################################################
-                        # # ## Get the covid and hospitalization delta
-                        # covid_hosp_delta = covid19_begin_date.values[0] - first_hosp_date
-                        ##############################################################
-
-                        ##############################################################
-                        # ## Prints
-                        # print("---------------------------------------")
-                        # print("covid_hosp_delta: ", covid_hosp_delta)
-                        # print("feature_data['days']: ", feature_data['days'])
-                        ##############################################################
-                        ##############################################################
-
-
-                        ## Convert value to numeric, handling non-numeric values
-                        feature_data[value_column_name] = pd.to_numeric(feature_data[value_column_name], errors='coerce')
+                patient_df_file = os.path.join(output_dir, f'patient_{patient}.csv')
+                writer.submit(patient_df, patient_df_file, index=False)
 
-                        # feature_data = feature_data.pivot_table(index=feature_column_name, columns='days', values=value_column_name, aggfunc='mean')
-                        feature_data = feature_data.pivot_table(index=feature_column_name, columns='days', values=value_column_name)
-                        feature_data.columns = [f'{day}' for day in feature_data.columns]
 
-                        patient_df = pd.concat([patient_df, feature_data])
+def medications_feature_extractor_per_patient(df, output_dir, feature_column_name, date_column_name, value_column_name,
+                                              hosp_timeline_data=None):
+    if hosp_timeline_data is None:
+        hosp_timeline_data = load_hosp_timeline()
 
-                        ## Transpose the dataframe
-                        patient_df_T = patient_df.T
+    ## derive the days from the first hospitalization date for all the rows at once
+    df = add_admission_days(df, hosp_timeline_data, date_column_name)
 
-                        ## Add the 'days' column name to the dataframe at the position 0
-                        patient_df_T.insert(0, 'days', patient_df_T.index)
-                        
-                        ## Set the column 'days' as an double type
-                        # patient_df_T['days'] = patient_df_T['days'].astype(float)
-                        patient_df_T['days'] = pd.to_numeric(patient_df_T['days'])
+    grouped_df = df.groupby('pseudoid_pid')
 
-                        ## Sort the dataframe by 'days' column
-                        patient_df_T = patient_df_T.sort_values(by=['days'])
+    for patient, data in grouped_df:
+        patient_df = pd.DataFrame()
 
-                patient_df_file = os.path.join(output_dir, f'patient_{patient}.csv')
-                patient_df_T.to_csv(patient_df_file, index=False)
+        ## The doses are already resolved into the numeric value column by the source schema
+        for feature_name, feature_data in data.groupby(feature_column_name, observed=True):
+            feature_data = feature_data.pivot_table(index=feature_column_name, columns='days', values=value_column_name, aggfunc='mean', observed=True)
+            feature_data.columns = [f'{day}' for day in feature_data.columns]
 
+            patient_df = pd.concat([patient_df, feature_data])
 
-def medications_feature_extractor_per_patient(df, output_dir, feature_column_name, date_column_name, value_column_name):
-    grouped_df = df.groupby('pseudoid_pid')
+        patient_df_file = os.path.join(output_dir, f'patient_{patient}.csv')
+        patient_df.to_csv(patient_df_file)
 
-    ## Read the hospitalization timeline csv file
-    general_data_file_name = "general_data"
-    hosp_timeline_file_name = "/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/dicts/" + general_data_file_name + "_hosp_timeline.csv" 
-    hosp_timeline_df = read_csv(hosp_timeline_file_name, sep=',')
-    # hosp_timeline = hosp_timeline_df[['pseudoid_pid', 'date_admission_hosp', 'date_discharge_hosp']]
 
-    ## Preprocess the date column
-    hosp_timeline_data = preprocess_data(hosp_timeline_df, 'date_admission_hosp')
 
+##############################################################################################################
+def launcher_pipeline(file_name, chunked=False, n_partitions=64, chunksize=1_000_000, patient_ids=None,
+                      hosp_timeline_data=None, output_format='csv', n_writers=4, incremental=False):
+    """
+    Extracts the features per patient for one clinical data source.
 
-    for patient, data in grouped_df:
-        patient_df = pd.DataFrame()
+    Args:
+        file_name (str): Name of the source file, without extension. The separator and the
+            id/feature/date/value columns are taken from its schema in source_schemas.
+        chunked (bool): Stream the source in chunks into patient partitions on disk and extract
+            one partition at a time, bounding the memory for extracts larger than RAM.
+        n_partitions (int): Number of patient partitions in chunked mode.
+        chunksize (int): Number of rows read per chunk in chunked mode.
+        patient_ids (list): Restrict the extraction to these patients. Only their rows are read,
+            through the patient row-range index of the source.
+        hosp_timeline_data (pd.DataFrame): The hospitalization timeline. It is read when not given.
+        output_format (str): 'csv' writes one 'patient_{id}.csv' file per patient, 'store' writes a single
+            feature store bucketed by patient into '<source>_features_store/' (see feature_store), 'sparse'
+            writes the observed cells CSR-style into '<source>_features_sparse/' (see sparse_features). The
+            format is recorded next to the output directory for the readers (see feature_sources).
+        n_writers (int): Number of background threads writing the per-patient CSV files.
+        incremental (bool): Recompute only the patients whose input rows changed since the previous run,
+            according to the per-patient content manifest of the output directory (see patient_manifest),
+            and delete the files of the patients that are no longer in the extract.
 
-        ## Get the hospitalization timeline for the patient
-        patient_hosp_timeline = hosp_timeline_data[hosp_timeline_data['pseudoid_pid'] == patient]
+    Returns:
+        dict: Summary of the extraction (source, rows, patients, features, seconds, and in incremental
+            mode the number of changed and removed patients).
+    """
+    start_time = time.perf_counter()
+    schema = get_source_schema(file_name)
+    feature_column_name = schema['feature_column']
+    date_column_name = schema['date_column']
+    value_column_name = schema['value_column']
 
-        ## Get the first hospitalization date
-        first_hosp_date = patient_hosp_timeline['date_admission_hosp'].min()
+    dir_CDA_features = IDSC_DATA_DIR
+    csv_file_path = os.path.join(dir_CDA_features, file_name + ".csv")
 
+    ## Set the output directory for the data per patient
+    output_dir = PATIENTOMICS_DATA_DIR + "06_clinical_data/" + file_name + "_features/"
+    
+    ## Create a new diretory for 'output_dir'
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
 
-        ## Function 
-        for feature_name, feature_data in data.groupby(feature_column_name):
-            min_date = first_hosp_date
-            ## derive the days from the first hospitalization date
-            feature_data['days'] = (feature_data[date_column_name] - min_date).dt.days
+    if hosp_timeline_data is None:
+        hosp_timeline_data = load_hosp_timeline()
+
+    if incremental and (output_format != 'csv' or patient_ids is not None):
+        raise ValueError("Incremental extraction needs the full extract and the 'csv' output format")
+    manifest = PatientManifest(output_dir, hosp_timeline_data) if incremental else None
+
+    store_writer, sparse_writer = None, None
+    if output_format == 'store':
+        store_writer = FeatureStoreWriter(format_dir(output_dir, 'store'))
+    elif output_format == 'sparse':
+        sparse_writer = SparseFeatureWriter(format_dir(output_dir, 'sparse'))
+
+    n_rows, n_patients = 0, 0
+    if patient_ids is not None:
+        ## Step 1: Read only the rows of the requested patients through the patient index
+        df = read_source_patients(csv_file_path, schema, patient_ids)
+        df = preprocess_data(df, date_column_name)
+        feature_list = df[feature_column_name].unique().tolist()
+        n_rows, n_patients = len(df), df['pseudoid_pid'].nunique()
+
+        ## Step 2: Save the data per patient in a CSV file
+        feature_extractor_per_patient(df, output_dir, feature_column_name, date_column_name, value_column_name,
+                                      file_name, hosp_timeline_data, store_writer, n_writers, sparse_writer)
+
+    elif chunked:
+        ## Step 1: Stream the CSV file into patient partitions on disk
+        partition_dir = os.path.join(dir_CDA_features, ".partitions", file_name)
+        partition_source(csv_file_path, partition_dir, schema, n_partitions=n_partitions, chunksize=chunksize)
+
+        ## Step 2: Extract the features one partition at a time
+        feature_list = []
+        for partition_df in iter_partitions(partition_dir, schema):
+            partition_df = preprocess_data(partition_df, date_column_name)
+            feature_list.extend(partition_df[feature_column_name].unique().tolist())
+            n_rows, n_patients = n_rows + len(partition_df), n_patients + partition_df['pseudoid_pid'].nunique()
+            if incremental:
+                ## Every patient is in a single partition, so the partitions are diffed one at a time
+                partition_df = manifest.select_changed(partition_df)
+            feature_extractor_per_patient(partition_df, output_dir, feature_column_name, date_column_name, value_column_name,
+                                          file_name, hosp_timeline_data, store_writer, n_writers, sparse_writer)
+        feature_list = list(dict.fromkeys(feature_list))
+
+    else:
+        # # Step 1: Read the CSV file into a DataFrame
+        ## The columnar cache serves reruns without re-parsing the CSV and its dates
+        df = read_source_cached(csv_file_path, schema)
+
+        # Step 2: Preprocess and categorize the data
+        df = preprocess_data(df, date_column_name)
+        # print("df: ", df.head())
+
+        # Step 3: Categorize the data
+        # Filter unique laboratory codes 'med_atc' with respective laboratory feature names 'med_medication'
+        feature_list = df[feature_column_name].unique().tolist()
+        n_rows, n_patients = len(df), df['pseudoid_pid'].nunique()
+        if incremental:
+            df = manifest.select_changed(df)
+
+        ## Step 4: Save the data per patient in a CSV file
+        feature_extractor_per_patient(df, output_dir, feature_column_name, date_column_name, value_column_name,
+                                      file_name, hosp_timeline_data, store_writer, n_writers, sparse_writer)
+
+        # ## Medications launcher
+        # medications_feature_extractor_per_patient(df, output_dir, feature_column_name, date_column_name, value_column_name, hosp_timeline_data)
+
+    if store_writer is not None:
+        store_writer.close()
+    if sparse_writer is not None:
+        sparse_writer.close()
+
+    ## The manifest is only updated once all the changed patients are written
+    manifest_summary = manifest.commit() if incremental else {}
+    ## The readers open the format written last (see feature_sources)
+    write_format_marker(output_dir, output_format)
+
+    ## Step 5: Save the list of features, only for the full extract so a cohort run does not overwrite it
+    if patient_ids is None:
+        ## Convert the list to a dataframe
+        clinical_feature_df = pd.DataFrame(feature_list, columns=[file_name])
+        medications_file_name = PATIENTOMICS_DATA_DIR + "dicts/" + file_name + ".csv"
+        save_pd_to_csv(clinical_feature_df, os.path.join(dir_CDA_features, medications_file_name))
+
+    return {
+        'source': file_name,
+        'rows': n_rows,
+        'patients': n_patients,
+        'features': len(feature_list),
+        'seconds': round(time.perf_counter() - start_time, 1),
+        **manifest_summary,
+    }
+
+
+def launcher_resampling(file_name, bin_widths=('1h', '4h', '1d'), aggfuncs=DEFAULT_AGGFUNCS, n_partitions=64,
+                        chunksize=1_000_000, hosp_timeline_data=None):
+    """
+    Resamples a high-frequency stream (o2_data_pdms, oxygen_supply) into sub-day bins from the first admission.
 
-            # Check if any value in 'med_given_dose' column is null
-            if feature_data['med_given_dose'].isnull().any():
-                # Convert 'med_given_dose' to numeric, handling non-numeric values
-                feature_data['med_given_dose'] = pd.to_numeric(feature_data['med_given_dose'], errors='coerce')
-            else:
-                ## Convert value to numeric, handling non-numeric values
-                feature_data[value_column_name] = pd.to_numeric(feature_data[value_column_name], errors='coerce')
+    The source is streamed into patient partitions and every partition is resampled into all the bin
+    widths before the next one is read, so the memory is bounded by the partition size.
 
-            # feature_data = feature_data.pivot_table(index=feature_column_name, columns='days', values=value_column_name, aggfunc='mean')
-            feature_data = feature_data.pivot_table(index=feature_column_name, columns='days', values='med_given_dose', aggfunc='mean')
-            feature_data.columns = [f'{day}' for day in feature_data.columns]
+    Args:
+        file_name (str): Name of the source file, without extension, registered in source_schemas.
+        bin_widths (tuple): Bin widths, any pd.Timedelta strings. Every width is written to
+            '<source>_resampled_<width>/' as long (patient, bin, feature) rows.
+        aggfuncs (tuple): Aggregations computed per bin.
+        n_partitions (int): Number of patient partitions.
+        chunksize (int): Number of rows read per chunk.
+        hosp_timeline_data (pd.DataFrame): The hospitalization timeline. It is read when not given.
 
-            patient_df = pd.concat([patient_df, feature_data])
+    Returns:
+        dict: Summary of the resampling (source, rows written per bin width, seconds).
+    """
+    start_time = time.perf_counter()
+    schema = get_source_schema(file_name)
 
-        patient_df_file = os.path.join(output_dir, f'patient_{patient}.csv')
-        patient_df.to_csv(patient_df_file)
+    dir_CDA_features = IDSC_DATA_DIR
+    csv_file_path = os.path.join(dir_CDA_features, file_name + ".csv")
+    output_base = PATIENTOMICS_DATA_DIR + "06_clinical_data/" + file_name + "_resampled_"
+    output_dirs = {bin_width: output_base + bin_name(bin_width) for bin_width in bin_widths}
 
+    if hosp_timeline_data is None:
+        hosp_timeline_data = load_hosp_timeline()
 
+    ## Step 1: Stream the CSV file into patient partitions on disk
+    partition_dir = os.path.join(dir_CDA_features, ".partitions", file_name)
+    partition_source(csv_file_path, partition_dir, schema, n_partitions=n_partitions, chunksize=chunksize)
 
-##############################################################################################################
-def launcher_pipeline(file_name, sep, feature_column_name, date_column_name, value_column_name):
-    # # Step 1: Read the CSV file into a DataFrame
-    dir_CDA_features = "/home/jagh/Documents/01_UB/10_Conferences_submitted/11_Second_paper/00_dataset/03_Insel_dataset/01_Preprocessing_IDSC202101463_data_v13_20221214/"
-    csv_file_path = os.path.join(dir_CDA_features, file_name + ".csv")
-    df = read_csv(csv_file_path, sep=sep)
+    ## Step 2: Resample one partition at a time into all the bin widths
+    n_rows = resample_partitions(iter_partitions(partition_dir, schema), hosp_timeline_data, schema['date_column'],
+                                 schema['feature_column'], schema['value_column'], output_dirs, aggfuncs)
 
+    return {
+        'source': file_name,
+        **{f'rows_{bin_name(bin_width)}': rows for bin_width, rows in n_rows.items()},
+        'seconds': round(time.perf_counter() - start_time, 1),
+    }
 
-    # Step 2: Preprocess and categorize the data
-    df = preprocess_data(df, date_column_name)
-    # print("df: ", df.head())
 
-    # Step 3: Categorize the data
-    # Filter unique laboratory codes 'med_atc' with respective laboratory feature names 'med_medication'
-    feature_list = df[feature_column_name].unique().tolist()
+def launcher_multi_source(file_names, max_workers=None, **launcher_kwargs):
+    """
+    Extracts several clinical data sources in one invocation.
 
+    The hospitalization timeline is read once and shared, and the independent sources run
+    concurrently in a process pool.
 
-    ## Step 4: Save the data per patient in a CSV file
-    ## Convert the list to a dataframe
+    Args:
+        file_names (list): Names of the sources registered in source_schemas.SOURCE_SCHEMAS.
+        max_workers (int): Number of worker processes. Defaults to one per source, capped by the CPU count.
+        **launcher_kwargs: Extra arguments for launcher_pipeline (e.g. chunked=True).
 
-    clinical_feature_df = pd.DataFrame(feature_list, columns=[file_name])
-    medications_file_name = "/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/dicts/" + file_name + ".csv"
-    save_pd_to_csv(clinical_feature_df, os.path.join(dir_CDA_features, medications_file_name))
+    Returns:
+        pd.DataFrame: One summary row per source.
+    """
+    hosp_timeline_data = load_hosp_timeline()
 
+    if max_workers is None:
+        max_workers = min(len(file_names), os.cpu_count() or 1)
 
-    ## Step 5: Save the data per patient in a CSV file
-    output_dir = "/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/06_clinical_data/" + file_name + "_features/"
-    
-    ## Create a new diretory for 'output_dir'
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    feature_extractor_per_patient(df, output_dir, feature_column_name, date_column_name, value_column_name)
+    summaries = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(launcher_pipeline, file_name, hosp_timeline_data=hosp_timeline_data, **launcher_kwargs): file_name
+            for file_name in file_names
+        }
+        for future, file_name in futures.items():
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                print(f"Error extracting {file_name}: {str(e)}")
+                summaries.append({'source': file_name, 'error': str(e)})
 
-    # ## Medications launcher
-    # medications_feature_extractor_per_patient(df, output_dir, feature_column_name, date_column_name, value_column_name)
+    summary_df = pd.DataFrame(summaries)
+    print(summary_df.to_string(index=False))
+    return summary_df
 
 
 
 ################################################################################################################
-file_name = "vasopressors"
-sep=';'
-feature_column_name = 'atc_code'
-date_column_name = 'date'
-value_column_name = 'amount'
-
-# file_name = "lab_data"
-# sep=';'
-# feature_column_name = 'lab_name'
-# date_column_name = 'lab_req_date'
-# value_column_name = 'lab_nval'
-
-# file_name = "medications"
-# sep=';'
-# feature_column_name = 'med_atc'
-# date_column_name = 'med_date'
-# value_column_name = 'med_dose'
-
-# file_name = "o2_data_pdms"
-# sep=';'
-# feature_column_name = 'name'
-# date_column_name = 'datetime'
-# value_column_name = 'value'
+## The per-source settings (separator, columns, dtypes) live in source_schemas.SOURCE_SCHEMAS
+if __name__ == "__main__":
+    file_names = ["lab_data", "medications", "vasopressors", "o2_data_pdms", "oxygen_supply", "o2_gabe"]
 
-# file_name = "oxygen_supply"
-# sep=';'
-# feature_column_name = 'name'
-# date_column_name = 'date'
-# value_column_name = 'dose'
+    launcher_multi_source(file_names)
 
+    # ## Single source
+    # launcher_pipeline("vasopressors")
 
-# file_name = "o2_gabe"
-# sep=';'
-# feature_column_name = 'type'
-# date_column_name = 'date'
-# value_column_name = 'value'
-
-launcher_pipeline(file_name, sep, feature_column_name, date_column_name, value_column_name)
+    # ## Sub-day bins of the high-frequency PDMS streams
+    # for file_name in ["o2_data_pdms", "oxygen_supply"]:
+    #     print(launcher_resampling(file_name))
 
 
 
@@ -20,8 +20,17 @@ import os
 import pandas as pd
 from sklearn.impute import KNNImputer
 
-def read_patient_data(patient_id, dir_lab_path):
-    """Read patient data from CSV file"""
+from feature_store import read_patient_frames
+from feature_sources import format_dir, resolve_feature_format
+from sparse_features import read_sparse_patient_frames
+from patient_timeline import PatientTimelines
+from lab_ontology import load_lab_ontology
+from data_paths import PATIENTOMICS_DATA_DIR, LONG_COVID_STUDY_DIR
+
+def read_patient_data(patient_id, dir_lab_path, patient_frames=None):
+    """Read patient data from CSV file, or from the frames bulk-read from the feature store"""
+    if patient_frames is not None:
+        return patient_frames[patient_id]
     filename = os.path.join(dir_lab_path, f'patient_{patient_id}.csv')
     return pd.read_csv(filename, sep=',', header=0)
 
@@ -29,6 +38,9 @@ def impute_missing_values(df, columns_to_impute, n_neighbors=1):
     """Impute missing values using KNNImputer"""
     imputer = KNNImputer(n_neighbors=n_neighbors)
     for column in columns_to_impute:
+        ## KNNImputer drops the columns without any observed value, they stay missing
+        if df[column].isna().all():
+            continue
         column_values = df[[column]].values
         imputed_values = imputer.fit_transform(column_values)
         df[column] = imputed_values
@@ -52,13 +64,12 @@ def process_patient(patient_id, df_lab_days, columns_to_impute, n_neighbors=1):
         
     return pd.concat(patient_dfs_imputed, ignore_index=True), pd.concat(patient_dfs_original, ignore_index=True)
 
-def sort_clinical_features(collection_df, df_lab_features):
+def sort_clinical_features(collection_df, lab_ontology):
     """  Sort clinical features based on the list of laboratory features.
          This function sorts the columns of the collection DataFrame based on 
-         the order of laboratory features and returns the sorted DataFrame. 
+         the canonical feature order of the lab ontology and returns the sorted DataFrame. 
     """
-    sorted_columns = ['patient_id'] + df_lab_features['lab_parameter'].tolist()
-    return collection_df.reindex(columns=sorted_columns)
+    return lab_ontology.sort_columns(collection_df, ['patient_id'])
 
 def normalize_df(df):
     """Normalize DataFrame values between 0 and 1"""
@@ -75,9 +86,16 @@ def replace_nan_empty(df):
     """Replace NaN or empty values with -1"""
     return df.fillna(-1)
 
-def main():
+def main(lab_format=None):
+    """
+    Builds the time series clinical matrices of the long covid patients.
+
+    Args:
+        lab_format (str): Output format of the extracted lab data ('csv', 'store' or 'sparse'). The format
+            recorded by the extractor is read when not given (see feature_sources).
+    """
     # Read the list of unique patient IDs
-    dir_path = '/data/01_multiomics/02_long_covid_study/04_lung_function_tests/03_FirstAnalysis/02_time_series_matrices/'
+    dir_path = LONG_COVID_STUDY_DIR + '04_lung_function_tests/03_FirstAnalysis/02_time_series_matrices/'
     filename = os.path.join(dir_path, '03_LongCovid_IDS_keys_clinical_data_OnlyLabDATA.csv')
     df = pd.read_csv(filename, sep=',', header=0)
 
@@ -90,21 +108,37 @@ def main():
     end_day = 8
 
      # Set path for lab data
-    dir_lab_path = '/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/06_clinical_data/lab_data_features/'
+    dir_lab_path = PATIENTOMICS_DATA_DIR + '06_clinical_data/lab_data_features/'
+
+    # Read all patients in one bulk read when the lab data was extracted to the feature store
+    ## The format recorded by the extractor, after checking it is not older than the patient CSV files
+    lab_format = resolve_feature_format(dir_lab_path, lab_format)
+    patient_frames = None
+    if lab_format == 'sparse':
+        ## The sparse store densifies only the selected day range
+        patient_frames = read_sparse_patient_frames(format_dir(dir_lab_path, 'sparse'), df['pseudoid_pid'].tolist(),
+                                                    init_day, end_day)
+    elif lab_format == 'store':
+        patient_frames = read_patient_frames(format_dir(dir_lab_path, 'store'), df['pseudoid_pid'].tolist())
+    else:
+        ## Otherwise the patient files are read on first access and kept in an LRU cache
+        patient_frames = PatientTimelines({'lab_data': dir_lab_path}).source_frames('lab_data')
 
 
     # Load the list of laboratory features
-    lab_features_filename = '/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/dicts/lab_parameter_grouping.csv'
-    df_lab_features = pd.read_csv(lab_features_filename, sep=',', header=0)
+    lab_features_filename = PATIENTOMICS_DATA_DIR + 'dicts/lab_parameter_grouping.csv'
+    lab_ontology = load_lab_ontology(lab_features_filename)
 
     # Iterate through the patient IDs
     for patient_id in df['pseudoid_pid']:
         try:
             # Read patient data
-            df_lab = read_patient_data(patient_id, dir_lab_path)
+            df_lab = read_patient_data(patient_id, dir_lab_path, patient_frames)
 
             # Get the row features from 'df_lab' for the selected day range
             df_lab_days = df_lab[df_lab['days'].between(init_day, end_day)].copy()
+            if df_lab_days.empty:
+                continue
 
             # Get the columns to impute
             columns_to_impute = df_lab_days.columns[2:-1].tolist()
@@ -121,6 +155,8 @@ def main():
 
     #######################################
     ## Concatenate all patient DataFrames into one
+    if not patient_dfs_imputed:
+        raise ValueError(f"No patient has lab data between day {init_day} and day {end_day}")
     collection_df_imputed = pd.concat(patient_dfs_imputed, ignore_index=True)
     collection_df_original = pd.concat(patient_dfs_original, ignore_index=True)
 
@@ -132,8 +168,8 @@ def main():
 
     #######################################
     ## Sort clinical features based on the list of laboratory features
-    collection_df_imputed_sorted = sort_clinical_features(collection_df_imputed, df_lab_features)
-    collection_df_original_sorted = sort_clinical_features(collection_df_original, df_lab_features)
+    collection_df_imputed_sorted = sort_clinical_features(collection_df_imputed, lab_ontology)
+    collection_df_original_sorted = sort_clinical_features(collection_df_original, lab_ontology)
 
     ## Save the time series clinical matrices to CSV files
     output_csv_path_imputed = os.path.join(dir_path, f'04_LongCovid_IDS_keys_clinical_data-{init_day}_to_{end_day}_imputed_sorted.csv')
@@ -0,0 +1,45 @@
+"""
+Alignment of the clinical events with the hospitalization timeline.
+
+The first admission date of every patient is computed with one grouped minimum over the timeline
+and joined to the events, so the day offsets of a whole extract are derived in a single vectorized
+step instead of filtering the timeline once per patient.
+"""
+
+import pandas as pd
+
+
+def first_admission_dates(hosp_timeline_data, id_column='pseudoid_pid', admission_column='date_admission_hosp'):
+    """
+    Returns the first hospital admission date of every patient.
+
+    Args:
+        hosp_timeline_data (pd.DataFrame): The hospitalization timeline with datetime admission dates.
+        id_column (str): Column with the patient id.
+        admission_column (str): Column with the admission date.
+
+    Returns:
+        pd.Series: First admission date indexed by patient id.
+    """
+    return hosp_timeline_data.groupby(id_column)[admission_column].min()
+
+
+def add_admission_days(df, hosp_timeline_data, date_column_name, id_column='pseudoid_pid', days_column='days',
+                       admission_column='date_admission_hosp'):
+    """
+    Adds the number of days between every event and the first admission of its patient.
+
+    Args:
+        df (pd.DataFrame): The events with datetime dates.
+        hosp_timeline_data (pd.DataFrame): The hospitalization timeline with datetime admission dates.
+        date_column_name (str): Column with the event dates.
+        id_column (str): Column with the patient id.
+        days_column (str): Name of the added column. Patients without admission get NaN.
+        admission_column (str): Column with the admission date in the timeline.
+
+    Returns:
+        pd.DataFrame: The events with the days column added.
+    """
+    first_hosp_dates = first_admission_dates(hosp_timeline_data, id_column, admission_column)
+    first_hosp_date = df[id_column].map(first_hosp_dates)
+    return df.assign(**{days_column: (df[date_column_name] - pd.to_datetime(first_hosp_date)).dt.days})
@@ -2,6 +2,12 @@
 import os
 import pandas as pd
 
+from feature_store import read_patient_frames
+from feature_sources import format_dir, resolve_feature_format
+from sparse_features import read_sparse_patient_frames
+from patient_timeline import PatientTimelines
+from data_paths import PATIENTOMICS_DATA_DIR
+
 def impute_missing_values(df_lab_selected_day, df_lab_days, columns_to_impute):
     """Function for data imputation using substitution method"""
     
@@ -30,12 +36,15 @@ def impute_missing_values(df_lab_selected_day, df_lab_days, columns_to_impute):
     
     return df_lab_selected_day, imputed_values
 
-def process_patient_data(patient_id, init_day, end_day, dir_lab_path):
-    """Process data for a single patient."""
+def process_patient_data(patient_id, init_day, end_day, dir_lab_path, patient_frames=None):
+    """Process data for a single patient, read from its CSV file or from the frames bulk-read from the feature store."""
     filename = os.path.join(dir_lab_path, f'patient_{patient_id}.csv')
     
     try:
-        df_lab = pd.read_csv(filename, sep=',', header=0)
+        if patient_frames is not None:
+            df_lab = patient_frames[patient_id]
+        else:
+            df_lab = pd.read_csv(filename, sep=',', header=0)
         df_lab_days = df_lab[df_lab['days'].between(init_day, end_day)].copy()
         columns_to_impute = df_lab_days.columns[2:-1].tolist()
         
@@ -62,8 +71,11 @@ def process_patient_data(patient_id, init_day, end_day, dir_lab_path):
 init_day = 0
 end_day = 60
 
+# Output format of the extracted lab data ('csv', 'store' or 'sparse'), None reads the format recorded by the extractor
+lab_format = None
+
 # Read the list of unique patient IDs
-dir_path = '/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/05_data_exploration/01_preprocessing_116_PLCP/'
+dir_path = PATIENTOMICS_DATA_DIR + '05_data_exploration/01_preprocessing_116_PLCP/'
 filename = os.path.join(dir_path, 'deceased_patients_pseudoid_pid.csv')
 df = pd.read_csv(filename, sep=',', header=0)
 
@@ -71,10 +83,24 @@ df = pd.read_csv(filename, sep=',', header=0)
 all_patient_dfs = []
 all_imputed_values = []
 
+# Read all patients in one bulk read when the lab data was extracted to the feature store
+dir_lab_path = PATIENTOMICS_DATA_DIR + '06_clinical_data/lab_data_features/'
+## The format recorded by the extractor, after checking it is not older than the patient CSV files
+lab_format = resolve_feature_format(dir_lab_path, lab_format)
+patient_frames = None
+if lab_format == 'sparse':
+    ## The sparse store densifies only the selected day range
+    patient_frames = read_sparse_patient_frames(format_dir(dir_lab_path, 'sparse'), df['pseudoid_pid'].tolist(),
+                                                init_day, end_day)
+elif lab_format == 'store':
+    patient_frames = read_patient_frames(format_dir(dir_lab_path, 'store'), df['pseudoid_pid'].tolist())
+else:
+    ## Otherwise the patient files are read on first access and kept in an LRU cache
+    patient_frames = PatientTimelines({'lab_data': dir_lab_path}).source_frames('lab_data')
+
 # Iterate through the patient IDs
 for patient_id in df['pseudoid_pid']:
-    dir_lab_path = '/home/jagh/Documents/01_UB/MultiOmiX/patientomics/data/06_clinical_data/lab_data_features/'
-    collection_df, imputed_values = process_patient_data(patient_id, init_day, end_day, dir_lab_path)
+    collection_df, imputed_values = process_patient_data(patient_id, init_day, end_day, dir_lab_path, patient_frames)
     
     if collection_df is not None:
         all_patient_dfs.append(collection_df)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+## The pipeline modules are imported by name from src/, like the scripts do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,67 @@
+import os
+import pandas as pd
+
+from patient_manifest import PatientManifest, patient_content_hashes, read_manifest
+
+
+def make_rows():
+    return pd.DataFrame({
+        'pseudoid_pid': [1, 1, 2, 2, 3],
+        'lab_name': ['CRP', 'Natrium', 'CRP', 'CRP', 'Glucose'],
+        'lab_req_date': pd.to_datetime(['2020-03-01', '2020-03-02', '2020-03-01', '2020-03-05', '2020-04-01']),
+        'lab_nval': [5.0, 140.0, 12.5, 8.0, 6.1],
+    })
+
+
+def write_outputs(output_dir, patient_ids):
+    for patient in patient_ids:
+        pd.DataFrame({'days': [0]}).to_csv(os.path.join(output_dir, f'patient_{patient}.csv'), index=False)
+
+
+def test_content_hashes_do_not_depend_on_row_order():
+    df = make_rows()
+    shuffled = df.sample(frac=1, random_state=0).reset_index(drop=True)
+    pd.testing.assert_series_equal(patient_content_hashes(df), patient_content_hashes(shuffled).sort_index())
+
+
+def test_content_hashes_detect_a_changed_value():
+    df = make_rows()
+    changed = df.copy()
+    changed.loc[2, 'lab_nval'] = 13.0
+
+    hashes, changed_hashes = patient_content_hashes(df), patient_content_hashes(changed)
+    assert hashes.index.tolist() == [1, 2, 3]
+    assert (hashes != changed_hashes).tolist() == [False, True, False]
+
+
+def test_unchanged_drop_in_another_order_selects_no_patient(tmp_path):
+    output_dir = str(tmp_path)
+    manifest = PatientManifest(output_dir)
+    assert manifest.select_changed(make_rows())['pseudoid_pid'].unique().tolist() == [1, 2, 3]
+    manifest.commit()
+    write_outputs(output_dir, [1, 2, 3])
+
+    manifest = PatientManifest(output_dir)
+    assert manifest.select_changed(make_rows().iloc[::-1]).empty
+    assert manifest.commit() == {'changed': 0, 'removed': 0}
+    assert sorted(os.listdir(output_dir)) == ['_manifest.parquet', 'patient_1.csv', 'patient_2.csv', 'patient_3.csv']
+
+
+def test_changed_and_removed_patients_are_recomputed_and_deleted(tmp_path):
+    output_dir = str(tmp_path)
+    manifest = PatientManifest(output_dir)
+    manifest.select_changed(make_rows())
+    manifest.commit()
+    write_outputs(output_dir, [1, 2, 3])
+
+    ## Patient 2 has a changed value, patient 3 left the drop
+    df = make_rows()
+    df.loc[3, 'lab_nval'] = 9.0
+    df = df[df['pseudoid_pid'] != 3]
+
+    manifest = PatientManifest(output_dir)
+    selected = manifest.select_changed(df)
+    assert selected['pseudoid_pid'].unique().tolist() == [2]
+    assert manifest.commit() == {'changed': 1, 'removed': 1}
+    assert sorted(os.listdir(output_dir)) == ['_manifest.parquet', 'patient_1.csv']
+    assert read_manifest(output_dir).index.tolist() == [1, 2]
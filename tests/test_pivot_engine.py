@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+from pivot_engine import aggregate_features, split_patient_matrices
+
+
+def make_rows():
+    return pd.DataFrame({
+        'pseudoid_pid': [2, 1, 1, 1, 1, 2, 2, 3],
+        'days': [5, 0, 3, 3, 0, 5, np.nan, 1],
+        'lab_name': pd.Categorical(['Natrium', 'CRP', 'Glucose', 'Glucose', 'Natrium', 'Natrium', 'CRP', 'CRP']),
+        'lab_nval': np.array([140.0, 6.935, 5.9, 6.1, np.nan, 138.5, 1.0, np.nan], dtype='float32'),
+    })
+
+
+def per_patient_pivot(df):
+    """Per-patient pivot of the float64 raw values, as the extraction did before the pivot engine."""
+    df = df[df['days'].notna()].astype({'days': 'int64', 'lab_name': 'str'})
+    ## The float64 values the raw strings parse to
+    df['lab_nval'] = df['lab_nval'].astype(str).astype('float64')
+    matrices = {}
+    for patient, patient_rows in df.groupby('pseudoid_pid'):
+        matrix = patient_rows.pivot_table(index='days', columns='lab_name', values='lab_nval', aggfunc='mean')
+        if matrix.empty:
+            continue
+        matrix.columns.name = None
+        matrices[patient] = matrix.reset_index()
+    return matrices
+
+
+def test_aggregate_features_means_per_patient_day_and_feature():
+    aggregated = aggregate_features(make_rows(), 'lab_name', 'lab_nval')
+
+    assert aggregated.index.names == ['pseudoid_pid', 'days', 'lab_name']
+    assert aggregated.dtype == 'float64'
+    ## The row without day and the missing values are dropped
+    assert aggregated.to_dict() == {
+        (1, 0, 'CRP'): 6.935,
+        (1, 3, 'Glucose'): (5.9 + 6.1) / 2,
+        (2, 5, 'Natrium'): (140.0 + 138.5) / 2,
+    }
+
+
+def test_split_patient_matrices_match_the_per_patient_pivot():
+    df = make_rows()
+    matrices = dict(split_patient_matrices(aggregate_features(df, 'lab_name', 'lab_nval')))
+    expected = per_patient_pivot(df)
+
+    assert list(matrices) == list(expected) == [1, 2]
+    for patient, matrix in matrices.items():
+        pd.testing.assert_frame_equal(matrix, expected[patient], check_exact=True)
+    ## The float32 values are written as their raw decimal, not as 6.9350004
+    assert matrices[1].to_csv(index=False) == 'days,CRP,Glucose\n0,6.935,\n3,,6.0\n'